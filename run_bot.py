@@ -38,7 +38,8 @@ def main():
 
     try:
         # Импортируем и запускаем
-        from tg_planer_aiogram.main import main as bot_main
+        # run_bot выбирает режим: один процесс или супервизор с воркерами (WORKERS)
+        from tg_planer_aiogram.main import run_bot as bot_main
         import asyncio
         asyncio.run(bot_main())
     except ImportError as e:
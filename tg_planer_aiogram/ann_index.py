@@ -0,0 +1,230 @@
+import os
+
+import numpy as np
+
+from vector_store import normalize_rows
+
+
+class _InvertedList:
+    """Векторы одного кластера: растущая матрица и массив id"""
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.size = 0
+        self.vectors = np.zeros((capacity, dim), dtype="float32")
+        self.ids = np.zeros(capacity, dtype="int64")
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> int:
+        """Добавляет строки в конец, возвращает номер первой из них"""
+        start = self.size
+        need = start + len(ids)
+        if need > len(self.ids):
+            capacity = max(need, 2 * len(self.ids))
+            grown = np.zeros((capacity, self.vectors.shape[1]), dtype="float32")
+            grown[:start] = self.vectors[:start]
+            self.vectors = grown
+            self.ids = np.concatenate([self.ids[:start], np.zeros(capacity - start, dtype="int64")])
+        self.vectors[start:need] = vectors
+        self.ids[start:need] = ids
+        self.size = need
+        return start
+
+    def remove_row(self, row: int) -> int | None:
+        """Удаляет строку переносом последней; возвращает id перенесённой"""
+        last = self.size - 1
+        moved = None
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.ids[row] = self.ids[last]
+            moved = int(self.ids[row])
+        self.size -= 1
+        return moved
+
+
+class IVFIndex:
+    """
+    Приближённый поиск ближайших соседей (IVF-Flat) по косинусному сходству.
+
+    Векторы нормируются и раскладываются по nlist кластерам k-means.
+    Запрос просматривает только nprobe ближайших кластеров: больше nprobe -
+    выше полнота (recall), но медленнее. До train() индекс работает как
+    точный перебор. Поддерживает добавление и удаление по id и
+    сохранение на диск в .npz.
+    """
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        self.centroids: np.ndarray | None = None
+        self._lists: list[_InvertedList] = [_InvertedList(dim)]
+        # id -> (номер списка, строка в нём)
+        self._where: dict[int, tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._where
+
+    @property
+    def nbytes(self) -> int:
+        lists = sum(inv.vectors.nbytes + inv.ids.nbytes for inv in self._lists)
+        return lists + (self.centroids.nbytes if self.centroids is not None else 0)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vectors: np.ndarray | None = None, iters: int = 20, seed: int = 0) -> None:
+        """
+        Обучает центроиды k-means на vectors (по умолчанию - на уже
+        добавленных векторах) и перераскладывает содержимое индекса
+        """
+        ids, current = self._export()
+        sample = normalize_rows(np.asarray(vectors, dtype="float32")) if vectors is not None else current
+        if len(sample) == 0:
+            raise ValueError("Нет векторов для обучения индекса")
+
+        rng = np.random.default_rng(seed)
+        nlist = min(self.nlist, len(sample))
+        # Для k-means достаточно нескольких сотен точек на кластер
+        if len(sample) > 256 * nlist:
+            sample = sample[rng.choice(len(sample), 256 * nlist, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            # Пустые кластеры переинициализируем случайными точками
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        self.centroids = centroids.astype("float32")
+        self._lists = [_InvertedList(self.dim) for _ in range(len(self.centroids))]
+        self._where = {}
+        if len(ids):
+            self._insert(ids, current)
+
+    def add(self, ids, vectors) -> None:
+        ids = np.asarray(ids, dtype="int64").reshape(-1)
+        vectors = normalize_rows(np.asarray(vectors, dtype="float32").reshape(len(ids), self.dim))
+        # Повторное добавление id заменяет вектор
+        self.remove([task_id for task_id in ids.tolist() if task_id in self._where])
+        self._insert(ids, vectors)
+
+    def _insert(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if self.centroids is None:
+            assign = np.zeros(len(ids), dtype="int64")
+        else:
+            assign = np.argmax(vectors @ self.centroids.T, axis=1)
+
+        for list_no in np.unique(assign):
+            mask = assign == list_no
+            list_ids = ids[mask]
+            start = self._lists[list_no].append(list_ids, vectors[mask])
+            for offset, task_id in enumerate(list_ids.tolist()):
+                self._where[task_id] = (int(list_no), start + offset)
+
+    def remove(self, ids) -> int:
+        removed = 0
+        for task_id in ids:
+            place = self._where.pop(int(task_id), None)
+            if place is None:
+                continue
+            list_no, row = place
+            moved = self._lists[list_no].remove_row(row)
+            if moved is not None:
+                self._where[moved] = (list_no, row)
+            removed += 1
+        return removed
+
+    def search(self, query: np.ndarray, k: int = 5, nprobe: int | None = None) -> list[tuple[float, int]]:
+        """k ближайших по косинусу: [(сходство, id)] по убыванию сходства"""
+        query = np.asarray(query, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        if self.centroids is None:
+            probe = [0]
+        else:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            centroid_scores = self.centroids @ query
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        all_scores, all_ids = [], []
+        for list_no in probe:
+            inv = self._lists[list_no]
+            if inv.size:
+                all_scores.append(inv.vectors[:inv.size] @ query)
+                all_ids.append(inv.ids[:inv.size])
+        if not all_scores:
+            return []
+
+        scores = np.concatenate(all_scores)
+        ids = np.concatenate(all_ids)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), int(ids[i])) for i in best]
+
+    def _export(self) -> tuple[np.ndarray, np.ndarray]:
+        ids = [inv.ids[:inv.size] for inv in self._lists]
+        vectors = [inv.vectors[:inv.size] for inv in self._lists]
+        return (
+            np.concatenate(ids) if ids else np.zeros(0, dtype="int64"),
+            np.concatenate(vectors) if vectors else np.zeros((0, self.dim), dtype="float32"),
+        )
+
+    def save(self, path: str) -> None:
+        """Атомарно сохраняет индекс в .npz (через временный файл)"""
+        sizes = np.array([inv.size for inv in self._lists], dtype="int64")
+        ids, vectors = self._export()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                params=np.array([self.dim, self.nlist, self.nprobe], dtype="int64"),
+                centroids=self.centroids if self.centroids is not None else np.zeros((0, self.dim), dtype="float32"),
+                sizes=sizes,
+                ids=ids,
+                vectors=vectors,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            dim, nlist, nprobe = (int(x) for x in data["params"])
+            index = cls(dim, nlist=nlist, nprobe=nprobe)
+            if len(data["centroids"]):
+                index.centroids = data["centroids"]
+            sizes, ids, vectors = data["sizes"], data["ids"], data["vectors"]
+
+        index._lists = []
+        start = 0
+        for list_no, size in enumerate(sizes.tolist()):
+            inv = _InvertedList(dim, capacity=max(16, size))
+            inv.append(ids[start:start + size], vectors[start:start + size])
+            index._lists.append(inv)
+            for row, task_id in enumerate(ids[start:start + size].tolist()):
+                index._where[task_id] = (list_no, row)
+            start += size
+        return index
+
+
+def build_user_index(ids: list[int], vectors: np.ndarray, nlist: int, nprobe: int) -> IVFIndex:
+    """
+    Обученный индекс задач одного пользователя. Кластеров около sqrt(n),
+    но не больше nlist: иначе в кластере оказывается по одной-две задачи
+    """
+    index = IVFIndex(vectors.shape[1], nlist=max(1, min(nlist, int(np.sqrt(len(ids))))), nprobe=nprobe)
+    index.add(ids, vectors)
+    index.train()
+    return index
@@ -5,3 +5,154 @@ import os
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 DB_NAME = 'planner.db'
 EMB_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# ---------------- ЗАПУСК ----------------
+
+# Способ получения апдейтов: "polling" (long polling) или "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+# Сколько апдейтов обрабатывается одновременно (остальные ждут очереди)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+# Сколько принятых по вебхуку апдейтов может ждать обработки; сверх этого
+# вебхук отвечает 503 и Telegram повторяет доставку позже (0 - без ограничения)
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+# Адрес и путь HTTP-сервера вебхука
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный https-адрес для регистрации вебхука в Telegram; пустой -
+# сервер только слушает (для локальной проверки tools/replay_updates.py)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (обязателен): 1-256 символов A-Z, a-z, 0-9, _ и -
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько соединений Telegram держит к вебхуку одновременно (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Сколько секунд дообрабатывать принятые апдейты при остановке
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "10"))
+# Процессов-воркеров: больше 1 - этот процесс только принимает апдейты
+# и раздаёт их воркерам по user_id (каждый пользователь - в одном воркере)
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Период пульса воркера и сколько секунд без пульса до его перезапуска
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "5"))
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "30"))
+# Сколько секунд ждать первого пульса нового воркера (импорт модулей, открытие БД)
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "120"))
+# Период отчёта о пропускной способности воркеров в лог, секунды
+WORKER_REPORT_INTERVAL = float(os.getenv("WORKER_REPORT_INTERVAL", "60"))
+# Сколько секунд воркеры дообрабатывают свои очереди при остановке
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "15"))
+
+# ---------------- ЭМБЕДДИНГИ ----------------
+
+# Движок: "sentence-transformers" (PyTorch), "onnx" (ONNX Runtime на CPU)
+# или "hashing" (хэширование слов без модели - для тестов и бенчмарков)
+EMB_BACKEND = os.getenv("EMB_BACKEND", "sentence-transformers")
+# ONNX-модель из tools/export_onnx.py (tokenizer.json лежит рядом)
+EMB_ONNX_PATH = os.getenv("EMB_ONNX_PATH", "models/minilm/model.onnx")
+# Динамическое квантование весов ONNX-модели в int8
+EMB_ONNX_QUANTIZE = os.getenv("EMB_ONNX_QUANTIZE", "1") == "1"
+# Размерность векторов движка hashing (как у модели, чтобы подходил файл векторов)
+EMB_HASH_DIM = int(os.getenv("EMB_HASH_DIM", "384"))
+
+# Где считаются эмбеддинги: "thread" - пул потоков, "process" - пул процессов
+# (в каждом процессе своя копия модели)
+EMB_EXECUTOR = os.getenv("EMB_EXECUTOR", "thread")
+EMB_WORKERS = int(os.getenv("EMB_WORKERS", "2"))
+# Микропакеты: максимум текстов в одном encode и окно ожидания попутчиков, мс
+EMB_BATCH_SIZE = int(os.getenv("EMB_BATCH_SIZE", "32"))
+EMB_BATCH_WAIT_MS = float(os.getenv("EMB_BATCH_WAIT_MS", "5"))
+# Кэш эмбеддингов: записей в памяти (LRU) и максимум строк в таблице emb_cache
+EMB_CACHE_SIZE = int(os.getenv("EMB_CACHE_SIZE", "5000"))
+EMB_CACHE_DB_MAX_ROWS = int(os.getenv("EMB_CACHE_DB_MAX_ROWS", "200000"))
+
+# ---------------- ПОИСК ----------------
+
+# Память под матрицы эмбеддингов пользователей (вытеснение по LRU), МБ
+SEARCH_MEMORY_BUDGET_MB = int(os.getenv("SEARCH_MEMORY_BUDGET_MB", "64"))
+# Сколько лучших по квантованным векторам задач пересчитывать точно (float32)
+SEARCH_RERANK_CANDIDATES = int(os.getenv("SEARCH_RERANK_CANDIDATES", "50"))
+# Режим /search: "vector" - векторы по всем задачам пользователя (матрица
+# в памяти, top-k через argpartition), "hybrid" - совпадения слов (FTS5,
+# BM25) и векторы только для кандидатов
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+# Кандидаты гибридного поиска: лучшие по BM25 и последние добавленные задачи
+SEARCH_FTS_CANDIDATES = int(os.getenv("SEARCH_FTS_CANDIDATES", "50"))
+SEARCH_RECENT_WINDOW = int(os.getenv("SEARCH_RECENT_WINDOW", "100"))
+# Константа reciprocal rank fusion: вклад выдачи = 1 / (SEARCH_RRF_K + место)
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
+# Приближённый поиск (IVF) в режиме vector: включается для пользователей,
+# у которых задач не меньше SEARCH_ANN_MIN_TASKS (0 - всегда точный перебор);
+# индекс у каждого пользователя свой, просматриваются NPROBE из NLIST кластеров
+SEARCH_ANN_MIN_TASKS = int(os.getenv("SEARCH_ANN_MIN_TASKS", "0"))
+SEARCH_ANN_NLIST = int(os.getenv("SEARCH_ANN_NLIST", "256"))
+SEARCH_ANN_NPROBE = int(os.getenv("SEARCH_ANN_NPROBE", "8"))
+
+# ---------------- СПИСКИ ЗАДАЧ ----------------
+
+# Память под кэш выборок /today, /week и /list (вытеснение по LRU), МБ
+TASK_CACHE_MEMORY_BUDGET_MB = int(os.getenv("TASK_CACHE_MEMORY_BUDGET_MB", "16"))
+# Задач на одной странице /list (листание кнопками «Назад» и «Далее»)
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "20"))
+
+# ---------------- СОСТОЯНИЯ ДИАЛОГОВ ----------------
+
+# Как часто изменения состояний диалогов (/add, /clear_all) пишутся в БД,
+# секунды, и после скольких накопленных изменений - сразу
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "200"))
+# Брошенный диалог удаляется через столько секунд после последнего шага
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 3600)))
+# Сколько секунд без обращений запись держится в памяти
+FSM_IDLE = float(os.getenv("FSM_IDLE", "900"))
+
+# ---------------- ХРАНИЛИЩЕ ВЕКТОРОВ ----------------
+
+# Доля удалённых записей в файле векторов, при которой он уплотняется
+VEC_COMPACT_RATIO = float(os.getenv("VEC_COMPACT_RATIO", "0.5"))
+# fsync после дозаписи вектора: без него сбой питания может оставить
+# недавние задачи без эмбеддинга
+VEC_FSYNC = os.getenv("VEC_FSYNC", "1") == "1"
+# Формат копии векторов для первого прохода поиска: "int8" (с масштабом
+# на вектор), "float16" или "float32" (без копии, поиск сразу точный)
+VEC_QUANT = os.getenv("VEC_QUANT", "int8")
+
+# ---------------- БАЗА ДАННЫХ ----------------
+
+# Количество соединений только для чтения в пуле
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Групповая фиксация: сколько изменений попадает в одну транзакцию и
+# сколько миллисекунд писатель ждёт попутчиков к первому (0 - не ждёт,
+# пачку составляют изменения, накопившиеся за время предыдущей транзакции)
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "64"))
+DB_WRITE_MAX_WAIT_MS = float(os.getenv("DB_WRITE_MAX_WAIT_MS", "0"))
+# Кэш подготовленных выражений sqlite3 на каждое соединение
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+# PRAGMA, применяемые к каждому соединению пула
+DB_PRAGMAS = {
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("DB_CACHE_SIZE", "-16000")),  # в КиБ, если < 0
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024))),
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", "5000")),  # мс
+}
+
+# ---------------- ФОНОВАЯ ОЧИСТКА ----------------
+
+# Период удаления просроченных задач, секунды
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "60"))
+# Максимум строк, удаляемых одной транзакцией
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "500"))
+
+# ---------------- НАПОМИНАНИЯ ----------------
+
+# Насколько вперёд (в секундах) задачи держатся в памяти планировщика
+REMINDER_HORIZON = int(os.getenv("REMINDER_HORIZON", str(24 * 3600)))
+
+# ---------------- ИСХОДЯЩИЕ СООБЩЕНИЯ ----------------
+
+# Общий лимит бота и лимит на один чат, сообщений в секунду
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+# Количество параллельных отправок и повторов при сетевых ошибках
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "5"))
+# Сколько секунд досылать очередь при остановке бота
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "5"))
@@ -1,46 +1,184 @@
-import aiosqlite
+import asyncio
 import logging
-from datetime import datetime
-from config import DB_NAME
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Callable
+
+import numpy as np
+
+from config import (
+    DB_NAME,
+    DB_PRAGMAS,
+    DB_READERS,
+    DB_STATEMENT_CACHE,
+    DB_WRITE_BATCH,
+    DB_WRITE_MAX_WAIT_MS,
+    EMB_CACHE_DB_MAX_ROWS,
+    SWEEP_BATCH_SIZE,
+    VEC_COMPACT_RATIO,
+    VEC_FSYNC,
+    VEC_QUANT,
+)
+from db_pool import ConnectionPool
+from embedding_backends import configured_version
+import migrations
+from vector_store import VectorStore, remove_stale_segments, segment_path
 
 log = logging.getLogger("planner_bot")
 
+_pool: ConnectionPool | None = None
+# Файл эмбеддингов задач текущего поколения (открывается в setup_db)
+_vectors: VectorStore | None = None
+# Квантованная копия с теми же слотами для первого прохода поиска
+# (None, если VEC_QUANT = "float32")
+_codes: VectorStore | None = None
+# Идёт уплотнение файла векторов в этом процессе: файлы нового поколения
+# подменит оно само
+_compacting = False
+
+# Подписчики на изменения задач: callback(event, user_id, **info).
+# События: insert, done, undo, delete, delete_all, expire, reembed.
+_listeners: list[Callable[..., None]] = []
+
+
+async def open_pool(path: str = DB_NAME) -> None:
+    """Открыть постоянные соединения с БД (вызывается при запуске бота)"""
+    global _pool
+    if _pool is not None and _pool.is_open:
+        return
+    _pool = ConnectionPool(
+        path,
+        readers=DB_READERS,
+        pragmas=DB_PRAGMAS,
+        cached_statements=DB_STATEMENT_CACHE,
+        batch_size=DB_WRITE_BATCH,
+        max_wait=DB_WRITE_MAX_WAIT_MS / 1000,
+    )
+    await _pool.open()
+
+
+async def close_pool() -> None:
+    """Закрыть соединения с БД (вызывается при остановке бота)"""
+    global _pool, _vectors, _codes
+    for store in (_vectors, _codes):
+        if store is not None:
+            store.close()
+    _vectors = _codes = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _get_pool() -> ConnectionPool:
+    if _pool is None or not _pool.is_open:
+        raise RuntimeError("Пул соединений не открыт: вызовите open_pool()")
+    return _pool
+
+
+def _get_vectors() -> VectorStore:
+    if _vectors is None:
+        raise RuntimeError("Файл векторов не открыт: вызовите setup_db() или attach_db()")
+    return _vectors
+
+
+def _append_vector(vec: np.ndarray) -> int:
+    """Дописывает вектор в оба файла (вызывается под блокировкой писателя)"""
+    global _codes
+    slot = _get_vectors().append(vec, VEC_FSYNC)[0]
+    if _codes is not None:
+        try:
+            # Квантованная копия производна от полной, её проверят при запуске
+            _codes.append(vec, sync=False)
+        except Exception as e:
+            log.error(f"Квантованные векторы отключены до перезапуска: {e}")
+            _codes.close()
+            _codes = None
+    return slot
+
+
+def add_listener(callback: Callable[..., None]) -> None:
+    """Подписаться на изменения задач (вызывается после фиксации транзакции)"""
+    _listeners.append(callback)
+
+
+def remove_listener(callback: Callable[..., None]) -> None:
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def _notify(event: str, user_id: int | None, **info) -> None:
+    for callback in list(_listeners):
+        try:
+            callback(event, user_id, **info)
+        except Exception as e:
+            log.error(f"Ошибка подписчика на событие {event}: {e}")
+
+
+async def _write(sql: str, params: tuple = ()) -> int:
+    """Одно выражение в общей транзакции записи; возвращает rowcount"""
+    async def op(db):
+        cur = await db.execute(sql, params)
+        return cur.rowcount
+
+    return await _get_pool().write(op)
+
+
+def _shard_params(shard: tuple[int, int]) -> tuple[int, int]:
+    """Параметры условия user_id % ? = ?: shard = (номер воркера, число воркеров)"""
+    index, workers = shard
+    return workers, index
+
+
+def due_timestamp(date_str: str, time_str: str) -> int:
+    """Срок задачи в секундах unix time (дата и время - локальные)"""
+    return int(datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M").timestamp())
+
+
+def current_minute_timestamp() -> int:
+    """Начало текущей минуты: задачи раньше него считаются просроченными"""
+    return int(datetime.now().replace(second=0, microsecond=0).timestamp())
+
+
+def _day_bounds(date_str: str) -> tuple[int, int]:
+    """Полуинтервал [начало дня, начало следующего дня) в unix time"""
+    start = datetime.strptime(date_str, "%Y-%m-%d")
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
 
 async def setup_db() -> None:
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                nickname TEXT
-            )
-            """
-        )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tasks (
-                id      INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                title   TEXT    NOT NULL,
-                date    TEXT    NOT NULL,
-                time    TEXT    NOT NULL,
-                status  TEXT    NOT NULL DEFAULT 'pending',
-                emb     BLOB,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """
-        )
-        await db.commit()
-    log.info("База данных инициализирована")
+    async with _get_pool().writer() as db:
+        version = await migrations.apply_migrations(db)
+    log.info(f"База данных инициализирована (версия схемы {version})")
+    await _open_vector_store()
+    await compact_vectors_if_needed()
+
+    for name, detail in await check_query_plans():
+        log.warning(f"Запрос {name} выполняет полный просмотр: {detail}")
+
+    purged = await trim_embedding_cache(configured_version(), EMB_CACHE_DB_MAX_ROWS)
+    if purged > 0:
+        log.info(f"Из кэша эмбеддингов удалено {purged} устаревших записей")
+
+
+async def attach_db() -> None:
+    """
+    Подключение процесса-воркера к уже подготовленной БД: миграции,
+    уплотнение и чистку кэша один раз выполнил супервизор в setup_db()
+    """
+    async with _get_pool().reader() as db:
+        version = await migrations.schema_version(db)
+    expected = migrations.MIGRATIONS[-1][0]
+    if version != expected:
+        raise RuntimeError(f"Версия схемы БД {version} вместо {expected}: нужен setup_db()")
+    await _open_vector_store()
 
 
 async def register_user(user_id: int, nickname: str | None) -> None:
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO users(user_id, nickname) VALUES (?, ?)",
-            (user_id, nickname),
-        )
-        await db.commit()
+    await _write(
+        "INSERT OR IGNORE INTO users(user_id, nickname) VALUES (?, ?)",
+        (user_id, nickname),
+    )
 
 
 async def insert_task(
@@ -48,68 +186,199 @@ async def insert_task(
     title: str,
     date_str: str,
     time_str: str,
-    emb_blob: bytes,
+    emb_blob: bytes | None,
+    emb_model: str | None = None,
 ) -> int:
-    async with aiosqlite.connect(DB_NAME) as db:
+    """Добавить задачу; emb_model - версия движка, которым посчитан эмбеддинг"""
+    due_at = due_timestamp(date_str, time_str)
+
+    async def op(db):
+        slot = await _store_vector(db, emb_blob)
         cur = await db.execute(
             """
-            INSERT INTO tasks(user_id, title, date, time, status, emb)
-            VALUES (?, ?, ?, ?, 'pending', ?)
+            INSERT INTO tasks(user_id, title, date, time, status, emb_slot, emb_model, due_at)
+            VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)
             """,
-            (user_id, title, date_str, time_str, emb_blob),
+            (user_id, title, date_str, time_str, slot, emb_model if slot is not None else None, due_at),
         )
-        await db.commit()
-        return cur.lastrowid
+        return cur.lastrowid, slot
+
+    task_id, slot = await _get_pool().write(op)
+    if slot is None:
+        emb_blob = emb_model = None
+    _notify(
+        "insert", user_id,
+        task_id=task_id, title=title, due_at=due_at, emb=emb_blob, emb_model=emb_model,
+    )
+    return task_id
+
+
+async def _lock_vector_store(db) -> None:
+    """
+    Открывает транзакцию записи (BEGIN IMMEDIATE), если она ещё не открыта,
+    и сверяет файлы векторов с БД. Блокировка записи SQLite общая для всех процессов, поэтому файлы
+    дописываются и уплотняются только под ней: процессы-воркеры не выдадут
+    один слот дважды. Под блокировкой подхватываются новое поколение и
+    записи, дописанные другими процессами.
+    """
+    if not db.in_transaction:
+        await db.execute("BEGIN IMMEDIATE")
+    cur = await db.execute("SELECT generation FROM vec_segment WHERE id = 1")
+    row = await cur.fetchone()
+    generation = row[0] if row else 0
+    if generation != _get_vectors().generation:
+        _switch_generation(generation)
+    await asyncio.to_thread(_refresh_vector_files)
+
+
+def _refresh_vector_files() -> None:
+    global _codes
+    vectors = _get_vectors()
+    vectors.refresh()
+    if _codes is None:
+        return
+    _codes.refresh()
+    if _codes.count < vectors.count:
+        # Процесс упал между дозаписью в полный файл и в копию
+        _codes.append(vectors.get(range(_codes.count, vectors.count)), sync=False)
+    elif _codes.count > vectors.count:
+        log.error("Квантованные векторы длиннее полных: копия отключена до перезапуска")
+        _codes.close()
+        _codes = None
+
+
+def _switch_generation(generation: int) -> None:
+    """Переоткрывает файлы векторов поколения generation (уплотнил другой процесс)"""
+    global _vectors, _codes
+    path = _get_pool().path
+    old = (_vectors, _codes)
+    _vectors = VectorStore(segment_path(path, generation), generation)
+    _vectors.open()
+    if _codes is not None:
+        _codes = VectorStore(segment_path(path, generation, "vecq"), generation, _codes.kind)
+        _codes.open()
+    for store in old:
+        if store is not None:
+            store.close()
+    log.info(f"Файл векторов переоткрыт: поколение {generation}")
+
+
+async def _store_vector(db, emb_blob: bytes | None) -> int | None:
+    """
+    Дописывает вектор в файл векторов (под блокировкой записи БД) и
+    возвращает слот. Вектор попадает на диск раньше, чем строка со ссылкой
+    на него; если запись строки не удастся, он останется «дырой» до уплотнения.
+    """
+    if emb_blob is None:
+        return None
+    await _lock_vector_store(db)
+    vec = np.frombuffer(emb_blob, dtype="float32")
+    try:
+        return await asyncio.to_thread(_append_vector, vec)
+    except ValueError as e:
+        # Движок с другой размерностью, чем у файла векторов
+        log.warning(f"Эмбеддинг не сохранён: {e}")
+        return None
+
+
+async def update_task_embedding(user_id: int, task_id: int, emb_blob: bytes, emb_model: str) -> int:
+    """Заменить эмбеддинг задачи (пересчёт другим движком)"""
+    async def op(db):
+        slot = await _store_vector(db, emb_blob)
+        if slot is None:
+            return 0
+        cur = await db.execute(
+            "UPDATE tasks SET emb_slot = ?, emb_model = ? WHERE id = ? AND user_id = ?",
+            (slot, emb_model, task_id, user_id),
+        )
+        return cur.rowcount
+
+    count = await _get_pool().write(op)
+    if count > 0:
+        _notify("reembed", user_id, task_id=task_id, emb=emb_blob, emb_model=emb_model)
+    return count
+
+
+_FETCH_TASKS_WITH_STALE_EMBEDDING_SQL = """
+    SELECT id, user_id, title
+    FROM tasks
+    WHERE id > ? AND emb_model IS NOT ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+
+async def fetch_tasks_with_stale_embedding(emb_model: str, after_id: int, limit: int):
+    """Задачи с id > after_id без эмбеддинга версии emb_model"""
+    async with _get_pool().reader() as db:
+        cur = await db.execute(_FETCH_TASKS_WITH_STALE_EMBEDDING_SQL, (after_id, emb_model, limit))
+        rows = await cur.fetchall()
+    return rows
+
+
+_FETCH_TASKS_FOR_DATE_SQL = """
+    SELECT id, title, time, status
+    FROM tasks
+    WHERE user_id = ? AND due_at >= ? AND due_at < ?
+      AND (status = 'done' OR due_at >= ?)
+    ORDER BY due_at
+"""
 
 
 async def fetch_tasks_for_date(user_id: int, date_str: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    day_start, day_end = _day_bounds(date_str)
+    async with _get_pool().reader() as db:
         cur = await db.execute(
-            """
-            SELECT id, title, time, status
-            FROM tasks
-            WHERE user_id = ? AND date = ?
-            ORDER BY time
-            """,
-            (user_id, date_str),
+            _FETCH_TASKS_FOR_DATE_SQL,
+            (user_id, day_start, day_end, current_minute_timestamp()),
         )
         rows = await cur.fetchall()
     return rows
 
 
+_FETCH_TASKS_FOR_DATES_SQL = """
+    SELECT id, title, date, time, status
+    FROM tasks
+    WHERE user_id = ? AND due_at >= ? AND due_at < ? AND date IN ({placeholders})
+      AND (status = 'done' OR due_at >= ?)
+    ORDER BY due_at
+"""
+
+
 async def fetch_tasks_for_dates(user_id: int, date_list: list[str]):
     """Получить задачи для нескольких дат"""
+    if not date_list:
+        return []
+    # Индекс читается одним диапазоном от первой до последней даты,
+    # а IN лишь отсеивает пропущенные дни внутри диапазона
+    range_start, _ = _day_bounds(min(date_list))
+    _, range_end = _day_bounds(max(date_list))
     placeholders = ','.join('?' * len(date_list))
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _get_pool().reader() as db:
         cur = await db.execute(
-            f"""
-            SELECT id, title, date, time, status
-            FROM tasks
-            WHERE user_id = ? AND date IN ({placeholders})
-            ORDER BY date, time
-            """,
-            (user_id, *date_list),
+            _FETCH_TASKS_FOR_DATES_SQL.format(placeholders=placeholders),
+            (user_id, range_start, range_end, *date_list, current_minute_timestamp()),
         )
         rows = await cur.fetchall()
     return rows
 
 
 async def mark_task_done(user_id: int, task_id: int) -> int:
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
-            """
-            UPDATE tasks
-            SET status = 'done'
-            WHERE id = ? AND user_id = ?
-            """,
-            (task_id, user_id),
-        )
-        await db.commit()
-        return cur.rowcount
+    count = await _write(
+        """
+        UPDATE tasks
+        SET status = 'done'
+        WHERE id = ? AND user_id = ?
+        """,
+        (task_id, user_id),
+    )
+    if count > 0:
+        _notify("done", user_id, task_id=task_id)
+    return count
 
 
 async def mark_task_undo(user_id: int, task_id: int) -> int:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async def op(db):
         cur = await db.execute(
             """
             UPDATE tasks
@@ -118,112 +387,614 @@ async def mark_task_undo(user_id: int, task_id: int) -> int:
             """,
             (task_id, user_id),
         )
-        await db.commit()
-        return cur.rowcount
+        count = cur.rowcount
+        # Для повторного напоминания подписчикам нужны название и срок
+        cur = await db.execute("SELECT title, due_at FROM tasks WHERE id = ?", (task_id,))
+        return count, await cur.fetchone()
+
+    count, row = await _get_pool().write(op)
+    if count > 0 and row:
+        _notify("undo", user_id, task_id=task_id, title=row[0], due_at=row[1])
+    return count
 
 
 async def delete_task(user_id: int, task_id: int) -> int:
     """Удалить задачу"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
-            """
-            DELETE FROM tasks
-            WHERE id = ? AND user_id = ?
-            """,
-            (task_id, user_id),
-        )
-        await db.commit()
-        return cur.rowcount
+    count = await _write(
+        """
+        DELETE FROM tasks
+        WHERE id = ? AND user_id = ?
+        """,
+        (task_id, user_id),
+    )
+    if count > 0:
+        _notify("delete", user_id, task_id=task_id)
+    return count
+
+
+# Номер задачи N - её место в общем списке /list (см. _FETCH_ALL_TASKS_SQL):
+# окно номеров читается по индексу (user_id, due_at) без выборки всего списка
+MAX_TASK_NUMBER = 10**9
+_RESOLVE_TASK_NUMBERS_SQL = """
+    SELECT id, title, due_at
+    FROM tasks
+    WHERE user_id = ? AND (status = 'done' OR due_at >= ?)
+    ORDER BY due_at ASC, id ASC
+    LIMIT ? OFFSET ?
+"""
+
+
+async def _resolve_task_numbers(db, user_id: int, numbers: list[int]) -> dict[int, tuple]:
+    """Номера задач -> (id, название, срок); несуществующие номера пропускаются"""
+    # Таких задач нет, а в LIMIT/OFFSET огромное число не поместится
+    numbers = [n for n in numbers if 1 <= n <= MAX_TASK_NUMBER]
+    if not numbers:
+        return {}
+    first, last = min(numbers), max(numbers)
+    cur = await db.execute(
+        _RESOLVE_TASK_NUMBERS_SQL,
+        (user_id, current_minute_timestamp(), last - first + 1, first - 1),
+    )
+    rows = await cur.fetchall()
+    return {n: rows[n - first] for n in numbers if n - first < len(rows)}
+
+
+async def _update_by_numbers(user_id: int, numbers: list[int], sql: str) -> dict[int, tuple]:
+    """
+    Находит задачи по номерам и применяет к ним sql (параметры - id и
+    user_id) одним executemany в одной транзакции: номера не успеют
+    сдвинуться между поиском и изменением
+    """
+    async def op(db):
+        found = await _resolve_task_numbers(db, user_id, numbers)
+        if found:
+            await db.executemany(sql, [(row[0], user_id) for row in found.values()])
+        return found
+
+    return await _get_pool().write(op)
+
+
+async def mark_done_by_numbers(user_id: int, numbers: list[int]) -> list[int]:
+    """Отметить выполненными задачи с номерами numbers; возвращает найденные номера"""
+    found = await _update_by_numbers(
+        user_id, numbers, "UPDATE tasks SET status = 'done' WHERE id = ? AND user_id = ?"
+    )
+    for task_id, _, _ in found.values():
+        _notify("done", user_id, task_id=task_id)
+    return sorted(found)
+
+
+async def mark_undo_by_numbers(user_id: int, numbers: list[int]) -> list[int]:
+    """Вернуть в работу задачи с номерами numbers; возвращает найденные номера"""
+    found = await _update_by_numbers(
+        user_id, numbers, "UPDATE tasks SET status = 'pending' WHERE id = ? AND user_id = ?"
+    )
+    for task_id, title, due_at in found.values():
+        _notify("undo", user_id, task_id=task_id, title=title, due_at=due_at)
+    return sorted(found)
+
+
+async def delete_by_numbers(user_id: int, numbers: list[int]) -> list[int]:
+    """Удалить задачи с номерами numbers; возвращает найденные номера"""
+    found = await _update_by_numbers(
+        user_id, numbers, "DELETE FROM tasks WHERE id = ? AND user_id = ?"
+    )
+    for task_id, _, _ in found.values():
+        _notify("delete", user_id, task_id=task_id)
+    return sorted(found)
+
+
+_TASKS_FOR_EXACT_DATETIME_SQL = """
+    SELECT id, user_id, title
+    FROM tasks
+    WHERE status = 'pending' AND due_at = ?
+"""
 
 
 async def tasks_for_exact_datetime(date_str: str, time_str: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _get_pool().reader() as db:
         cur = await db.execute(
-            """
-            SELECT id, user_id, title
-            FROM tasks
-            WHERE date = ? AND time = ? AND status = 'pending'
-            """,
-            (date_str, time_str),
+            _TASKS_FOR_EXACT_DATETIME_SQL, (due_timestamp(date_str, time_str),)
         )
         rows = await cur.fetchall()
     return rows
 
 
-async def load_tasks_with_vectors(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+_FETCH_PENDING_DUE_BETWEEN_SQL = """
+    SELECT id, user_id, title, due_at
+    FROM tasks
+    WHERE status = 'pending' AND due_at >= ? AND due_at < ?
+      AND user_id % ? = ?
+    ORDER BY due_at
+"""
+
+
+async def fetch_pending_due_between(start_ts: int, end_ts: int, shard: tuple[int, int] = (0, 1)):
+    """
+    Невыполненные задачи со сроком в полуинтервале [start_ts, end_ts);
+    shard = (номер, всего) оставляет пользователей одного воркера
+    """
+    async with _get_pool().reader() as db:
         cur = await db.execute(
-            "SELECT id, title, emb FROM tasks WHERE user_id = ?",
-            (user_id,),
+            _FETCH_PENDING_DUE_BETWEEN_SQL, (start_ts, end_ts, *_shard_params(shard))
         )
         rows = await cur.fetchall()
     return rows
 
 
+# Поколение читается тем же запросом, что и слоты, - из одного снимка БД
+_LOAD_TASKS_WITH_VECTORS_SQL = """
+    SELECT id, title, emb_slot, (SELECT generation FROM vec_segment WHERE id = 1)
+    FROM tasks
+    WHERE user_id = ? AND emb_slot IS NOT NULL AND emb_model = ?
+"""
+
+
+async def _fetch_slots(sql: str, params: tuple) -> list:
+    """
+    Строки (..., слот, поколение), согласованные с открытым файлом векторов.
+    Если запрос прочитал слоты другого поколения (шло уплотнение), он
+    повторяется; более новое поколение от другого процесса открывается.
+    """
+    while True:
+        async with _get_pool().reader() as db:
+            cur = await db.execute(sql, params)
+            rows = await cur.fetchall()
+        if not rows or rows[0][-1] == _get_vectors().generation:
+            return rows
+        if rows[0][-1] > _get_vectors().generation and not _compacting:
+            _switch_generation(rows[0][-1])
+            continue
+        await asyncio.sleep(0)
+
+
+async def load_tasks_with_vectors(
+    user_id: int,
+    emb_model: str,
+    quantized: bool = False,
+) -> tuple[list[int], list[str], np.ndarray]:
+    """
+    Задачи пользователя с эмбеддингами версии emb_model: id, названия и
+    матрица векторов. С quantized=True матрица берётся из квантованного файла как есть
+    (int8 без масштаба или float16) - годится для косинуса, но не для
+    абсолютных значений.
+    """
+    rows = await _fetch_slots(_LOAD_TASKS_WITH_VECTORS_SQL, (user_id, emb_model))
+    ids = [row[0] for row in rows]
+    titles = [row[1] for row in rows]
+    slots = [row[2] for row in rows]
+    if quantized and _codes is not None:
+        return ids, titles, np.ascontiguousarray(_codes.get_records(slots)["vec"])
+    return ids, titles, _get_vectors().get(slots)
+
+
+_LOAD_VECTORS_SQL = """
+    SELECT id, emb_slot, (SELECT generation FROM vec_segment WHERE id = 1)
+    FROM tasks
+    WHERE id IN ({placeholders}) AND user_id = ? AND emb_slot IS NOT NULL AND emb_model = ?
+"""
+
+
+async def load_vectors(
+    user_id: int,
+    task_ids: list[int],
+    emb_model: str,
+) -> tuple[list[int], np.ndarray]:
+    """Точные векторы float32 выбранных задач (кандидатов поиска)"""
+    if not task_ids:
+        return [], np.zeros((0, _get_vectors().dim), dtype="float32")
+    rows = await _fetch_slots(
+        _LOAD_VECTORS_SQL.format(placeholders=",".join("?" * len(task_ids))),
+        (*task_ids, user_id, emb_model),
+    )
+    return [row[0] for row in rows], _get_vectors().get([row[1] for row in rows])
+
+
+def fts_query(user_id: int, text: str) -> str | None:
+    """
+    Выражение MATCH для FTS5: задачи пользователя, в названии которых есть
+    любое слово запроса. Слова обрезаются до основы и ищутся по префиксу,
+    чтобы «продукты» находило «продуктов» (грубая замена стеммингу).
+    """
+    terms = []
+    for word in re.findall(r"\w+", text.casefold().replace("ё", "е")):
+        if len(word) < 2:
+            continue
+        stem = word[:max(4, len(word) - 2)]
+        terms.append(f'"{stem}"*')
+    if not terms:
+        return None
+    return f'owner:"u{user_id}" AND ({" OR ".join(dict.fromkeys(terms))})'
+
+
+_SEARCH_TITLES_SQL = """
+    SELECT t.id, t.title
+    FROM tasks_fts
+    JOIN tasks AS t ON t.id = tasks_fts.rowid
+    WHERE tasks_fts MATCH ?
+    ORDER BY bm25(tasks_fts, 1.0, 0.0)
+    LIMIT ?
+"""
+
+
+async def search_titles(user_id: int, text: str, limit: int) -> list[tuple[int, str]]:
+    """Задачи пользователя по словам запроса (FTS5), от лучших по BM25"""
+    query = fts_query(user_id, text)
+    if query is None:
+        return []
+    async with _get_pool().reader() as db:
+        cur = await db.execute(_SEARCH_TITLES_SQL, (query, limit))
+        rows = await cur.fetchall()
+    return rows
+
+
+_RECENT_TASKS_SQL = """
+    SELECT id, title
+    FROM tasks
+    WHERE user_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+
+async def recent_tasks(user_id: int, limit: int) -> list[tuple[int, str]]:
+    """Последние добавленные задачи пользователя"""
+    async with _get_pool().reader() as db:
+        cur = await db.execute(_RECENT_TASKS_SQL, (user_id, limit))
+        rows = await cur.fetchall()
+    return rows
+
+
+def vector_store_stats() -> dict:
+    stats = {"vectors": _vectors.count if _vectors else 0}
+    for name, store in (("full", _vectors), ("quantized", _codes)):
+        if store is not None:
+            stats[f"{name}_kind"] = store.kind
+            stats[f"{name}_bytes"] = store.nbytes
+    return stats
+
+
+def _requantize(full: VectorStore, path: str, kind: str) -> VectorStore:
+    """Строит квантованную копию полного файла векторов"""
+    codes = VectorStore(path, full.generation, kind)
+    codes.create(full.dim)
+    for start in range(0, full.count, 10_000):
+        codes.append(full.get(range(start, min(full.count, start + 10_000))), sync=False)
+    codes.sync()
+    return codes
+
+
+async def _open_vector_store() -> None:
+    global _vectors, _codes
+    pool = _get_pool()
+    # Под блокировкой записи: другие процессы в это время не дописывают файлы
+    async with pool.writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT generation FROM vec_segment WHERE id = 1")
+        row = await cur.fetchone()
+        generation = row[0] if row else 0
+
+        for store in (_vectors, _codes):
+            if store is not None:
+                store.close()
+        _vectors = VectorStore(segment_path(pool.path, generation), generation)
+        _vectors.open()
+
+        _codes = None
+        if VEC_QUANT != "float32":
+            path = segment_path(pool.path, generation, "vecq")
+            codes = VectorStore(path, generation, VEC_QUANT)
+            codes.open()
+            # Копия отстала после сбоя или сменился формат - перестраиваем
+            if codes.kind != VEC_QUANT or codes.count != _vectors.count or codes.dim != _vectors.dim:
+                codes.close()
+                log.info(f"Квантование {_vectors.count} векторов в формат {VEC_QUANT}")
+                codes = await asyncio.to_thread(_requantize, _vectors, path, VEC_QUANT)
+            _codes = codes
+
+        keep = [store.path for store in (_vectors, _codes) if store is not None]
+        remove_stale_segments(pool.path, generation, keep)
+
+        # Слоты за концом файла возможны, только если дозапись без fsync
+        # потерялась при сбое: такие задачи остаются без эмбеддинга
+        cur = await db.execute(
+            "UPDATE tasks SET emb_slot = NULL WHERE emb_slot >= ?", (_vectors.count,)
+        )
+        await db.commit()
+    if cur.rowcount > 0:
+        log.warning(f"Файл векторов короче ожидаемого: {cur.rowcount} задач без эмбеддинга")
+
+
+async def compact_vectors() -> int:
+    """
+    Переписывает живые векторы в файл следующего поколения.
+    Слоты и номер поколения меняются одной транзакцией, поэтому при
+    сбое остаётся согласованной либо старая, либо новая пара.
+    Возвращает количество освобождённых записей.
+    """
+    global _vectors, _codes, _compacting
+    pool = _get_pool()
+
+    async with pool.writer() as db:
+        await _lock_vector_store(db)
+        old = _get_vectors()
+        cur = await db.execute(
+            "SELECT id, emb_slot FROM tasks WHERE emb_slot IS NOT NULL ORDER BY emb_slot"
+        )
+        rows = await cur.fetchall()
+
+        generation = old.generation + 1
+        new = VectorStore(segment_path(pool.path, generation), generation)
+        new_codes = None
+        if _codes is not None:
+            new_codes = VectorStore(segment_path(pool.path, generation, "vecq"), generation, _codes.kind)
+        _compacting = True
+        try:
+            new.create(old.dim)
+            if new_codes is not None:
+                new_codes.create(old.dim)
+            slots = [slot for _, slot in rows]
+            for start in range(0, len(slots), 10_000):
+                chunk = old.get(slots[start:start + 10_000])
+                await asyncio.to_thread(new.append, chunk, False)
+                if new_codes is not None:
+                    await asyncio.to_thread(new_codes.append, chunk, False)
+            await asyncio.to_thread(new.sync)
+
+            await db.executemany(
+                "UPDATE tasks SET emb_slot = ? WHERE id = ?",
+                [(new_slot, task_id) for new_slot, (task_id, _) in enumerate(rows)],
+            )
+            await db.execute(
+                "INSERT OR REPLACE INTO vec_segment(id, generation) VALUES (1, ?)",
+                (generation,),
+            )
+            await db.commit()
+        except BaseException:
+            _compacting = False
+            for store in (new, new_codes):
+                if store is not None:
+                    store.close()
+                    os.remove(store.path)
+            raise
+
+        old_codes = _codes
+        _vectors, _codes = new, new_codes
+        _compacting = False
+
+    freed = old.count - new.count
+    for store in (old, old_codes):
+        if store is not None:
+            store.close()
+    keep = [store.path for store in (new, new_codes) if store is not None]
+    remove_stale_segments(pool.path, generation, keep)
+    log.info(f"Файл векторов уплотнён: освобождено {freed} записей, осталось {new.count}")
+    return freed
+
+
+async def compact_vectors_if_needed(min_dead_ratio: float = VEC_COMPACT_RATIO) -> int:
+    """Уплотняет файл векторов, если доля удалённых записей не меньше min_dead_ratio"""
+    store = _get_vectors()
+    if store.count == 0:
+        return 0
+    async with _get_pool().reader() as db:
+        cur = await db.execute("SELECT COUNT(emb_slot) FROM tasks")
+        row = await cur.fetchone()
+    dead = store.count - (row[0] if row else 0)
+    if dead <= 0 or dead / store.count < min_dead_ratio:
+        return 0
+    return await compact_vectors()
+
+
+_FETCH_ALL_TASKS_SQL = """
+    SELECT id, title, date, time, status
+    FROM tasks
+    WHERE user_id = ? AND (status = 'done' OR due_at >= ?)
+    ORDER BY due_at ASC, id ASC
+    LIMIT ?
+"""
+
+
 async def fetch_all_tasks(user_id: int, limit: int = 50):
     """Получить все задачи пользователя (с лимитом для производительности)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _get_pool().reader() as db:
         cur = await db.execute(
-            """
-            SELECT id, title, date, time, status
-            FROM tasks
-            WHERE user_id = ?
-            ORDER BY date ASC, time ASC
-            LIMIT ?
-            """,
-            (user_id, limit),
+            _FETCH_ALL_TASKS_SQL, (user_id, current_minute_timestamp(), limit)
         )
         rows = await cur.fetchall()
     return rows
 
 
-async def delete_expired_tasks() -> int:
-    """Удалить все просроченные задачи (старше текущего момента)"""
-    current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M")
-    async with aiosqlite.connect(DB_NAME) as db:
+# Страницы /list: поиск по ключу (due_at, id) вместо OFFSET - страница
+# читается одним диапазоном индекса (user_id, due_at) с любого места списка
+_FETCH_TASKS_PAGE_SQL = """
+    SELECT id, due_at, title, date, time, status
+    FROM tasks
+    WHERE user_id = ? AND (due_at, id) {op} (?, ?)
+      AND (status = 'done' OR due_at >= ?)
+    ORDER BY due_at {order}, id {order}
+    LIMIT ?
+"""
+_FETCH_TASKS_PAGE_AFTER_SQL = _FETCH_TASKS_PAGE_SQL.format(op=">", order="ASC")
+_FETCH_TASKS_PAGE_BEFORE_SQL = _FETCH_TASKS_PAGE_SQL.format(op="<", order="DESC")
+
+
+async def fetch_tasks_page(
+    user_id: int,
+    cursor: tuple[int, int] | None,
+    limit: int,
+    backward: bool = False,
+):
+    """
+    Страница списка задач в порядке (due_at, id): limit задач после
+    cursor = (due_at, id) или, с backward=True, перед ним.
+    Без cursor - первая страница. Строки: id, due_at, title, date, time, status
+    """
+    if cursor is None:
+        cursor, backward = (-1, 0), False
+    sql = _FETCH_TASKS_PAGE_BEFORE_SQL if backward else _FETCH_TASKS_PAGE_AFTER_SQL
+    async with _get_pool().reader() as db:
+        cur = await db.execute(sql, (user_id, *cursor, current_minute_timestamp(), limit))
+        rows = await cur.fetchall()
+    if backward:
+        rows.reverse()
+    return rows
+
+
+_SELECT_EXPIRED_TASKS_SQL = """
+    SELECT id, user_id
+    FROM tasks
+    WHERE status = 'pending' AND due_at < ? AND user_id % ? = ?
+    LIMIT ?
+"""
+
+
+async def delete_expired_tasks(batch_size: int = SWEEP_BATCH_SIZE, shard: tuple[int, int] = (0, 1)) -> int:
+    """
+    Удалить все просроченные задачи (старше текущего момента);
+    shard = (номер, всего) - только задачи пользователей одного воркера
+    """
+    current_minute = current_minute_timestamp()
+    deleted_count = 0
+
+    # Удаляем пачками по отдельной транзакции, чтобы не держать
+    # блокировку записи долго и пропускать между пачками другие запросы
+    async def op(db):
         cur = await db.execute(
-            """
-            DELETE FROM tasks
-            WHERE (date || ' ' || time) < ? AND status = 'pending'
-            """,
-            (current_datetime,),
+            _SELECT_EXPIRED_TASKS_SQL, (current_minute, *_shard_params(shard), batch_size)
         )
-        deleted_count = cur.rowcount
-        await db.commit()
-    return deleted_count
+        rows = await cur.fetchall()
+        if rows:
+            await db.executemany(
+                "DELETE FROM tasks WHERE id = ?",
+                [(task_id,) for task_id, _ in rows],
+            )
+        return rows
+
+    while True:
+        rows = await _get_pool().write(op)
+
+        # Подписчикам сообщаем, какие задачи каких пользователей исчезли
+        expired_by_user: dict[int, list[int]] = {}
+        for task_id, user_id in rows:
+            expired_by_user.setdefault(user_id, []).append(task_id)
+        for user_id, task_ids in expired_by_user.items():
+            _notify("expire", user_id, task_ids=task_ids)
+
+        deleted_count += len(rows)
+        if len(rows) < batch_size:
+            return deleted_count
+        await asyncio.sleep(0)
 
 
 async def delete_all_tasks(user_id: int) -> int:
     """Удалить все задачи пользователя"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async def op(db):
+        # id нужны подписчикам, которые индексируют задачи не по пользователю
+        cur = await db.execute("SELECT id FROM tasks WHERE user_id = ?", (user_id,))
+        task_ids = [row[0] for row in await cur.fetchall()]
         cur = await db.execute(
             "DELETE FROM tasks WHERE user_id = ?",
             (user_id,),
         )
         deleted_count = cur.rowcount
-        await db.commit()
 
         # Сбрасываем autoincrement счетчик
         await db.execute("DELETE FROM sqlite_sequence WHERE name='tasks'")
-        await db.commit()
+        return task_ids, deleted_count
 
+    task_ids, deleted_count = await _get_pool().write(op)
+    _notify("delete_all", user_id, task_ids=task_ids)
     return deleted_count
 
 
-async def count_user_tasks(user_id: int) -> int:
-    """Посчитать количество задач пользователя"""
-    async with aiosqlite.connect(DB_NAME) as db:
+_COUNT_USER_TASKS_SQL = "SELECT COUNT(*) FROM tasks WHERE user_id = ?"
+
+
+async def load_cached_embedding(model: str, text: str) -> bytes | None:
+    async with _get_pool().reader() as db:
         cur = await db.execute(
-            "SELECT COUNT(*) FROM tasks WHERE user_id = ?",
-            (user_id,),
+            "SELECT emb FROM emb_cache WHERE model = ? AND text = ?",
+            (model, text),
         )
         row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def store_cached_embedding(model: str, text: str, emb_blob: bytes) -> None:
+    await _write(
+        "INSERT OR IGNORE INTO emb_cache(model, text, emb) VALUES (?, ?, ?)",
+        (model, text, emb_blob),
+    )
+
+
+async def trim_embedding_cache(model: str, max_rows: int) -> int:
+    """Удалить записи других моделей и самые старые записи сверх max_rows"""
+    async def op(db):
+        cur = await db.execute("DELETE FROM emb_cache WHERE model != ?", (model,))
+        deleted_count = cur.rowcount
+        cur = await db.execute(
+            "DELETE FROM emb_cache WHERE rowid <= (SELECT MAX(rowid) FROM emb_cache) - ?",
+            (max_rows,),
+        )
+        return deleted_count + cur.rowcount
+
+    return await _get_pool().write(op)
+
+
+_LOAD_FSM_RECORD_SQL = "SELECT state, data, updated_at FROM fsm_state WHERE key = ?"
+_DELETE_STALE_FSM_RECORDS_SQL = "DELETE FROM fsm_state WHERE updated_at < ?"
+
+
+async def load_fsm_record(key: str) -> tuple[str | None, str, int] | None:
+    """Состояние, данные (JSON) и время изменения диалога по ключу хранилища FSM"""
+    async with _get_pool().reader() as db:
+        cur = await db.execute(_LOAD_FSM_RECORD_SQL, (key,))
+        row = await cur.fetchone()
+    return tuple(row) if row else None
+
+
+async def save_fsm_records(
+    upserts: list[tuple[str, str | None, str, int]],
+    deletes: list[str],
+) -> None:
+    """
+    Записать пачку изменений FSM одной транзакцией:
+    upserts - (ключ, состояние, данные JSON, время изменения), deletes - ключи
+    завершённых диалогов
+    """
+    async def op(db):
+        if upserts:
+            await db.executemany(
+                """
+                INSERT INTO fsm_state(key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+        if deletes:
+            await db.executemany("DELETE FROM fsm_state WHERE key = ?", [(key,) for key in deletes])
+
+    await _get_pool().write(op)
+
+
+async def delete_stale_fsm_records(before: int) -> int:
+    """Удалить диалоги, не менявшиеся с момента before (unix time)"""
+    return await _write(_DELETE_STALE_FSM_RECORDS_SQL, (before,))
+
+
+async def count_user_tasks(user_id: int) -> int:
+    """Посчитать количество задач пользователя"""
+    async with _get_pool().reader() as db:
+        cur = await db.execute(_COUNT_USER_TASKS_SQL, (user_id,))
+        row = await cur.fetchone()
     return row[0] if row else 0
 
 
 async def reset_task_ids() -> None:
     """Сбросить autoincrement счетчик ID задач"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async def op(db):
         # Получить максимальный ID
         cur = await db.execute("SELECT MAX(id) FROM tasks")
         max_id_row = await cur.fetchone()
@@ -239,4 +1010,38 @@ async def reset_task_ids() -> None:
                 (max_id,)
             )
 
-        await db.commit()
+    await _get_pool().write(op)
+
+
+# Типичные формы запросов (с фиктивными параметрами) для проверки планов
+QUERY_SHAPES = {
+    "fetch_tasks_for_date": (_FETCH_TASKS_FOR_DATE_SQL, (0, 0, 0, 0)),
+    "fetch_tasks_for_dates": (
+        _FETCH_TASKS_FOR_DATES_SQL.format(placeholders=",".join("?" * 7)),
+        (0, 0, 0, *[""] * 7, 0),
+    ),
+    "fetch_all_tasks": (_FETCH_ALL_TASKS_SQL, (0, 0, 50)),
+    "resolve_task_numbers": (_RESOLVE_TASK_NUMBERS_SQL, (0, 0, 1, 0)),
+    "fetch_tasks_page_after": (_FETCH_TASKS_PAGE_AFTER_SQL, (0, 0, 0, 0, 21)),
+    "fetch_tasks_page_before": (_FETCH_TASKS_PAGE_BEFORE_SQL, (0, 0, 0, 0, 21)),
+    "count_user_tasks": (_COUNT_USER_TASKS_SQL, (0,)),
+    "load_tasks_with_vectors": (_LOAD_TASKS_WITH_VECTORS_SQL, (0, "")),
+    "fetch_tasks_with_stale_embedding": (_FETCH_TASKS_WITH_STALE_EMBEDDING_SQL, (0, "", 64)),
+    "load_vectors": (
+        _LOAD_VECTORS_SQL.format(placeholders=",".join("?" * 50)),
+        (*[0] * 50, 0, ""),
+    ),
+    "search_titles": (_SEARCH_TITLES_SQL, ('owner:"u0" AND "слово"*', 50)),
+    "recent_tasks": (_RECENT_TASKS_SQL, (0, 100)),
+    "tasks_for_exact_datetime": (_TASKS_FOR_EXACT_DATETIME_SQL, (0,)),
+    "fetch_pending_due_between": (_FETCH_PENDING_DUE_BETWEEN_SQL, (0, 0, 1, 0)),
+    "delete_expired_tasks": (_SELECT_EXPIRED_TASKS_SQL, (0, 1, 0, 1)),
+    "load_fsm_record": (_LOAD_FSM_RECORD_SQL, ("",)),
+    "delete_stale_fsm_records": (_DELETE_STALE_FSM_RECORDS_SQL, (0,)),
+}
+
+
+async def check_query_plans() -> list[tuple[str, str]]:
+    """Список запросов, которые всё ещё читают таблицу целиком"""
+    async with _get_pool().reader() as db:
+        return await migrations.find_full_scans(db, QUERY_SHAPES)
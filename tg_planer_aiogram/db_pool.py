@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+
+log = logging.getLogger("planner_bot")
+
+
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class ConnectionPool:
+    """
+    Постоянные соединения с SQLite: один писатель и несколько читателей (WAL).
+
+    Изменения (write) выполняет одна фоновая задача: она забирает из
+    очереди до batch_size накопившихся операций (ожидая попутчиков не
+    дольше max_wait секунд), выполняет их в одной транзакции, каждую -
+    в своей точке сохранения, и фиксирует их одним commit. Неудачная
+    операция откатывается одна, её вызывающий получает исключение.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        pragmas: dict[str, object] | None = None,
+        cached_statements: int = 128,
+        batch_size: int = 64,
+        max_wait: float = 0.0,
+    ):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.pragmas = pragmas or {}
+        self.cached_statements = cached_statements
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+
+        self._writer: aiosqlite.Connection | None = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: list[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._writes: asyncio.Queue[tuple[WriteOp, asyncio.Future]] = asyncio.Queue()
+        self._write_task: asyncio.Task | None = None
+
+        self.commits = 0
+        self.writes = 0
+        self.failed_writes = 0
+        # Размер пачки -> число транзакций (степени двойки: 1, 2, 4, ...)
+        self.batch_histogram: dict[int, int] = {}
+        self._opened_at = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def open(self) -> None:
+        if self.is_open:
+            return
+
+        # Писатель открывается первым: он создаёт файл и включает WAL,
+        # после чего читатели могут подключаться в режиме только чтения
+        self._writer = await aiosqlite.connect(
+            self.path, cached_statements=self.cached_statements
+        )
+        await self._writer.execute("PRAGMA journal_mode=WAL")
+        await self._apply_pragmas(self._writer)
+
+        for _ in range(self.readers_count):
+            conn = await aiosqlite.connect(
+                f"file:{self.path}?mode=ro",
+                uri=True,
+                cached_statements=self.cached_statements,
+            )
+            await self._apply_pragmas(conn)
+            self._readers.append(conn)
+            self._idle.put_nowait(conn)
+
+        self._opened_at = time.monotonic()
+        self._write_task = asyncio.create_task(self._write_loop(), name="db-writer")
+
+        log.info(
+            f"Пул соединений открыт: {self.path} "
+            f"(1 писатель, {self.readers_count} читателей)"
+        )
+
+    async def close(self) -> None:
+        if not self.is_open:
+            return
+
+        # Операции, поставленные до закрытия, выполняются
+        await self._writes.join()
+        self._write_task.cancel()
+        try:
+            await self._write_task
+        except asyncio.CancelledError:
+            pass
+        self._write_task = None
+        log.info(f"Запись в БД: {self.write_stats()}")
+
+        for conn in self._readers:
+            await conn.close()
+        self._readers.clear()
+        self._idle = asyncio.Queue()
+
+        await self._writer.close()
+        self._writer = None
+        log.info("Пул соединений закрыт")
+
+    async def _apply_pragmas(self, conn: aiosqlite.Connection) -> None:
+        for name, value in self.pragmas.items():
+            await conn.execute(f"PRAGMA {name}={value}")
+
+    @asynccontextmanager
+    async def writer(self):
+        """
+        Эксклюзивный доступ к соединению-писателю на время транзакции -
+        для миграций и долгих операций со своими commit; пачки write ждут
+        """
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт")
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    async def write(self, op: WriteOp) -> Any:
+        """
+        Выполняет op(db) в общей транзакции записи и возвращает её
+        результат (rowcount, lastrowid и т.п.) после фиксации. op не
+        вызывает commit/rollback сама.
+        """
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт")
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((op, future))
+        return await future
+
+    def write_stats(self) -> dict:
+        elapsed = time.monotonic() - self._opened_at if self._opened_at else 0.0
+        return {
+            "commits": self.commits,
+            "writes": self.writes,
+            "failed_writes": self.failed_writes,
+            "commits_per_sec": round(self.commits / elapsed, 2) if elapsed else 0.0,
+            "avg_batch": round(self.writes / self.commits, 2) if self.commits else 0.0,
+            "batch_histogram": dict(sorted(self.batch_histogram.items())),
+        }
+
+    async def _next_batch(self) -> list[tuple[WriteOp, asyncio.Future]]:
+        batch = [await self._writes.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            if not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._writes.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write_loop(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                async with self._writer_lock:
+                    results = await self._apply_batch(batch)
+                for (_, future), (ok, value) in zip(batch, results):
+                    if future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+            except Exception as e:
+                # Не удалось начать или зафиксировать транзакцию - она целиком не применена
+                log.error(f"Ошибка транзакции записи ({len(batch)} операций): {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    async def _apply_batch(self, batch: list[tuple[WriteOp, asyncio.Future]]) -> list[tuple[bool, Any]]:
+        db = self._writer
+        results: list[tuple[bool, Any]] = []
+        # IMMEDIATE: блокировка записи берётся сразу (и для других процессов)
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            for op, future in batch:
+                if future.cancelled():
+                    results.append((False, asyncio.CancelledError()))
+                    continue
+                await db.execute("SAVEPOINT op")
+                try:
+                    value = await op(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO op")
+                    await db.execute("RELEASE op")
+                    self.failed_writes += 1
+                    results.append((False, e))
+                    continue
+                await db.execute("RELEASE op")
+                results.append((True, value))
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+        self.commits += 1
+        self.writes += len(batch)
+        bucket = 1 << (len(batch).bit_length() - 1)
+        self.batch_histogram[bucket] = self.batch_histogram.get(bucket, 0) + 1
+        return results
+
+    @asynccontextmanager
+    async def reader(self):
+        """Соединение только для чтения из пула"""
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт")
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from config import (
+    EMB_BACKEND,
+    EMB_HASH_DIM,
+    EMB_MODEL,
+    EMB_ONNX_PATH,
+    EMB_ONNX_QUANTIZE,
+)
+
+log = logging.getLogger("planner_bot")
+
+
+class EmbeddingBackend:
+    """
+    Движок эмбеддингов. Конструктор лёгкий, тяжёлые библиотеки и модель
+    загружаются в load(). version записывается рядом с каждым сохранённым
+    вектором: векторы разных версий между собой не сравниваются.
+    """
+
+    version = ""
+
+    def load(self) -> None:
+        pass
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Эмбеддинги пачки текстов: матрица float32 (тексты x размерность)"""
+        raise NotImplementedError
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Модель sentence-transformers на PyTorch"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        # Совпадает с прежним ключом кэша эмбеддингов - кэш остаётся в силе
+        self.version = model_name
+        self._model = None
+
+    def load(self) -> None:
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(self.model_name)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self._model.encode(texts).astype("float32")
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    Та же модель, экспортированная в ONNX (tools/export_onnx.py), на
+    ONNX Runtime без PyTorch. С quantize=True веса один раз квантуются
+    динамически в int8 (файл *.int8.onnx рядом с исходным).
+    Пулинг - среднее по токенам, как у sentence-transformers.
+    """
+
+    def __init__(self, model_name: str, onnx_path: str, quantize: bool = True, max_length: int = 128):
+        self.model_name = model_name
+        self.onnx_path = onnx_path
+        self.quantize = quantize
+        self.max_length = max_length
+        self.version = f"{model_name}@onnx" + ("-int8" if quantize else "")
+        self._session = None
+        self._tokenizer = None
+        self._input_names: set[str] = set()
+
+    def load(self) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if not os.path.exists(self.onnx_path):
+            raise FileNotFoundError(
+                f"Нет ONNX-модели {self.onnx_path}: создайте её через tools/export_onnx.py"
+            )
+        path = self.onnx_path
+        if self.quantize:
+            root, ext = os.path.splitext(self.onnx_path)
+            path = f"{root}.int8{ext}"
+            if not os.path.exists(path):
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                log.info(f"Квантование ONNX-модели в int8: {path}")
+                quantize_dynamic(self.onnx_path, path, weight_type=QuantType.QInt8)
+
+        self._session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self._input_names = {item.name for item in self._session.get_inputs()}
+
+        tokenizer_path = os.path.join(os.path.dirname(self.onnx_path), "tokenizer.json")
+        self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._tokenizer.enable_truncation(self.max_length)
+        self._tokenizer.enable_padding()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        encoded = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([item.ids for item in encoded], dtype="int64")
+        mask = np.array([item.attention_mask for item in encoded], dtype="int64")
+        feed = {"input_ids": input_ids, "attention_mask": mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+
+        hidden = self._session.run(None, feed)[0]
+        weights = mask[:, :, None].astype("float32")
+        summed = (hidden * weights).sum(axis=1)
+        return (summed / np.clip(weights.sum(axis=1), 1e-9, None)).astype("float32")
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    Детерминированные векторы без модели: слова и символьные триграммы
+    раскладываются хэшем по dim корзинам со знаком. Похожие по написанию
+    тексты получают близкие векторы - достаточно для тестов и бенчмарков.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.version = f"hashing-v1-{dim}"
+
+    @staticmethod
+    def _features(text: str) -> list[tuple[str, float]]:
+        features = []
+        for word in text.casefold().split():
+            features.append((word, 1.0))
+            padded = f"#{word}#"
+            features.extend((padded[i:i + 3], 0.5) for i in range(len(padded) - 2))
+        return features
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                # blake2b, а не hash(): он не зависит от PYTHONHASHSEED процесса
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value >> 63 else -1.0
+                vectors[row, value % self.dim] += sign * weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def create_backend(name: str = EMB_BACKEND) -> EmbeddingBackend:
+    if name == "sentence-transformers":
+        return SentenceTransformerBackend(EMB_MODEL)
+    if name == "onnx":
+        return OnnxBackend(EMB_MODEL, EMB_ONNX_PATH, quantize=EMB_ONNX_QUANTIZE)
+    if name == "hashing":
+        return HashingBackend(EMB_HASH_DIM)
+    raise ValueError(f"Неизвестный движок эмбеддингов: {name}")
+
+
+def configured_version() -> str:
+    """Версия векторов настроенного движка (без загрузки модели)"""
+    return create_backend().version
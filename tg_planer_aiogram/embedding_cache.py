@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import numpy as np
+
+import database
+
+log = logging.getLogger("planner_bot")
+
+
+def normalize_text(text: str) -> str:
+    """Ключ кэша: NFKC, нижний регистр, одиночные пробелы"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class EmbeddingCache:
+    """
+    Двухуровневый кэш эмбеддингов: LRU в памяти и таблица emb_cache в SQLite.
+
+    Ключ - нормализованный текст и имя модели, поэтому векторы другой
+    модели никогда не попадут в выдачу (а из БД удаляются при запуске).
+    Сам вектор считается по исходному тексту - нормализация только
+    объединяет его написания в одну запись.
+    """
+
+    def __init__(self, model: str, capacity: int = 5000, persistent: bool = True):
+        self.model = model
+        self.capacity = capacity
+        self.persistent = persistent
+
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        # Одновременные промахи по одному тексту ждут одно вычисление
+        self._inflight: dict[str, asyncio.Future] = {}
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        # Вызовы, дождавшиеся чужого вычисления того же текста: в памяти
+        # вектора ещё не было, поэтому в hit_rate попаданием не считаются
+        self.inflight_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.inflight_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "inflight_hits": self.inflight_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 3) if lookups else 0.0,
+            "memory_size": len(self._memory),
+        }
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        # Один и тот же массив отдаётся всем вызывающим - запрещаем запись
+        vec.setflags(write=False)
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[np.ndarray]],
+    ) -> np.ndarray:
+        vec = self._memory.get(key)
+        if vec is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return vec
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.inflight_hits += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            vec = await self._load_or_compute(key, compute)
+            future.set_result(vec)
+            return vec
+        except BaseException as e:
+            future.set_exception(e)
+            # Ошибку получит и этот вызывающий; ожидающие получат её через Future
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[np.ndarray]],
+    ) -> np.ndarray:
+        if self.persistent:
+            blob = await database.load_cached_embedding(self.model, key)
+            if blob is not None:
+                self.db_hits += 1
+                vec = np.frombuffer(blob, dtype="float32")
+                self._remember(key, vec)
+                return vec
+
+        self.misses += 1
+        vec = await compute()
+        self._remember(key, vec)
+        if self.persistent:
+            try:
+                await database.store_cached_embedding(self.model, key, vec.tobytes())
+            except Exception as e:
+                log.warning(f"Не удалось сохранить эмбеддинг в кэш БД: {e}")
+        return vec
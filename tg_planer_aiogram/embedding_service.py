@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Callable
+
+import numpy as np
+
+log = logging.getLogger("planner_bot")
+
+
+class EmbeddingBatcher:
+    """
+    Собирает одновременные запросы эмбеддингов в пачки.
+
+    Первый запрос запускает окно ожидания max_wait_ms; пачка уходит
+    в пул, когда окно истекло или набралось max_batch текстов. Каждый
+    вызывающий получает свою строку результата.
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[list[str]], np.ndarray],
+        executor: Executor,
+        max_batch: int = 32,
+        max_wait_ms: float = 5,
+    ):
+        self.encode_batch = encode_batch
+        self.executor = executor
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._running: set[asyncio.Task] = set()
+
+        # Распределение размеров пачек: размер -> количество пачек
+        self.batch_sizes: Counter[int] = Counter()
+
+    async def embed(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def stats(self) -> dict:
+        batches = sum(self.batch_sizes.values())
+        texts = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "texts": texts,
+            "mean_batch": round(texts / batches, 2) if batches else 0.0,
+            "histogram": dict(sorted(self.batch_sizes.items())),
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        self.batch_sizes[len(batch)] += 1
+        texts = [text for text, _ in batch]
+        loop = asyncio.get_running_loop()
+
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.encode_batch, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vec in zip(batch, vectors):
+            # Вызывающий мог быть отменён, пока пачка считалась
+            if not future.done():
+                future.set_result(vec)
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import database
+
+log = logging.getLogger("planner_bot")
+
+# Период удаления брошенных диалогов и вытеснения неактивных записей, секунды
+_CLEANUP_INTERVAL = 60.0
+
+
+class _Record:
+    __slots__ = ("state", "data", "payload", "updated_at", "used_at")
+
+    def __init__(self, state: str | None, payload: str, updated_at: int):
+        self.state = state
+        self.payload = payload
+        self.data = json.loads(payload)
+        self.updated_at = updated_at
+        self.used_at = time.monotonic()
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в таблице fsm_state: диалоги /add и /clear_all
+    переживают перезапуск бота.
+
+    Чтение и запись идут через слой в памяти: FSM-middleware спрашивает
+    состояние на каждом апдейте, а у большинства пользователей диалога нет -
+    ответ «нет состояния» тоже запоминается. Изменения копятся и пишутся
+    одной транзакцией раз в flush_interval секунд или как только их
+    набралось batch_size. Сбой процесса теряет не больше flush_interval
+    секунд изменений.
+
+    Слой в памяти считается главным, поэтому диалог пользователя должен
+    обслуживать один процесс - режим воркеров это гарантирует. Диалоги без
+    изменений дольше ttl секунд удаляются, записи без обращений дольше
+    idle секунд вытесняются из памяти.
+    """
+
+    def __init__(self, ttl: float, flush_interval: float, batch_size: int, idle: float):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.idle = idle
+        self.key_builder = DefaultKeyBuilder(
+            with_bot_id=True, with_business_connection_id=True, with_destiny=True
+        )
+        self._records: dict[str, _Record] = {}
+        self._dirty: set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.written = 0
+        self.expired = 0
+
+    def stats(self) -> dict:
+        return {
+            "records": len(self._records),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "written": self.written,
+            "expired": self.expired,
+        }
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="fsm-flush")
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и сбрасывает накопленное (вызывает и aiogram при остановке)"""
+        if self._task is None and not self._dirty:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._dirty:
+            await self.flush()
+        log.info(f"Хранилище состояний диалогов: {self.stats()}")
+
+    async def _record(self, key: StorageKey) -> tuple[str, _Record]:
+        name = self.key_builder.build(key)
+        record = self._records.get(name)
+        if record is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            row = await database.load_fsm_record(name)
+            # Пока шло чтение, запись могла появиться в памяти - она новее
+            record = self._records.get(name)
+            if record is None:
+                record = _Record(*row) if row else _Record(None, "{}", 0)
+                self._records[name] = record
+        record.used_at = time.monotonic()
+        return name, record
+
+    def _changed(self, name: str, record: _Record) -> None:
+        record.updated_at = int(time.time())
+        self._dirty.add(name)
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._changed(name, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        # Сериализация сразу: несохраняемое значение - ошибка в обработчике,
+        # а не потерянная запись при сбросе
+        payload = json.dumps(dict(data), ensure_ascii=False)
+        name, record = await self._record(key)
+        record.data = dict(data)
+        record.payload = payload
+        self._changed(name, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def flush(self) -> None:
+        """Пишет накопленные изменения одной транзакцией"""
+        names, self._dirty = self._dirty, set()
+        records = {name: self._records[name] for name in names if name in self._records}
+        upserts = [
+            (name, record.state, record.payload, record.updated_at)
+            for name, record in records.items()
+            if not record.empty
+        ]
+        # Завершённый диалог (state.clear()) - строка больше не нужна
+        deletes = [name for name, record in records.items() if record.empty]
+        try:
+            await database.save_fsm_records(upserts, deletes)
+        except Exception:
+            # Повторим при следующем сбросе; изменения, сделанные за это время, новее
+            for name, record in records.items():
+                self._records.setdefault(name, record)
+            self._dirty |= records.keys()
+            raise
+        self.flushes += 1
+        self.written += len(records)
+
+    async def cleanup(self) -> int:
+        """Удаляет брошенные диалоги и вытесняет из памяти неактивные записи"""
+        now = time.monotonic()
+        before = int(time.time() - self.ttl)
+        for name, record in list(self._records.items()):
+            if name in self._dirty:
+                continue
+            if (not record.empty and record.updated_at < before) or now - record.used_at > self.idle:
+                del self._records[name]
+        deleted = await database.delete_stale_fsm_records(before)
+        self.expired += deleted
+        if deleted > 0:
+            log.info(f"Удалено брошенных диалогов: {deleted}")
+        return deleted
+
+    async def _run(self) -> None:
+        next_cleanup = time.monotonic() + _CLEANUP_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if self._dirty:
+                    await self.flush()
+                if time.monotonic() >= next_cleanup:
+                    next_cleanup = time.monotonic() + _CLEANUP_INTERVAL
+                    await self.cleanup()
+            except Exception as e:
+                log.error(f"Ошибка записи состояний диалогов: {e}")
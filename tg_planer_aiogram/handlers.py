@@ -1,12 +1,17 @@
 from datetime import datetime, timedelta
 from aiogram import Dispatcher
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 import database
 import utils
+from config import LIST_PAGE_SIZE
+from search_engine import engine as search_engine
+from task_cache import cache as task_cache
 
 
 class AddTaskStates(StatesGroup):
@@ -18,6 +23,14 @@ class ClearAllStates(StatesGroup):
     waiting_for_confirmation = State()
 
 
+class ListPage(CallbackData, prefix="list"):
+    """Кнопка листания /list: курсор (срок и id крайней задачи страницы) и её номер"""
+    due_at: int
+    task_id: int
+    number: int
+    backward: bool = False
+
+
 def register_handlers(dp: Dispatcher):
     # Команды
     dp.message.register(on_start, Command("start"))
@@ -33,6 +46,7 @@ def register_handlers(dp: Dispatcher):
     dp.message.register(on_undo, Command("undo"))
     dp.message.register(on_delete, Command("delete"))
     dp.message.register(on_search, Command("search"))
+    dp.callback_query.register(on_list_page, ListPage.filter())
 
     # Диалог добавления задачи
     dp.message.register(process_title, StateFilter(AddTaskStates.waiting_for_title))
@@ -129,7 +143,8 @@ async def on_help(message: Message):
 
         "<b>Управление задачами:</b>\n"
         "<code>/done 1</code> - Выполнить первую задачу\n"
-        "<code>/delete 2</code> - Удалить вторую задачу\n\n"
+        "<code>/delete 2</code> - Удалить вторую задачу\n"
+        "<code>/done 1 3 5-8</code> - Выполнить несколько задач сразу\n\n"
 
         "<b>Просмотр задач:</b>\n"
         "<code>/today</code> - Задачи на сегодня\n"
@@ -261,9 +276,11 @@ async def process_datetime(message: Message, state: FSMContext):
         return  # НЕ очищаем состояние, даем возможность ввести заново
 
     # Создаем задачу
-    vec = utils.make_embedding(title)
+    vec = await utils.make_embedding_async(title)
     blob = utils.emb_to_blob(vec)
-    task_id = await database.insert_task(message.from_user.id, title, date_str, time_str, blob)
+    task_id = await database.insert_task(
+        message.from_user.id, title, date_str, time_str, blob, utils.embedding_version()
+    )
 
     formatted_datetime = utils.format_datetime_display(date_str, time_str)
     await message.answer(
@@ -293,13 +310,8 @@ async def cancel_add(message: Message, state: FSMContext):
 
 
 async def on_today(message: Message):
-    # Сначала удаляем просроченные задачи
-    deleted_count = await database.delete_expired_tasks()
-    if deleted_count > 0:
-        log.info(f"Удалено {deleted_count} просроченных задач")
-
     today = utils.current_date()
-    tasks = await database.fetch_tasks_for_date(message.from_user.id, today)
+    tasks = await task_cache.fetch_tasks_for_date(message.from_user.id, today)
 
     if not tasks:
         await message.answer(
@@ -336,15 +348,10 @@ async def on_today(message: Message):
 
 async def on_week(message: Message):
     """Показать задачи на неделю вперед"""
-    # Сначала удаляем просроченные задачи
-    deleted_count = await database.delete_expired_tasks()
-    if deleted_count > 0:
-        log.info(f"Удалено {deleted_count} просроченных задач")
-
     today = datetime.now().date()
     week_dates = [(today + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
 
-    tasks = await database.fetch_tasks_for_dates(message.from_user.id, week_dates)
+    tasks = await task_cache.fetch_tasks_for_dates(message.from_user.id, week_dates)
 
     if not tasks:
         await message.answer(
@@ -390,35 +397,43 @@ async def on_week(message: Message):
     await message.answer("\n".join(lines))
 
 
-async def on_list(message: Message):
-    """Показать все задачи пользователя"""
-    # Сначала удаляем просроченные задачи
-    deleted_count = await database.delete_expired_tasks()
-    if deleted_count > 0:
-        await message.answer(f"🗑️ Удалено {deleted_count} просроченных задач")
-
-    tasks = await database.fetch_all_tasks(message.from_user.id)
-
-    if not tasks:
-        await message.answer(
-            "📝 <b>Все ваши задачи</b>\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-            "📭 <i>У вас пока нет задач</i>\n\n"
-            "💡 <i>Используйте /add чтобы добавить первую задачу</i>"
-        )
-        return
-
+async def _load_list_page(
+    user_id: int,
+    cursor: tuple[int, int] | None = None,
+    number: int = 1,
+    backward: bool = False,
+) -> tuple[list, int, bool, bool]:
+    """
+    Страница /list: строки, номер первой задачи и есть ли страницы до и после.
+    Читается на одну задачу больше страницы - так видно, есть ли продолжение
+    """
+    rows = await task_cache.fetch_tasks_page(user_id, cursor, LIST_PAGE_SIZE + 1, backward)
+    if backward:
+        if len(rows) <= LIST_PAGE_SIZE:
+            # Перед курсором не больше страницы - это начало списка
+            return await _load_list_page(user_id)
+        return rows[1:], max(2, number - LIST_PAGE_SIZE), True, True
+    if not rows and cursor is not None:
+        # Задачи после курсора успели исчезнуть
+        return await _load_list_page(user_id)
+    return rows[:LIST_PAGE_SIZE], number, number > 1, len(rows) > LIST_PAGE_SIZE
+
+
+def _render_list_page(rows: list, number: int, has_prev: bool, has_next: bool):
+    """Текст страницы /list и кнопки листания"""
+    last_number = number + len(rows) - 1
     lines = [
         "📋 <b>Все ваши задачи</b>",
         "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
     ]
+    if has_prev or has_next:
+        lines.append(f"📄 <i>Задачи {number}–{last_number}</i>")
 
-    # Группируем по статусу с порядковой нумерацией
+    # Группируем по статусу, номера - сквозные по всему списку
     pending_tasks = []
     done_tasks = []
 
-    task_number = 1
-    for task_id, title, date_str, time_str, status in tasks:
+    for task_number, (task_id, due_at, title, date_str, time_str, status) in enumerate(rows, number):
         formatted_datetime = utils.format_datetime_display(date_str, time_str)
 
         if status == "done":
@@ -430,37 +445,90 @@ async def on_list(message: Message):
             mark = "⏳"
             pending_tasks.append(f"  {emoji} <b>{task_number}.</b> <code>{formatted_datetime}</code> - {title} {mark}")
 
-        task_number += 1
-
     # Показываем сначала невыполненные задачи
     if pending_tasks:
         lines.extend([
             f"\n🔄 <b>Невыполненные задачи ({len(pending_tasks)}):</b>",
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
         ])
-        lines.extend(pending_tasks[:20])  # Ограничиваем количество
+        lines.extend(pending_tasks)
 
     if done_tasks:
         lines.extend([
             f"\n✅ <b>Выполненные задачи ({len(done_tasks)}):</b>",
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
         ])
-        lines.extend(done_tasks[:10])  # Меньше выполненных показываем
+        lines.extend(done_tasks)
 
     lines.extend([
         "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
         f"💡 <i>Используйте /done N для выполнения задач</i>"
     ])
 
-    if len(pending_tasks) > 20 or len(done_tasks) > 10:
-        lines.append(f"💡 <i>Показаны не все задачи. Используйте /today или /week для фильтрации</i>")
+    buttons = []
+    if has_prev:
+        first = rows[0]
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад",
+            callback_data=ListPage(due_at=first[1], task_id=first[0], number=number, backward=True).pack(),
+        ))
+    if has_next:
+        last = rows[-1]
+        buttons.append(InlineKeyboardButton(
+            text="Далее ➡️",
+            callback_data=ListPage(due_at=last[1], task_id=last[0], number=last_number + 1).pack(),
+        ))
+    markup = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(lines), markup
+
+
+_EMPTY_LIST_TEXT = (
+    "📝 <b>Все ваши задачи</b>\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+    "📭 <i>У вас пока нет задач</i>\n\n"
+    "💡 <i>Используйте /add чтобы добавить первую задачу</i>"
+)
 
-    await message.answer("\n".join(lines))
+
+async def on_list(message: Message):
+    """Показать все задачи пользователя (первая страница)"""
+    rows, number, has_prev, has_next = await _load_list_page(message.from_user.id)
+
+    if not rows:
+        await message.answer(_EMPTY_LIST_TEXT)
+        return
+
+    text, markup = _render_list_page(rows, number, has_prev, has_next)
+    await message.answer(text, reply_markup=markup)
+
+
+async def on_list_page(callback: CallbackQuery, callback_data: ListPage):
+    """Листание /list: следующая или предыдущая страница от курсора в кнопке"""
+    rows, number, has_prev, has_next = await _load_list_page(
+        callback.from_user.id,
+        (callback_data.due_at, callback_data.task_id),
+        callback_data.number,
+        callback_data.backward,
+    )
+    if rows:
+        text, markup = _render_list_page(rows, number, has_prev, has_next)
+    else:
+        text, markup = _EMPTY_LIST_TEXT, None
+
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        # Страница не изменилась или сообщение уже нельзя редактировать
+        pass
+    await callback.answer()
 
 
-async def on_cleanup(message: Message):
-    """Удалить все просроченные задачи"""
-    deleted_count = await database.delete_expired_tasks()
+async def on_cleanup(message: Message, shard: tuple[int, int] = (0, 1)):
+    """
+    Удалить все просроченные задачи; в режиме воркеров - только задачи
+    пользователей этого воркера, иначе кэши других воркеров устареют
+    """
+    deleted_count = await database.delete_expired_tasks(shard=shard)
 
     if deleted_count > 0:
         await message.answer(
@@ -602,111 +670,101 @@ async def process_clear_confirmation(message: Message, state: FSMContext):
         await state.set_state(ClearAllStates.waiting_for_confirmation)
 
 
-async def on_done(message: Message):
-    # формат: /done ID (где ID - порядковый номер в списке задач)
-    try:
-        display_id = int(message.text.split(" ", 1)[1])
-    except (ValueError, IndexError):
-        await message.answer("Нужно указать номер задачи.\nПример: /done 1")
-        return
+async def _read_task_numbers(message: Message, command: str) -> list[int] | None:
+    """Номера задач из аргумента команды: /done 1 или /done 1 3 5-8"""
+    parts = message.text.split(" ", 1)
+    numbers = utils.parse_task_numbers(parts[1]) if len(parts) > 1 else None
+    if numbers is None:
+        await message.answer(
+            "Нужно указать номер задачи или несколько номеров (до 100).\n"
+            f"Пример: /{command} 1 или /{command} 1 3 5-8"
+        )
+    return numbers
 
-    # Получаем все задачи пользователя, отсортированные по времени
-    tasks = await database.fetch_all_tasks(message.from_user.id, 1000)  # Больше лимит для поиска
 
-    if display_id < 1 or display_id > len(tasks):
-        await message.answer(f"Задача с номером {display_id} не найдена.")
-        return
+def _format_numbers(numbers: list[int]) -> str:
+    return ", ".join(str(n) for n in numbers)
+
+
+def _not_found_text(numbers: list[int]) -> str:
+    if len(numbers) == 1:
+        return f"Задача с номером {numbers[0]} не найдена."
+    return f"Задачи с номерами {_format_numbers(numbers)} не найдены."
+
 
-    # Находим задачу по порядковому номеру
-    real_task_id = tasks[display_id - 1][0]  # Первый элемент - это ID в базе
+def _missing_line(numbers: list[int], found: list[int]) -> str:
+    missing = sorted(set(numbers) - set(found))
+    return f"❓ Не найдены: №{_format_numbers(missing)}\n" if missing else ""
 
-    count = await database.mark_task_done(message.from_user.id, real_task_id)
-    if count > 0:
+
+async def on_done(message: Message):
+    # формат: /done N [N ...] (N - порядковый номер в списке задач, можно диапазон 5-8)
+    numbers = await _read_task_numbers(message, "done")
+    if numbers is None:
+        return
+
+    done = await database.mark_done_by_numbers(message.from_user.id, numbers)
+    if not done:
+        await message.answer(_not_found_text(numbers))
+    elif len(numbers) == 1:
         await message.answer(
             f"✅ <b>Задача выполнена!</b>\n\n"
-            f"🎯 Задача №{display_id} отмечена как выполненная\n\n"
-            f"💡 <i>Используйте /undo {display_id} если передумали</i>"
+            f"🎯 Задача №{done[0]} отмечена как выполненная\n\n"
+            f"💡 <i>Используйте /undo {done[0]} если передумали</i>"
         )
     else:
         await message.answer(
-            "❌ <b>Ошибка выполнения задачи</b>\n\n"
-            "Возможные причины:\n"
-            "• Задача уже выполнена\n"
-            "• Задача не найдена\n"
-            "• Неверный номер задачи\n\n"
-            "💡 <i>Проверьте список задач с помощью /list</i>"
+            f"✅ <b>Задачи выполнены!</b>\n\n"
+            f"🎯 Отмечены как выполненные: №{_format_numbers(done)}\n"
+            f"{_missing_line(numbers, done)}\n"
+            f"💡 <i>Используйте /undo {' '.join(map(str, done))} если передумали</i>"
         )
 
 
 async def on_undo(message: Message):
-    # формат: /undo ID (где ID - порядковый номер в списке задач)
-    try:
-        display_id = int(message.text.split(" ", 1)[1])
-    except (ValueError, IndexError):
-        await message.answer("Нужно указать номер задачи.\nПример: /undo 1")
+    # формат: /undo N [N ...] (N - порядковый номер в списке задач, можно диапазон 5-8)
+    numbers = await _read_task_numbers(message, "undo")
+    if numbers is None:
         return
 
-    # Получаем все задачи пользователя, отсортированные по времени
-    tasks = await database.fetch_all_tasks(message.from_user.id, 1000)
-
-    if display_id < 1 or display_id > len(tasks):
-        await message.answer(f"Задача с номером {display_id} не найдена.")
-        return
-
-    # Находим задачу по порядковому номеру
-    real_task_id = tasks[display_id - 1][0]
-
-    count = await database.mark_task_undo(message.from_user.id, real_task_id)
-    if count > 0:
+    undone = await database.mark_undo_by_numbers(message.from_user.id, numbers)
+    if not undone:
+        await message.answer(_not_found_text(numbers))
+    elif len(numbers) == 1:
         await message.answer(
             f"↩️ <b>Задача возвращена!</b>\n\n"
-            f"🔄 Задача №{display_id} снова активна\n\n"
-            f"💡 <i>Используйте /done {display_id} чтобы выполнить её снова</i>"
+            f"🔄 Задача №{undone[0]} снова активна\n\n"
+            f"💡 <i>Используйте /done {undone[0]} чтобы выполнить её снова</i>"
         )
     else:
         await message.answer(
-            "❌ <b>Ошибка отмены выполнения</b>\n\n"
-            "Возможные причины:\n"
-            "• Задача ещё не выполнена\n"
-            "• Задача не найдена\n"
-            "• Неверный номер задачи\n\n"
-            "💡 <i>Проверьте список задач с помощью /list</i>"
+            f"↩️ <b>Задачи возвращены!</b>\n\n"
+            f"🔄 Снова активны: №{_format_numbers(undone)}\n"
+            f"{_missing_line(numbers, undone)}"
         )
 
 
 async def on_delete(message: Message):
-    """Удалить задачу"""
-    try:
-        display_id = int(message.text.split(" ", 1)[1])
-    except (ValueError, IndexError):
-        await message.answer("Нужно указать номер задачи.\nПример: /delete 1")
+    """Удалить задачу (или несколько: /delete 1 3 5-8)"""
+    numbers = await _read_task_numbers(message, "delete")
+    if numbers is None:
         return
 
-    # Получаем все задачи пользователя, отсортированные по времени
-    tasks = await database.fetch_all_tasks(message.from_user.id, 1000)
-
-    if display_id < 1 or display_id > len(tasks):
-        await message.answer(f"Задача с номером {display_id} не найдена.")
-        return
-
-    # Находим задачу по порядковому номеру
-    real_task_id = tasks[display_id - 1][0]
-
-    count = await database.delete_task(message.from_user.id, real_task_id)
-    if count > 0:
+    deleted = await database.delete_by_numbers(message.from_user.id, numbers)
+    if not deleted:
+        await message.answer(_not_found_text(numbers))
+    elif len(numbers) == 1:
         await message.answer(
             f"🗑️ <b>Задача удалена!</b>\n\n"
-            f"❌ Задача №{display_id} полностью удалена\n\n"
+            f"❌ Задача №{deleted[0]} полностью удалена\n\n"
             f"⚠️ <i>Это действие нельзя отменить</i>"
         )
     else:
         await message.answer(
-            "❌ <b>Ошибка удаления задачи</b>\n\n"
-            "Возможные причины:\n"
-            "• Задача не найдена\n"
-            "• Неверный номер задачи\n"
-            "• Задача уже удалена\n\n"
-            "💡 <i>Проверьте список задач с помощью /list</i>"
+            f"🗑️ <b>Задачи удалены!</b>\n\n"
+            f"❌ Удалены задачи №{_format_numbers(deleted)}\n"
+            f"{_missing_line(numbers, deleted)}\n"
+            f"⚠️ <i>Номера остальных задач сдвинулись - проверьте /list</i>"
         )
 
 
@@ -735,11 +793,12 @@ async def on_search(message: Message):
         )
         return
 
-    query_vec = utils.make_embedding(query_text)
+    query_vec = await utils.make_embedding_async(query_text)
 
-    # Получаем все задачи пользователя (включая старые)
-    rows = await database.load_tasks_with_vectors(message.from_user.id)
-    if not rows:
+    # Совпадения слов (FTS5) и смысловая близость среди кандидатов;
+    # в режиме vector - матрица всех задач пользователя в памяти
+    results = await search_engine.search(message.from_user.id, query_vec, k=5, query_text=query_text)
+    if not results:
         await message.answer(
             "🔍 <b>Поиск задач</b>\n"
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
@@ -749,18 +808,9 @@ async def on_search(message: Message):
         )
         return
 
-    # Считаем косинусное сходство
-    results = []
-    for t_id, t_title, t_blob in rows:
-        t_vec = utils.blob_to_emb(t_blob)
-        if t_vec is not None:
-            score = utils.cosine_sim(query_vec, t_vec)
-            results.append((score, t_id, t_title))
-
-    # Сортируем по убыванию похожести
-    results.sort(key=lambda x: x[0], reverse=True)
-
-    if not results or results[0][0] < 0.1:  # минимальный порог похожести
+    # Совпадение слов - находка при любом косинусе: у задачи может не быть
+    # вектора, а порядок гибридной выдачи задаёт не косинус
+    if not any(r.lexical or r.score >= 0.1 for r in results):  # минимальный порог похожести
         await message.answer(
             f"🔍 <b>Поиск: '{query_text}'</b>\n"
             f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
@@ -771,18 +821,18 @@ async def on_search(message: Message):
         return
 
     # Берем топ результатов, но показываем только релевантные
-    top_results = [r for r in results if r[0] >= 0.3][:5]  # максимум 5 результатов
+    top_results = [r for r in results if r.lexical or r.score >= 0.3][:5]  # максимум 5 результатов
 
     if not top_results:
         # Если нет очень похожих, показываем хотя бы одну самую близкую
-        top_results = results[:1]
+        top_results = [max(results, key=lambda r: r.score)]
 
     lines = [
         f"🔍 <b>Поиск: '{query_text}'</b>",
         "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
     ]
 
-    for score, task_id, title in top_results:
+    for score, task_id, title, lexical in top_results:
         if score >= 0.8:
             similarity_icon = "🎯"
             similarity_text = "Отлично"
@@ -792,6 +842,9 @@ async def on_search(message: Message):
         elif score >= 0.4:
             similarity_icon = "⚠️"
             similarity_text = "Средне"
+        elif lexical:
+            similarity_icon = "🔤"
+            similarity_text = "Совпадение слов"
         else:
             similarity_icon = "🤔"
             similarity_text = "Слабо"
@@ -801,8 +854,9 @@ async def on_search(message: Message):
             lines.append(f"   📊 Сходство: {similarity_text} ({score:.1%})")
 
     # Если нашли очень похожую задачу, предлагаем действия
-    if results[0][0] >= 0.8:
-        best_match_id = results[0][1]
+    best = max(results, key=lambda r: r.score)
+    if best.score >= 0.8:
+        best_match_id = best.task_id
         lines.extend([
             "",
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
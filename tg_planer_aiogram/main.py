@@ -1,3 +1,8 @@
+import time
+
+# Отсчёт фаз запуска ведётся от начала импорта модулей бота
+_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 import sys
@@ -6,16 +11,20 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest, TelegramConflictError, TelegramNetworkError
+from aiogram.fsm.storage.memory import MemoryStorage
 
 import config
 import database
 import handlers
+from fsm_storage import SQLiteStorage
+from services import BotServices
+from supervisor import FanOut, Supervisor
+from task_cache import cache as task_cache
+from webhook import ConcurrencyLimit, run_webhook
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-)
+# Фазы запуска: imports, token_check, db_setup - длительность в секундах,
+# model_ready и polling - сколько секунд прошло от начала запуска
+startup_timings: dict[str, float] = {"imports": time.perf_counter() - _STARTED}
 
 # Фильтр для блокировки сообщений о конфликте
 class ConflictFilter(logging.Filter):
@@ -23,30 +32,57 @@ class ConflictFilter(logging.Filter):
         message = record.getMessage()
         return "Conflict" not in message and "terminated by other getUpdates" not in message
 
-# Отключаем подробные логи aiogram и добавляем фильтр
-aiogram_logger = logging.getLogger("aiogram")
-aiogram_logger.setLevel(logging.ERROR)
-aiogram_logger.addFilter(ConflictFilter())
-
-dispatcher_logger = logging.getLogger("aiogram.dispatcher")
-dispatcher_logger.setLevel(logging.CRITICAL)
-dispatcher_logger.addFilter(ConflictFilter())
 
 log = logging.getLogger("planner_bot")
 
-# Проверка токена
-if not config.TOKEN or config.TOKEN.strip() == "":
-    log.error("Токен Telegram бота не настроен!")
-    log.error("Установите переменную окружения TELEGRAM_BOT_TOKEN")
-    log.error("Пример: export TELEGRAM_BOT_TOKEN='ваш_токен_от_BotFather'")
-    exit(1)
+# Бот, диспетчер и хранилище диалогов создаёт build_app() при запуске, а не
+# импорт модуля: процессы-воркеры (spawn) заново импортируют __main__
+bot: Bot | None = None
+dp: Dispatcher | None = None
+fsm_storage: SQLiteStorage | None = None
+update_limiter: ConcurrencyLimit | None = None
+
 
-# Инициализация бота
-bot = Bot(token=config.TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+def setup_logging() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    )
 
-# Регистрация обработчиков
-handlers.register_handlers(dp)
+    # Отключаем подробные логи aiogram и добавляем фильтр
+    aiogram_logger = logging.getLogger("aiogram")
+    aiogram_logger.setLevel(logging.ERROR)
+    aiogram_logger.addFilter(ConflictFilter())
+
+    dispatcher_logger = logging.getLogger("aiogram.dispatcher")
+    dispatcher_logger.setLevel(logging.CRITICAL)
+    dispatcher_logger.addFilter(ConflictFilter())
+
+
+def check_token() -> bool:
+    """Проверка, что токен задан (до обращения к Telegram API)"""
+    if not config.TOKEN or config.TOKEN.strip() == "":
+        log.error("Токен Telegram бота не настроен!")
+        log.error("Установите переменную окружения TELEGRAM_BOT_TOKEN")
+        log.error("Пример: export TELEGRAM_BOT_TOKEN='ваш_токен_от_BotFather'")
+        return False
+    return True
+
+
+def build_app() -> None:
+    """Создаёт бота и диспетчер с обработчиками"""
+    global bot, dp, fsm_storage, update_limiter
+    bot = Bot(token=config.TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Состояния диалогов хранятся в БД. В режиме воркеров их держат воркеры,
+    # принимающему апдейты процессу они не нужны
+    fsm_storage = SQLiteStorage(config.FSM_TTL, config.FSM_FLUSH_INTERVAL, config.FSM_FLUSH_BATCH, config.FSM_IDLE)
+    dp = Dispatcher(storage=MemoryStorage() if config.WORKERS > 1 else fsm_storage)
+    # Ограничение одновременно обрабатываемых апдейтов (в обоих режимах запуска)
+    update_limiter = ConcurrencyLimit(config.UPDATE_CONCURRENCY, config.UPDATE_MAX_PENDING)
+    dp.update.outer_middleware(update_limiter)
+
+    # Регистрация обработчиков
+    handlers.register_handlers(dp)
 
 
 async def validate_token():
@@ -71,18 +107,8 @@ async def validate_token():
         return False
 
 
-async def main():
-    # Проверяем токен перед настройкой БД
-    if not await validate_token():
-        return False
-
-    await database.setup_db()
-
-    # Удаляем просроченные задачи при запуске
-    deleted_count = await database.delete_expired_tasks()
-    if deleted_count > 0:
-        log.info(f"Удалено {deleted_count} просроченных задач при запуске")
-
+async def start_polling() -> bool:
+    """Запуск long polling с обработкой типичных ошибок"""
     try:
         await bot.delete_webhook(drop_pending_updates=True)
         log.info("Запуск polling...")
@@ -117,11 +143,127 @@ async def main():
     return True
 
 
+async def start_webhook() -> bool:
+    """Запуск HTTP-сервера вебхука (RUN_MODE=webhook)"""
+    if not config.WEBHOOK_SECRET:
+        log.error("Для режима webhook задайте WEBHOOK_SECRET")
+        return False
+    try:
+        await run_webhook(
+            bot,
+            dp,
+            update_limiter,
+            host=config.WEBHOOK_HOST,
+            port=config.WEBHOOK_PORT,
+            path=config.WEBHOOK_PATH,
+            secret=config.WEBHOOK_SECRET,
+            public_url=config.WEBHOOK_URL,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            shutdown_timeout=config.WEBHOOK_SHUTDOWN_TIMEOUT,
+        )
+    except TelegramBadRequest as e:
+        log.error(f"Telegram отклонил вебхук: {e}")
+        return False
+    except OSError as e:
+        log.error(f"Не удалось запустить сервер вебхука: {e}")
+        return False
+    return True
+
+
+def _on_model_ready(task: asyncio.Task) -> None:
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        log.warning(f"Прогрев модели не удался, она загрузится при первом запросе: {task.exception()}")
+        return
+    startup_timings["model_ready"] = time.perf_counter() - _STARTED
+    log.info(f"Модель эмбеддингов готова через {startup_timings['model_ready']:.2f} с после запуска")
+
+
+def log_startup_timings() -> None:
+    phases = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in startup_timings.items())
+    log.info(f"Фазы запуска: {phases}")
+
+
+async def main():
+    services = BotServices(bot, fsm_storage)
+    # Модель грузится в пуле эмбеддингов параллельно с проверкой токена
+    # и настройкой БД
+    services.warm_up().add_done_callback(_on_model_ready)
+
+    # Проверяем токен перед настройкой БД
+    started = time.perf_counter()
+    token_ok = await validate_token()
+    startup_timings["token_check"] = time.perf_counter() - started
+    if not token_ok:
+        await services.stop()
+        return False
+
+    # Постоянные соединения с БД живут всё время работы бота
+    await database.open_pool()
+    try:
+        started = time.perf_counter()
+        await database.setup_db()
+        startup_timings["db_setup"] = time.perf_counter() - started
+        # Первый проход очистки выполняется сразу при запуске
+        services.start()
+
+        startup_timings["polling"] = time.perf_counter() - _STARTED
+        log_startup_timings()
+        if config.RUN_MODE == "webhook":
+            return await start_webhook()
+        return await start_polling()
+    finally:
+        await services.stop()
+        log.info(f"Кэш списков задач: {task_cache.stats()}")
+        await database.close_pool()
+
+
+async def run_supervisor() -> bool:
+    """
+    Режим WORKERS > 1: этот процесс принимает апдейты (polling или webhook)
+    и раздаёт их процессам-воркерам; задачи, напоминания и эмбеддинги
+    обрабатываются только в воркерах
+    """
+    if not await validate_token():
+        return False
+
+    # Миграции выполняются один раз до запуска воркеров
+    await database.open_pool()
+    try:
+        await database.setup_db()
+    finally:
+        await database.close_pool()
+
+    supervisor = Supervisor(
+        config.WORKERS,
+        heartbeat_interval=config.WORKER_HEARTBEAT_INTERVAL,
+        heartbeat_timeout=config.WORKER_HEARTBEAT_TIMEOUT,
+        start_timeout=config.WORKER_START_TIMEOUT,
+        report_interval=config.WORKER_REPORT_INTERVAL,
+    )
+    dp.update.outer_middleware(FanOut(supervisor))
+    supervisor.start()
+    try:
+        startup_timings["polling"] = time.perf_counter() - _STARTED
+        log_startup_timings()
+        if config.RUN_MODE == "webhook":
+            return await start_webhook()
+        return await start_polling()
+    finally:
+        await supervisor.stop(config.WORKER_SHUTDOWN_TIMEOUT)
+        await bot.session.close()
+
+
 async def run_bot():
     """Запуск бота с обработкой ошибок"""
+    setup_logging()
+    if not check_token():
+        sys.exit(1)
+    build_app()
     log.info("Бот запускается...")
 
-    success = await main()
+    success = await (run_supervisor() if config.WORKERS > 1 else main())
     if not success:
         log.error("Не удалось запустить бота из-за ошибок")
         sys.exit(1)
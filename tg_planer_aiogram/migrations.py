@@ -0,0 +1,325 @@
+import logging
+
+import aiosqlite
+import numpy as np
+
+from config import EMB_MODEL
+from vector_store import VectorStore, segment_path
+
+log = logging.getLogger("planner_bot")
+
+
+async def database_file(db: aiosqlite.Connection) -> str:
+    """Путь к файлу основной БД соединения"""
+    cur = await db.execute("PRAGMA database_list")
+    for _, name, path in await cur.fetchall():
+        if name == "main" and path:
+            return path
+    raise RuntimeError("Файловое хранилище векторов недоступно для БД в памяти")
+
+
+async def _move_embeddings_to_store(db: aiosqlite.Connection) -> None:
+    """Переносит BLOB-ы tasks.emb в файл векторов поколения 0"""
+    store = VectorStore(segment_path(await database_file(db), 0))
+    store.create()
+    moved = skipped = 0
+    try:
+        cur = await db.execute("SELECT id, emb FROM tasks WHERE emb IS NOT NULL ORDER BY id")
+        while rows := await cur.fetchmany(1000):
+            ids, vectors = [], []
+            for task_id, blob in rows:
+                vec = np.frombuffer(blob, dtype="float32")
+                dim = store.dim or (len(vectors[0]) if vectors else len(vec))
+                if len(vec) != dim:
+                    skipped += 1
+                    continue
+                ids.append(task_id)
+                vectors.append(vec)
+            if not ids:
+                continue
+            slots = store.append(np.vstack(vectors), sync=False)
+            await db.executemany(
+                "UPDATE tasks SET emb_slot = ? WHERE id = ?",
+                list(zip(slots, ids)),
+            )
+            moved += len(ids)
+        store.sync()
+    finally:
+        store.close()
+
+    await db.execute("INSERT OR REPLACE INTO vec_segment(id, generation) VALUES (1, 0)")
+    log.info(f"В файл векторов перенесено {moved} эмбеддингов")
+    if skipped:
+        log.warning(f"Пропущено {skipped} эмбеддингов другой размерности")
+
+
+async def _record_embedding_model(db: aiosqlite.Connection) -> None:
+    # До появления сменных движков все векторы считала модель EMB_MODEL
+    await db.execute(
+        "UPDATE tasks SET emb_model = ? WHERE emb_slot IS NOT NULL", (EMB_MODEL,)
+    )
+
+
+# Упорядоченный список миграций: (версия, описание, шаги).
+# Шаг - SQL-выражение или асинхронная функция, принимающая соединение.
+# Номер текущей версии схемы хранится в PRAGMA user_version.
+MIGRATIONS = [
+    (
+        1,
+        "Базовая схема: пользователи и задачи",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                nickname TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id      INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                title   TEXT    NOT NULL,
+                date    TEXT    NOT NULL,
+                time    TEXT    NOT NULL,
+                status  TEXT    NOT NULL DEFAULT 'pending',
+                emb     BLOB,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "Индексы для выборок по пользователю и по дате/времени",
+        [
+            # Покрывающий индекс для /today, /week, /list и подсчёта задач:
+            # все выбираемые столбцы (id - это rowid) лежат в самом индексе
+            """
+            CREATE INDEX IF NOT EXISTS idx_tasks_user_date_time
+            ON tasks(user_id, date, time, status, title)
+            """,
+            # Поиск задач на конкретный момент для напоминаний
+            """
+            CREATE INDEX IF NOT EXISTS idx_tasks_date_time_status
+            ON tasks(date, time, status)
+            """,
+        ],
+    ),
+    (
+        3,
+        "Целочисленный срок due_at (unix time) вместо сравнения строк",
+        [
+            "ALTER TABLE tasks ADD COLUMN due_at INTEGER",
+            # Модификатор 'utc' трактует строку как локальное время,
+            # так же как datetime.timestamp() для наивных дат в Python
+            """
+            UPDATE tasks
+            SET due_at = CAST(strftime('%s', date || ' ' || time, 'utc') AS INTEGER)
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_tasks_user_due ON tasks(user_id, due_at)",
+            # Просроченные задачи и напоминания: status = 'pending' AND due_at ...
+            "CREATE INDEX IF NOT EXISTS idx_tasks_status_due ON tasks(status, due_at)",
+            # Поиск по точным date/time больше не используется
+            "DROP INDEX IF EXISTS idx_tasks_date_time_status",
+        ],
+    ),
+    (
+        4,
+        "Удаление индекса (user_id, date, time): выборки идут по due_at",
+        [
+            # /list тоже упорядочен по due_at, а подсчёт задач пользователя
+            # обслуживает более узкий индекс (user_id, due_at)
+            "DROP INDEX IF EXISTS idx_tasks_user_date_time",
+        ],
+    ),
+    (
+        5,
+        "Постоянный кэш эмбеддингов по (модель, нормализованный текст)",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS emb_cache (
+                model TEXT NOT NULL,
+                text  TEXT NOT NULL,
+                emb   BLOB NOT NULL,
+                UNIQUE (model, text)
+            )
+            """,
+        ],
+    ),
+    (
+        6,
+        "Эмбеддинги задач в файле векторов (np.memmap) вместо BLOB в строках",
+        [
+            # Номер записи в файле векторов текущего поколения
+            "ALTER TABLE tasks ADD COLUMN emb_slot INTEGER",
+            # Текущее поколение файла: меняется вместе со слотами при уплотнении
+            """
+            CREATE TABLE IF NOT EXISTS vec_segment (
+                id         INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )
+            """,
+            _move_embeddings_to_store,
+            "ALTER TABLE tasks DROP COLUMN emb",
+        ],
+    ),
+    (
+        7,
+        "Версия движка эмбеддингов рядом с каждым вектором задачи",
+        [
+            "ALTER TABLE tasks ADD COLUMN emb_model TEXT",
+            _record_embedding_model,
+        ],
+    ),
+    (
+        8,
+        "Полнотекстовый индекс FTS5 по названиям задач",
+        [
+            # Таблица без копии текста (content=''): хранится только индекс.
+            # owner - метка пользователя 'u<id>', чтобы MATCH сразу отбирал
+            # задачи одного пользователя, а не все совпадения по базе.
+            # remove_diacritics не касается кириллицы, поэтому «ё» заменяется
+            # на «е» при индексации (и в запросе - см. database.fts_query)
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                title, owner,
+                content = '',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """,
+            """
+            INSERT INTO tasks_fts(rowid, title, owner)
+            SELECT id, replace(replace(title, 'ё', 'е'), 'Ё', 'Е'), 'u' || user_id FROM tasks
+            """,
+            # Для таблицы без текста удаление требует прежних значений столбцов
+            """
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+                INSERT INTO tasks_fts(rowid, title, owner)
+                VALUES (new.id, replace(replace(new.title, 'ё', 'е'), 'Ё', 'Е'), 'u' || new.user_id);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+                INSERT INTO tasks_fts(tasks_fts, rowid, title, owner)
+                VALUES ('delete', old.id, replace(replace(old.title, 'ё', 'е'), 'Ё', 'Е'), 'u' || old.user_id);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, user_id ON tasks BEGIN
+                INSERT INTO tasks_fts(tasks_fts, rowid, title, owner)
+                VALUES ('delete', old.id, replace(replace(old.title, 'ё', 'е'), 'Ё', 'Е'), 'u' || old.user_id);
+                INSERT INTO tasks_fts(rowid, title, owner)
+                VALUES (new.id, replace(replace(new.title, 'ё', 'е'), 'Ё', 'Е'), 'u' || new.user_id);
+            END
+            """,
+        ],
+    ),
+    (
+        9,
+        "Состояния диалогов FSM (aiogram) в БД вместо памяти процесса",
+        [
+            # key - ключ aiogram (бот, чат, пользователь, destiny), data - JSON
+            """
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key        TEXT PRIMARY KEY,
+                state      TEXT,
+                data       TEXT NOT NULL DEFAULT '{}',
+                updated_at INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """,
+            # Удаление брошенных диалогов по давности изменения
+            "CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at)",
+        ],
+    ),
+    (
+        10,
+        "Сброс кэша эмбеддингов: векторы считались по нормализованному тексту",
+        [
+            "DELETE FROM emb_cache",
+        ],
+    ),
+    (
+        11,
+        "Покрывающий индекс задач пользователя по сроку",
+        [
+            # Столбцы /today, /week, /list и поиска по номерам лежат в самом
+            # индексе; id стоит сразу за due_at, так что ORDER BY due_at, id
+            # и курсор (due_at, id) по-прежнему читаются одним диапазоном
+            """
+            CREATE INDEX IF NOT EXISTS idx_tasks_user_due_cover
+            ON tasks(user_id, due_at, id, status, title, date, time)
+            """,
+            "DROP INDEX IF EXISTS idx_tasks_user_due",
+        ],
+    ),
+]
+
+
+async def schema_version(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("PRAGMA user_version")
+    row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """
+    Применяет по порядку все миграции новее текущей версии схемы.
+    Каждая миграция выполняется в отдельной транзакции.
+    """
+    current = await schema_version(db)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+
+        # IMMEDIATE: блокировка записи берётся сразу, и версия перечитывается
+        # под ней - если процессов несколько, миграцию применит один из них
+        await db.execute("BEGIN IMMEDIATE")
+        current = await schema_version(db)
+        if version <= current:
+            await db.rollback()
+            continue
+
+        log.info(f"Миграция БД {current} -> {version}: {description}")
+        try:
+            for step in steps:
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            # PRAGMA не поддерживает параметры, версия - целое число из списка выше
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            log.error(f"Миграция {version} не применена, схема осталась в версии {current}")
+            raise
+        current = version
+
+    return current
+
+
+async def find_full_scans(
+    db: aiosqlite.Connection,
+    queries: dict[str, tuple[str, tuple]],
+) -> list[tuple[str, str]]:
+    """
+    Прогоняет EXPLAIN QUERY PLAN для запросов и возвращает те,
+    что по-прежнему читают таблицу или индекс целиком: [(имя, шаг плана)]
+    """
+    # EXPLAIN не сверяет версию схемы, поэтому соединение, открытое до
+    # миграций, строило бы план по старой схеме. Обычное чтение её обновит.
+    await db.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+
+    full_scans = []
+    for name, (sql, params) in queries.items():
+        cur = await db.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        for row in await cur.fetchall():
+            detail = row[-1]
+            # Виртуальные таблицы (FTS5) сами выбирают индекс: «INDEX 0:M...» -
+            # это поиск по MATCH, а не полный просмотр
+            if not detail.startswith("SCAN "):
+                continue
+            if "CONSTANT ROW" not in detail and "VIRTUAL TABLE INDEX" not in detail:
+                full_scans.append((name, detail))
+    return full_scans
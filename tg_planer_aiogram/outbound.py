@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+
+log = logging.getLogger("planner_bot")
+
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self) -> float:
+        """Забирает маркер и возвращает 0, либо возвращает сколько секунд ждать"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (wait := self.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Полная остановка выдачи маркеров (ответ 429 от Telegram)"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "text", "kwargs", "future", "created", "attempts")
+
+    def __init__(self, chat_id: int, text: str, kwargs: dict, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.created = time.monotonic()
+        self.attempts = 0
+
+
+class OutboundDispatcher:
+    """
+    Очередь исходящих сообщений с ограничением скорости.
+
+    Глобальная корзина держит общий лимит бота (~30 сообщений/с),
+    корзины чатов - лимит на чат (~1 сообщение/с). Сообщения одного чата
+    уходят по порядку, чаты обслуживаются по кругу. При 429 отправка
+    откладывается на retry_after со случайной добавкой, сообщения не теряются.
+    """
+
+    # Сколько корзин чатов держать до чистки простаивающих
+    MAX_IDLE_BUCKETS = 10_000
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        workers: int = 8,
+        max_retries: int = 5,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.workers_count = max(1, workers)
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._pending: dict[int, deque[_Job]] = {}
+        # Чаты, у которых есть сообщения и которые сейчас никто не обслуживает
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self._latencies: deque[float] = deque(maxlen=1000)
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker(), name=f"outbound-{i}")
+                for i in range(self.workers_count)
+            ]
+
+    async def stop(self, drain_timeout: float = 0) -> None:
+        """Остановить обработчики, по возможности дослав очередь за drain_timeout секунд"""
+        deadline = time.monotonic() + drain_timeout
+        while self.depth > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers.clear()
+
+        # Недосланные сообщения: отправитель, ждущий Future, получает ошибку, а не зависает
+        error = RuntimeError("Исходящая очередь остановлена, сообщение не отправлено")
+        for queue in self._pending.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(error)
+                    job.future.exception()
+                self.dropped += 1
+        self._pending.clear()
+        self._ready = asyncio.Queue()
+        self.depth = 0
+        if self.dropped > 0:
+            log.warning(f"При остановке не отправлено сообщений: {self.dropped}")
+        log.info(f"Исходящая очередь остановлена: {self.stats()}")
+
+    def enqueue(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь и сразу возвращает Future,
+        который завершится отправленным Message или ошибкой
+        """
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(chat_id, text, kwargs, future)
+
+        queue = self._pending.get(chat_id)
+        if queue is None:
+            self._pending[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+        else:
+            queue.append(job)
+        self.depth += 1
+        return future
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        """Отправить через очередь и дождаться результата"""
+        return await self.enqueue(chat_id, text, **kwargs)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "queue_depth": self.depth,
+            "chats_waiting": len(self._pending),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "latency_p50": round(percentile(0.50), 3),
+            "latency_p95": round(percentile(0.95), 3),
+            "latency_max": round(latencies[-1], 3) if latencies else 0.0,
+        }
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                self._prune_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        for chat_id in [
+            c for c, bucket in self._chat_buckets.items()
+            if c not in self._pending and bucket.is_idle()
+        ]:
+            del self._chat_buckets[chat_id]
+
+    def _requeue_later(self, chat_id: int, delay: float) -> None:
+        asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+
+            # Лимит чата ещё не восстановился - вернёмся к чату позже,
+            # не занимая обработчик ожиданием
+            wait = self._chat_bucket(chat_id).try_acquire()
+            if wait > 0:
+                self._requeue_later(chat_id, wait)
+                continue
+
+            await self._global.acquire()
+
+            queue = self._pending[chat_id]
+            job = queue[0]
+            delay = await self._deliver(job)
+
+            if delay is None:
+                queue.popleft()
+                self.depth -= 1
+
+            if not queue:
+                del self._pending[chat_id]
+            elif delay:
+                self._requeue_later(chat_id, delay)
+            else:
+                self._ready.put_nowait(chat_id)
+
+    async def _deliver(self, job: _Job) -> float | None:
+        """
+        Одна попытка отправки. Возвращает None, если сообщение обработано
+        (отправлено или окончательно не удалось), иначе паузу перед повтором
+        """
+        job.attempts += 1
+        try:
+            message = await self.bot.send_message(job.chat_id, job.text, **job.kwargs)
+        except TelegramRetryAfter as e:
+            # Пауза со случайной добавкой, чтобы повторы не пришли одной волной
+            delay = e.retry_after * (1 + random.uniform(0.05, 0.25))
+            self._chat_bucket(job.chat_id).pause(delay)
+            self._global.pause(e.retry_after)
+            self.retried += 1
+            log.warning(f"Flood control: чат {job.chat_id}, повтор через {delay:.1f} с")
+            return delay
+        except TelegramNetworkError as e:
+            if job.attempts <= self.max_retries:
+                delay = min(60.0, 2 ** job.attempts) * random.uniform(0.5, 1.0)
+                self.retried += 1
+                log.warning(f"Сетевая ошибка при отправке в чат {job.chat_id}: {e}")
+                return delay
+            self._fail(job, e)
+            return None
+        except TelegramAPIError as e:
+            # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+            self._fail(job, e)
+            return None
+        except Exception as e:
+            self._fail(job, e)
+            return None
+
+        self.sent += 1
+        self._latencies.append(time.monotonic() - job.created)
+        if not job.future.done():
+            job.future.set_result(message)
+        return None
+
+    def _fail(self, job: _Job, error: Exception) -> None:
+        self.failed += 1
+        log.error(f"Сообщение в чат {job.chat_id} не отправлено: {error}")
+        if not job.future.done():
+            job.future.set_exception(error)
+            # Ошибка уже залогирована: не даём asyncio ругаться на Future,
+            # результат которого отправитель не ждёт
+            job.future.exception()
@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import html
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
+
+import database
+
+log = logging.getLogger("planner_bot")
+
+
+def format_reminder(title: str, due_at: int) -> str:
+    when = datetime.fromtimestamp(due_at).strftime("%d.%m.%Y %H:%M")
+    return (
+        "⏰ <b>Напоминание!</b>\n"
+        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+        f"📝 <b>Задача:</b> {html.escape(title)}\n"
+        f"📅 <b>Когда:</b> <code>{when}</code>\n\n"
+        "💡 <i>Отметьте выполнение через /list и /done N</i>"
+    )
+
+
+class ReminderScheduler:
+    """
+    Отправляет напоминания в момент наступления срока задачи.
+
+    В памяти хранится min-куча (due_at, task_id) только на горизонт
+    вперёд (например, 24 часа); по мере движения времени куча
+    дозагружается из БД. Изменения задач приходят через database.add_listener.
+    В режиме с воркерами каждый напоминает только своим пользователям
+    (shard = (номер, всего)): их изменения проходят через этот же процесс.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[int, str], Awaitable[None]],
+        horizon: int = 24 * 3600,
+        shard: tuple[int, int] = (0, 1),
+    ):
+        self.send = send
+        self.horizon = horizon
+        self.shard = shard
+        self.sent = 0
+
+        self._heap: list[tuple[int, int]] = []
+        # task_id -> (due_at, user_id, title); записи кучи без пары здесь устарели
+        self._entries: dict[int, tuple[int, int, str]] = {}
+        self._loaded_until = 0
+        # Задачи и пользователи, удалённые во время чтения из БД при дозагрузке
+        self._removed_while_loading: set[tuple[str, int]] | None = None
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start(self) -> None:
+        if self._task is None:
+            database.add_listener(self._on_task_change)
+            self._task = asyncio.create_task(self._run(), name="reminder-scheduler")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        database.remove_listener(self._on_task_change)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _push(self, task_id: int, user_id: int, title: str, due_at: int) -> None:
+        # Задачи за горизонтом подтянутся при следующей дозагрузке
+        if due_at >= self._loaded_until:
+            return
+        self._entries[task_id] = (due_at, user_id, title)
+        heapq.heappush(self._heap, (due_at, task_id))
+
+        # Новая задача раньше текущего ближайшего срока - будим цикл
+        if self._heap[0][1] == task_id:
+            self._wakeup.set()
+
+    def _on_task_change(self, event: str, user_id: int | None, **info) -> None:
+        if event in ("insert", "undo"):
+            # Возвращённая в работу просроченная задача напоминания не получает
+            if info["due_at"] < database.current_minute_timestamp():
+                return
+            self._push(info["task_id"], user_id, info["title"], info["due_at"])
+        elif event in ("done", "delete"):
+            # Удаление ленивое: запись в куче пропустится при извлечении
+            self._entries.pop(info["task_id"], None)
+            if self._removed_while_loading is not None:
+                self._removed_while_loading.add(("task", info["task_id"]))
+        elif event == "delete_all":
+            for task_id in [t for t, entry in self._entries.items() if entry[1] == user_id]:
+                del self._entries[task_id]
+            if self._removed_while_loading is not None:
+                self._removed_while_loading.add(("user", user_id))
+
+    async def _refill(self, now: int) -> None:
+        previous = self._loaded_until
+        start = previous or now
+        end = now + self.horizon
+        # Горизонт сдвигается до чтения, чтобы не потерять задачи,
+        # добавленные пока выполняется запрос (повторы отсеет _entries)
+        self._loaded_until = end
+        self._removed_while_loading = set()
+        try:
+            rows = await database.fetch_pending_due_between(start, end, self.shard)
+            removed = self._removed_while_loading
+        except BaseException:
+            self._loaded_until = previous
+            raise
+        finally:
+            self._removed_while_loading = None
+
+        for task_id, user_id, title, due_at in rows:
+            if ("task", task_id) in removed or ("user", user_id) in removed:
+                continue
+            self._push(task_id, user_id, title, due_at)
+        log.debug(f"Напоминания: загружено {len(rows)}, в очереди {len(self._entries)}")
+
+    async def _fire_due(self, now: int) -> None:
+        while self._heap and self._heap[0][0] <= now:
+            due_at, task_id = heapq.heappop(self._heap)
+            entry = self._entries.get(task_id)
+            if entry is None or entry[0] != due_at:
+                continue
+            del self._entries[task_id]
+
+            _, user_id, title = entry
+            try:
+                await self.send(user_id, format_reminder(title, due_at))
+                self.sent += 1
+            except Exception as e:
+                log.error(f"Не удалось отправить напоминание о задаче {task_id}: {e}")
+
+    async def _run(self) -> None:
+        # Задачи текущей минуты ещё не просрочены - напоминаем и о них
+        await self._refill(database.current_minute_timestamp())
+
+        while True:
+            try:
+                now = int(time.time())
+                # Дозагружаем, когда до конца окна остаётся меньше половины горизонта
+                if self._loaded_until - now < self.horizon // 2:
+                    await self._refill(now)
+
+                await self._fire_due(now)
+
+                next_due = self._heap[0][0] if self._heap else self._loaded_until
+                next_refill = self._loaded_until - self.horizon // 2
+                delay = max(0.0, min(next_due, next_refill) - time.time())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Ошибка планировщика напоминаний: {e}")
+                delay = 5.0
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,371 @@
+import asyncio
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+import database
+from ann_index import IVFIndex, build_user_index
+from config import (
+    SEARCH_ANN_MIN_TASKS,
+    SEARCH_ANN_NLIST,
+    SEARCH_ANN_NPROBE,
+    SEARCH_FTS_CANDIDATES,
+    SEARCH_MEMORY_BUDGET_MB,
+    SEARCH_MODE,
+    SEARCH_RECENT_WINDOW,
+    SEARCH_RERANK_CANDIDATES,
+    SEARCH_RRF_K,
+)
+from embedding_backends import configured_version
+from vector_store import normalize_rows, quantize
+
+
+class SearchResult(NamedTuple):
+    """Найденная задача: косинус с запросом и признак совпадения слов (FTS5)"""
+
+    score: float
+    task_id: int
+    title: str
+    lexical: bool = False
+
+
+def inverse_norms(matrix: np.ndarray) -> np.ndarray:
+    """1/норма каждой строки (0 для нулевых строк)"""
+    norms = np.linalg.norm(matrix.astype("float32"), axis=1)
+    return np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+
+class UserVectors:
+    """
+    Эмбеддинги задач одного пользователя: матрица (float32, float16 или
+    int8) с запасом по ёмкости, обратные нормы строк, массив id и названия
+    в том же порядке. Косинус - это (строка · запрос) / норма строки, так
+    что масштаб int8-вектора сокращается и хранить его не нужно.
+    """
+
+    def __init__(self, ids: list[int], titles: list[str], matrix: np.ndarray):
+        self.size = len(ids)
+        capacity = max(16, self.size)
+        dim = matrix.shape[1]
+
+        self.matrix = np.zeros((capacity, dim), dtype=matrix.dtype)
+        self.matrix[:self.size] = matrix
+        self.inv_norms = np.zeros(capacity, dtype="float32")
+        self.inv_norms[:self.size] = inverse_norms(matrix)
+        self.ids = np.zeros(capacity, dtype="int64")
+        self.ids[:self.size] = ids
+        self.titles = list(titles)
+        self.rows = {task_id: row for row, task_id in enumerate(ids)}
+        # Приближённый индекс (IVF) для пользователей с большим числом задач
+        self.ann: IVFIndex | None = None
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def is_quantized(self) -> bool:
+        return self.matrix.dtype != np.float32
+
+    @property
+    def nbytes(self) -> int:
+        ann = self.ann.nbytes if self.ann is not None else 0
+        return self.matrix.nbytes + self.inv_norms.nbytes + self.ids.nbytes + ann
+
+    def add(self, task_id: int, title: str, vec: np.ndarray) -> None:
+        if task_id in self.rows:
+            return
+        if self.size == len(self.ids):
+            # Удвоение ёмкости: вставки обходятся в среднем в O(d)
+            self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.inv_norms = np.concatenate([self.inv_norms, np.zeros_like(self.inv_norms)])
+            self.ids = np.concatenate([self.ids, np.zeros_like(self.ids)])
+
+        row = quantize(vec.reshape(1, -1), self.matrix.dtype.name)["vec"]
+        self.matrix[self.size] = row[0]
+        self.inv_norms[self.size] = inverse_norms(row)[0]
+        self.ids[self.size] = task_id
+        self.titles.append(title)
+        self.rows[task_id] = self.size
+        self.size += 1
+        if self.ann is not None:
+            self.ann.add([task_id], vec.reshape(1, -1))
+
+    def remove(self, task_id: int) -> None:
+        row = self.rows.pop(task_id, None)
+        if row is None:
+            return
+        # Переносим последнюю строку на место удалённой
+        last = self.size - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.inv_norms[row] = self.inv_norms[last]
+            self.ids[row] = self.ids[last]
+            self.titles[row] = self.titles[last]
+            self.rows[int(self.ids[row])] = row
+        self.titles.pop()
+        self.size -= 1
+        if self.ann is not None:
+            self.ann.remove([task_id])
+
+    def top_k(self, query: np.ndarray, k: int) -> list[tuple[float, int, str]]:
+        """k лучших строк для нормированного запроса float32"""
+        if self.size == 0:
+            return []
+        if self.ann is not None:
+            return [
+                (score, task_id, self.titles[self.rows[task_id]])
+                for score, task_id in self.ann.search(query, k)
+            ]
+        if self.is_quantized:
+            # Для int8/float16 numpy умножает без BLAS: быстрее перевести
+            # матрицу во float32 блоками, не раздувая память на всю матрицу
+            scores = np.empty(self.size, dtype="float32")
+            for start in range(0, self.size, 8192):
+                block = self.matrix[start:min(self.size, start + 8192)]
+                scores[start:start + len(block)] = block.astype("float32") @ query
+        else:
+            scores = self.matrix[:self.size] @ query
+        scores *= self.inv_norms[:self.size]
+        k = min(k, self.size)
+        # argpartition отбирает k лучших за O(n), сортируются только они
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), int(self.ids[i]), self.titles[i]) for i in best]
+
+
+class SearchEngine:
+    """
+    Семантический поиск по задачам через матрично-векторное произведение.
+
+    Матрица пользователя строится лениво при первом поиске, затем
+    поддерживается по событиям database (добавление/удаление задач)
+    и вытесняется по LRU, когда суммарный объём превышает бюджет памяти.
+    Если матрица квантована, первые rerank_candidates задач пересчитываются
+    по точным векторам float32 из файла векторов. Участвуют только
+    векторы версии emb_model - той же, что и у векторов запросов.
+
+    В гибридном режиме матрица не нужна: кандидаты - совпадения слов
+    по FTS5 и последние задачи, векторы считаются только для них, а две
+    выдачи объединяются через reciprocal rank fusion.
+
+    Если у пользователя не меньше ann_min_tasks задач (0 - никогда),
+    матрица хранится во float32, а top-k ищется приближённо по его
+    собственному IVF-индексу: просматриваются ann_nprobe из ann_nlist
+    кластеров. Гибридный режим индекс не использует.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        rerank_candidates: int = 50,
+        emb_model: str | None = None,
+        hybrid: bool = False,
+        fts_candidates: int = 50,
+        recent_window: int = 100,
+        rrf_k: int = 60,
+        ann_min_tasks: int = 0,
+        ann_nlist: int = 256,
+        ann_nprobe: int = 8,
+    ):
+        self.memory_budget = memory_budget
+        self.rerank_candidates = rerank_candidates
+        self.emb_model = emb_model or configured_version()
+        self.hybrid = hybrid
+        self.fts_candidates = fts_candidates
+        self.recent_window = recent_window
+        self.rrf_k = rrf_k
+        self.ann_min_tasks = ann_min_tasks
+        self.ann_nlist = ann_nlist
+        self.ann_nprobe = ann_nprobe
+        self._users: OrderedDict[int, UserVectors] = OrderedDict()
+        # Пользователи, чья матрица сейчас строится: [число построений,
+        # счётчик изменений]. Матрица, во время чтения которой пришло
+        # изменение, не кэшируется; запись удаляется с последним построением
+        self._building: dict[int, list[int]] = {}
+        self._subscribed = False
+
+        self.builds = 0
+        self.evictions = 0
+
+    @property
+    def memory_used(self) -> int:
+        return sum(vectors.nbytes for vectors in self._users.values())
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "memory_used": self.memory_used,
+            "builds": self.builds,
+            "evictions": self.evictions,
+        }
+
+    def _on_task_change(self, event: str, user_id: int | None, **info) -> None:
+        building = self._building.get(user_id)
+        if building is not None:
+            building[1] += 1
+        vectors = self._users.get(user_id)
+        if vectors is None:
+            return
+
+        if event == "insert":
+            if info.get("emb") is not None and info.get("emb_model") == self.emb_model:
+                vec = np.frombuffer(info["emb"], dtype="float32")
+                if vec.shape[0] == vectors.dim:
+                    vectors.add(info["task_id"], info["title"], vec)
+                    self._enforce_budget(keep=user_id)
+        elif event == "delete":
+            vectors.remove(info["task_id"])
+        elif event == "expire":
+            for task_id in info["task_ids"]:
+                vectors.remove(task_id)
+        elif event in ("delete_all", "reembed"):
+            # После пересчёта эмбеддинга матрица перестроится при следующем поиске
+            del self._users[user_id]
+
+    async def _build(self, user_id: int) -> UserVectors | None:
+        if not self._subscribed:
+            database.add_listener(self._on_task_change)
+            self._subscribed = True
+
+        building = self._building.setdefault(user_id, [0, 0])
+        building[0] += 1
+        version = building[1]
+        try:
+            use_ann = (
+                self.ann_min_tasks > 0
+                and await database.count_user_tasks(user_id) >= self.ann_min_tasks
+            )
+            # Для IVF нужны точные векторы: по квантованным индекс не строится
+            ids, titles, matrix = await database.load_tasks_with_vectors(
+                user_id, self.emb_model, quantized=not use_ann
+            )
+            vectors = UserVectors(ids, titles, matrix) if ids else None
+            if vectors is not None and use_ann and len(ids) >= self.ann_min_tasks:
+                vectors.ann = await asyncio.to_thread(
+                    build_user_index, ids, matrix, self.ann_nlist, self.ann_nprobe
+                )
+        finally:
+            building[0] -= 1
+            if building[0] == 0:
+                del self._building[user_id]
+        if vectors is None:
+            return None
+
+        self.builds += 1
+
+        if building[1] == version:
+            self._users[user_id] = vectors
+            self._enforce_budget(keep=user_id)
+        return vectors
+
+    def _enforce_budget(self, keep: int) -> None:
+        used = self.memory_used
+        while used > self.memory_budget and len(self._users) > 1:
+            user_id = next(iter(self._users))
+            if user_id == keep:
+                self._users.move_to_end(user_id)
+                continue
+            used -= self._users.pop(user_id).nbytes
+            self.evictions += 1
+
+    async def search(
+        self,
+        user_id: int,
+        query_vec: np.ndarray,
+        k: int = 5,
+        query_text: str | None = None,
+    ) -> list[SearchResult]:
+        """
+        k самых похожих задач. В гибридном режиме (нужен query_text) порядок
+        задаёт объединённый рейтинг, сходство - косинус с запросом (0 для
+        задач без вектора), а lexical отмечает задачи, найденные по словам
+        """
+        if self.hybrid and query_text is not None:
+            return await self._hybrid_search(user_id, query_vec, query_text, k)
+
+        vectors = self._users.get(user_id)
+        if vectors is not None:
+            self._users.move_to_end(user_id)
+        else:
+            vectors = await self._build(user_id)
+            if vectors is None:
+                return []
+
+        # Нулевой запрос даёт нулевое сходство со всеми задачами, как cosine_sim
+        norm = np.linalg.norm(query_vec)
+        query = (query_vec / norm if norm > 0 else query_vec).astype("float32")
+        if not vectors.is_quantized:
+            return [SearchResult(*hit) for hit in vectors.top_k(query, k)]
+
+        candidates = vectors.top_k(query, max(k, self.rerank_candidates))
+        ids, full = await database.load_vectors(
+            user_id, [task_id for _, task_id, _ in candidates], self.emb_model
+        )
+        return [SearchResult(*hit) for hit in rerank(candidates, ids, full, query, k)]
+
+    async def _hybrid_search(
+        self,
+        user_id: int,
+        query_vec: np.ndarray,
+        query_text: str,
+        k: int,
+    ) -> list[SearchResult]:
+        lexical = await database.search_titles(user_id, query_text, self.fts_candidates)
+        recent = await database.recent_tasks(user_id, self.recent_window)
+        titles = dict(recent)
+        titles.update(lexical)
+        if not titles:
+            return []
+
+        ids, full = await database.load_vectors(user_id, list(titles), self.emb_model)
+        norm = np.linalg.norm(query_vec)
+        query = (query_vec / norm if norm > 0 else query_vec).astype("float32")
+        cosine = dict(zip(ids, (normalize_rows(full) @ query).tolist()))
+        semantic = sorted(cosine, key=cosine.get, reverse=True)
+
+        matched = [task_id for task_id, _ in lexical]
+        fused = reciprocal_rank_fusion([matched, semantic], self.rrf_k)
+        matched = set(matched)
+        return [
+            SearchResult(cosine.get(task_id, 0.0), task_id, titles[task_id], task_id in matched)
+            for task_id in fused[:k]
+        ]
+
+
+def reciprocal_rank_fusion(rankings: list[list[int]], k: int = 60) -> list[int]:
+    """Объединяет выдачи: у каждого id сумма 1 / (k + место) по всем выдачам"""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for place, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + place)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def rerank(
+    candidates: list[tuple[float, int, str]],
+    ids: list[int],
+    full: np.ndarray,
+    query: np.ndarray,
+    k: int,
+) -> list[tuple[float, int, str]]:
+    """Пересчитывает сходство кандидатов по точным векторам и оставляет k лучших"""
+    titles = {task_id: title for _, task_id, title in candidates}
+    scores = normalize_rows(full) @ query
+    order = np.argsort(-scores)[:k]
+    # Задача могла быть удалена между проходами - её в ids уже нет
+    return [(float(scores[i]), ids[i], titles[ids[i]]) for i in order]
+
+
+engine = SearchEngine(
+    SEARCH_MEMORY_BUDGET_MB * 1024 * 1024,
+    SEARCH_RERANK_CANDIDATES,
+    hybrid=SEARCH_MODE == "hybrid",
+    fts_candidates=SEARCH_FTS_CANDIDATES,
+    recent_window=SEARCH_RECENT_WINDOW,
+    rrf_k=SEARCH_RRF_K,
+    ann_min_tasks=SEARCH_ANN_MIN_TASKS,
+    ann_nlist=SEARCH_ANN_NLIST,
+    ann_nprobe=SEARCH_ANN_NPROBE,
+)
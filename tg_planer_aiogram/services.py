@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+
+import config
+import utils
+from fsm_storage import SQLiteStorage
+from outbound import OutboundDispatcher
+from reminders import ReminderScheduler
+from sweeper import ExpirySweeper
+
+log = logging.getLogger("planner_bot")
+
+
+class BotServices:
+    """
+    Фоновые службы процесса, обрабатывающего апдейты: прогрев модели
+    эмбеддингов, запись состояний диалогов, очистка просроченных задач,
+    исходящая очередь и напоминания. Общие для одиночного режима (main.py)
+    и процессов-воркеров (supervisor.py).
+
+    shard - (номер, всего): задачи каких пользователей достаются процессу;
+    общий лимит отправки делится между процессами поровну. Уплотнение
+    файла векторов и пересчёт эмбеддингов (maintenance) выполняет только
+    один процесс.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        storage: SQLiteStorage,
+        shard: tuple[int, int] = (0, 1),
+        maintenance: bool = True,
+    ):
+        self.bot = bot
+        self.storage = storage
+        self.maintenance = maintenance
+        self.sweeper = ExpirySweeper(config.SWEEP_INTERVAL, config.SWEEP_BATCH_SIZE, shard, compact=maintenance)
+        self.outbound = OutboundDispatcher(
+            bot,
+            global_rate=config.OUTBOUND_GLOBAL_RATE / shard[1],
+            chat_rate=config.OUTBOUND_CHAT_RATE,
+            workers=config.OUTBOUND_WORKERS,
+            max_retries=config.OUTBOUND_MAX_RETRIES,
+        )
+        self.reminders = ReminderScheduler(self._send_reminder, config.REMINDER_HORIZON, shard)
+        self.warmup: asyncio.Task | None = None
+        self._reembed: asyncio.Task | None = None
+
+    async def _send_reminder(self, user_id: int, text: str) -> None:
+        # Для личных чатов chat_id совпадает с user_id; не ждём доставки,
+        # чтобы пачка напоминаний на одно время сразу ушла в очередь
+        self.outbound.enqueue(user_id, text)
+
+    def warm_up(self) -> asyncio.Task:
+        """
+        Загрузка модели в пуле эмбеддингов параллельно с остальным запуском;
+        команды без эмбеддингов её не ждут
+        """
+        self.warmup = asyncio.create_task(utils.warm_up_embeddings(), name="embedding-warmup")
+        return self.warmup
+
+    def start(self) -> None:
+        """Запуск служб - когда БД уже открыта и готова"""
+        if self.maintenance:
+            self._reembed = asyncio.create_task(self._reembed_after_warmup(), name="reembed")
+        self.storage.start()
+        self.sweeper.start()
+        self.outbound.start()
+        self.reminders.start()
+
+    async def _reembed_after_warmup(self) -> None:
+        """Пересчёт эмбеддингов задач, сохранённых другим движком, когда модель готова"""
+        if self.warmup is not None:
+            try:
+                await self.warmup
+            except Exception:
+                pass
+        try:
+            updated = await utils.reembed_stale_tasks()
+        except Exception as e:
+            log.error(f"Ошибка пересчёта эмбеддингов: {e}")
+            return
+        if updated > 0:
+            log.info(f"Пересчитаны эмбеддинги {updated} задач ({utils.embedding_version()})")
+
+    async def stop(self) -> None:
+        """
+        Останавливает службы (и не запущенные тоже), досылая исходящую
+        очередь до OUTBOUND_DRAIN_TIMEOUT; пул соединений с БД закрывает
+        вызывающий
+        """
+        if self.warmup is not None:
+            self.warmup.cancel()
+        if self._reembed is not None:
+            self._reembed.cancel()
+        await self.reminders.stop()
+        await self.outbound.stop(config.OUTBOUND_DRAIN_TIMEOUT)
+        await self.sweeper.stop()
+        await self.storage.close()
+        utils.shutdown_embeddings()
+        await self.bot.session.close()
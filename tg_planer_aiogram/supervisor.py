@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+log = logging.getLogger("planner_bot")
+
+
+def shard_of(user_id: int, workers: int) -> int:
+    """Номер воркера пользователя (то же, что user_id % ? = ? в запросах database)"""
+    return user_id % workers
+
+
+class _Worker:
+    """Процесс-воркер глазами супервизора: очередь апдейтов и счётчики"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: multiprocessing.Process | None = None
+        self.updates: multiprocessing.Queue | None = None
+        self.sent = 0
+        self.processed = 0
+        self.reported = 0
+        self.last_heartbeat = 0.0
+        # Первый пульс после запуска: до него действует start_timeout
+        self.started = False
+        self.restarts = 0
+
+
+class Supervisor:
+    """
+    Режим с несколькими процессами: этот процесс только принимает апдейты
+    (polling или webhook) и раздаёт их workers процессам-воркерам по
+    user_id % workers. Все апдейты пользователя попадают в один воркер,
+    поэтому его FSM-состояние, кэши и порядок команд остаются в одном месте,
+    а эмбеддинги и работа с БД занимают все ядра.
+
+    Воркер раз в heartbeat_interval присылает пульс со счётчиком
+    обработанных апдейтов. Воркер, который завершился или молчит дольше
+    heartbeat_timeout (после запуска - start_timeout), перезапускается;
+    апдейты из его очереди переходят новому процессу. Раз в report_interval
+    в лог пишется пропускная способность каждого воркера.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        heartbeat_interval: float = 5.0,
+        heartbeat_timeout: float = 30.0,
+        start_timeout: float = 120.0,
+        report_interval: float = 60.0,
+    ):
+        # spawn, а не fork: родитель уже запустил event loop и потоки
+        self._ctx = multiprocessing.get_context("spawn")
+        self._status = self._ctx.Queue()
+        self.workers = [_Worker(index) for index in range(workers)]
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.start_timeout = start_timeout
+        self.report_interval = report_interval
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        for worker in self.workers:
+            self._spawn(worker)
+        self._tasks = [
+            asyncio.create_task(self._read_status(), name="supervisor-status"),
+            asyncio.create_task(self._monitor(), name="supervisor-monitor"),
+        ]
+        log.info(f"Запущено воркеров: {len(self.workers)}")
+
+    def _spawn(self, worker: _Worker) -> None:
+        old_updates = worker.updates
+        worker.updates = self._ctx.Queue()
+        if old_updates is not None:
+            # Очередь могла остаться заблокированной упавшим процессом -
+            # забираем без ожидания то, что удастся, и переносим в новую
+            moved = 0
+            while True:
+                try:
+                    worker.updates.put(old_updates.get_nowait())
+                    moved += 1
+                except (queue.Empty, OSError, EOFError):
+                    break
+            lost = worker.sent - worker.processed - moved
+            if lost > 0:
+                # Счётчик обработанных отстаёт на пульс, поэтому оценка сверху
+                log.warning(f"Воркер {worker.index}: потеряно до {lost} апдейтов")
+            worker.sent = worker.processed + moved
+
+        worker.process = self._ctx.Process(
+            target=worker_main,
+            args=(worker.index, len(self.workers), worker.updates, self._status, self.heartbeat_interval),
+            name=f"planner-worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.last_heartbeat = time.monotonic()
+        worker.started = False
+        # Счётчик нового процесса начинается с нуля
+        worker.reported = worker.processed
+
+    def dispatch(self, user_id: int, update: dict) -> None:
+        worker = self.workers[shard_of(user_id, len(self.workers))]
+        worker.updates.put((user_id, update))
+        worker.sent += 1
+
+    def _get_status(self) -> tuple | None:
+        try:
+            return self._status.get(timeout=1.0)
+        except queue.Empty:
+            return None
+
+    async def _read_status(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self._get_status)
+            if message is None:
+                continue
+            kind, index, pid, processed = message
+            worker = self.workers[index]
+            if pid != worker.process.pid:
+                # Запоздавший пульс уже перезапущенного процесса
+                continue
+            worker.last_heartbeat = time.monotonic()
+            worker.started = True
+            worker.processed = worker.reported + processed
+            if kind == "ready":
+                log.info(f"Воркер {index} готов (pid {pid})")
+
+    async def _monitor(self) -> None:
+        next_report = time.monotonic() + self.report_interval
+        last = {worker.index: worker.processed for worker in self.workers}
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for worker in self.workers:
+                if self._stopping:
+                    return
+                timeout = self.heartbeat_timeout if worker.started else self.start_timeout
+                if not worker.process.is_alive():
+                    log.error(f"Воркер {worker.index} завершился (код {worker.process.exitcode}), перезапуск")
+                elif now - worker.last_heartbeat > timeout:
+                    log.error(f"Воркер {worker.index} не отвечает {now - worker.last_heartbeat:.0f} с, перезапуск")
+                    worker.process.kill()
+                    await asyncio.to_thread(worker.process.join, 5)
+                else:
+                    continue
+                worker.restarts += 1
+                self._spawn(worker)
+
+            if now >= next_report:
+                elapsed = self.report_interval + (now - next_report)
+                log.info("Воркеры: " + "; ".join(
+                    f"№{w.index}: {(w.processed - last[w.index]) / elapsed:.1f} апд/с, "
+                    f"в очереди {w.sent - w.processed}, перезапусков {w.restarts}"
+                    for w in self.workers
+                ))
+                last = {worker.index: worker.processed for worker in self.workers}
+                next_report = now + self.report_interval
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "worker": worker.index,
+                "pid": worker.process.pid if worker.process else None,
+                "sent": worker.sent,
+                "processed": worker.processed,
+                "restarts": worker.restarts,
+            }
+            for worker in self.workers
+        ]
+
+    async def stop(self, timeout: float = 15.0) -> None:
+        """Воркеры дообрабатывают свои очереди не дольше timeout секунд"""
+        self._stopping = True
+        for worker in self.workers:
+            worker.updates.put(None)
+
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            await asyncio.to_thread(worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                # SIGTERM воркер игнорирует
+                log.warning(f"Воркер {worker.index} не остановился за {timeout} с, завершаем")
+                worker.process.kill()
+                await asyncio.to_thread(worker.process.join, 5)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Последние пульсы со счётчиками
+        while (message := self._get_status_nowait()) is not None:
+            kind, index, pid, processed = message
+            worker = self.workers[index]
+            if pid == worker.process.pid:
+                worker.processed = worker.reported + processed
+        log.info(f"Воркеры остановлены: {self.stats()}")
+
+    def _get_status_nowait(self) -> tuple | None:
+        try:
+            return self._status.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class FanOut(BaseMiddleware):
+    """
+    Внешний middleware апдейтов процесса-супервизора: вместо обработки
+    передаёт апдейт воркеру его пользователя
+    """
+
+    def __init__(self, supervisor: Supervisor):
+        self.supervisor = supervisor
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        # Апдейты без пользователя (например, опросы в каналах) - первому воркеру
+        self.supervisor.dispatch(user.id if user else 0, event.model_dump(mode="json", exclude_none=True))
+        return None
+
+
+def worker_main(
+    index: int,
+    workers: int,
+    updates: multiprocessing.Queue,
+    status: multiprocessing.Queue,
+    heartbeat_interval: float,
+) -> None:
+    """Точка входа процесса-воркера"""
+    # Сигналы остановки получает вся группа процессов; воркеров
+    # останавливает супервизор, дав им дообработать очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s | %(levelname)s | %(name)s[w{index}] | %(message)s",
+    )
+    logging.getLogger("aiogram").setLevel(logging.ERROR)
+    asyncio.run(_run_worker(index, workers, updates, status, heartbeat_interval))
+
+
+async def _run_worker(
+    index: int,
+    workers: int,
+    updates: multiprocessing.Queue,
+    status: multiprocessing.Queue,
+    heartbeat_interval: float,
+) -> None:
+    # Модули бота импортируются уже в процессе-воркере
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+
+    import config
+    import database
+    import handlers
+    from fsm_storage import SQLiteStorage
+    from services import BotServices
+    from webhook import ConcurrencyLimit
+
+    processed = 0
+
+    async def heartbeat() -> None:
+        while True:
+            status.put(("heartbeat", index, os.getpid(), processed))
+            await asyncio.sleep(heartbeat_interval)
+
+    pulse = asyncio.create_task(heartbeat(), name="worker-heartbeat")
+
+    bot = Bot(token=config.TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    storage = SQLiteStorage(config.FSM_TTL, config.FSM_FLUSH_INTERVAL, config.FSM_FLUSH_BATCH, config.FSM_IDLE)
+    shard = (index, workers)
+    # shard попадает в обработчики: /cleanup удаляет только задачи своих пользователей
+    dp = Dispatcher(storage=storage, shard=shard)
+    dp.update.outer_middleware(ConcurrencyLimit(config.UPDATE_CONCURRENCY))
+    handlers.register_handlers(dp)
+
+    # Уплотнение файла векторов и пересчёт эмбеддингов - только в одном воркере
+    services = BotServices(bot, storage, shard, maintenance=index == 0)
+    services.warm_up()
+    await database.open_pool()
+    # Схему и файлы векторов уже подготовил супервизор
+    await database.attach_db()
+    services.start()
+    status.put(("ready", index, os.getpid(), processed))
+
+    # Апдейты одного пользователя обрабатываются по очереди, разных - параллельно
+    tails: dict[int, asyncio.Task] = {}
+
+    async def process(user_id: int, update: dict, previous: asyncio.Task | None) -> None:
+        nonlocal processed
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            log.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+        finally:
+            processed += 1
+            if tails.get(user_id) is asyncio.current_task():
+                del tails[user_id]
+
+    parent = multiprocessing.parent_process()
+
+    def get_update():
+        while True:
+            try:
+                return updates.get(timeout=1.0)
+            except queue.Empty:
+                # Супервизор завершился аварийно - останавливаемся сами
+                if parent is not None and not parent.is_alive():
+                    return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        while (item := await loop.run_in_executor(None, get_update)) is not None:
+            user_id, update = item
+            tails[user_id] = asyncio.create_task(process(user_id, update, tails.get(user_id)))
+        if tails:
+            await asyncio.wait(list(tails.values()))
+    finally:
+        await services.stop()
+        await database.close_pool()
+        pulse.cancel()
+        status.put(("heartbeat", index, os.getpid(), processed))
+
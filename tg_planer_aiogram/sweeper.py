@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+import database
+
+log = logging.getLogger("planner_bot")
+
+
+class ExpirySweeper:
+    """
+    Периодически удаляет просроченные задачи в фоне,
+    чтобы обработчики просмотра только читали из БД.
+
+    В режиме с воркерами каждый чистит задачи своих пользователей
+    (shard = (номер, всего)), а файл векторов уплотняет только один
+    (compact=True)
+    """
+
+    def __init__(self, interval: float, batch_size: int, shard: tuple[int, int] = (0, 1), compact: bool = True):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.shard = shard
+        self.compact = compact
+        self.runs = 0
+        self.last_deleted = 0
+        self.total_deleted = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="expiry-sweeper")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def sweep_once(self) -> int:
+        deleted_count = await database.delete_expired_tasks(self.batch_size, self.shard)
+        self.runs += 1
+        self.last_deleted = deleted_count
+        self.total_deleted += deleted_count
+
+        if deleted_count > 0:
+            log.info(f"Фоновая очистка: удалено {deleted_count} просроченных задач")
+        else:
+            log.debug("Фоновая очистка: просроченных задач нет")
+
+        # Удалённые задачи оставляют записи в файле векторов
+        if self.compact:
+            await database.compact_vectors_if_needed()
+        return deleted_count
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Ошибка фоновой очистки: {e}")
+            await asyncio.sleep(self.interval)
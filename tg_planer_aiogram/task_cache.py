@@ -0,0 +1,185 @@
+import sys
+from collections import OrderedDict
+from datetime import datetime
+
+import database
+from config import TASK_CACHE_MEMORY_BUDGET_MB
+
+
+def _rows_size(rows: list) -> int:
+    """Примерный объём строк выборки в памяти, байт"""
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows
+    )
+
+
+class _Entry:
+    __slots__ = ("rows", "valid_until", "nbytes")
+
+    def __init__(self, rows: list, valid_until: int | None):
+        self.rows = rows
+        self.valid_until = valid_until
+        self.nbytes = _rows_size(rows)
+
+
+class TaskCache:
+    """
+    Кэш списков задач для /today, /week и /list: строки выборок
+    fetch_tasks_for_date, fetch_tasks_for_dates и fetch_tasks_page по
+    пользователю и параметрам запроса.
+
+    Записи пользователя сбрасываются событиями database при любом
+    изменении его задач. Без записи в БД выборка меняется только со
+    временем: невыполненная задача пропадает, когда проходит её срок, -
+    поэтому запись действительна до ближайшего срока невыполненной задачи
+    в ней. При смене даты кэш очищается целиком. Общий объём ограничен
+    бюджетом памяти с вытеснением по LRU.
+    """
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._keys_by_user: dict[int, set[tuple]] = {}
+        # Пользователи с незавершёнными выборками: [число выборок, счётчик
+        # изменений]. Выборка, во время которой пользователь изменился, могла
+        # прочитать старые данные и не кэшируется. Запись удаляется вместе с
+        # последней выборкой, так что словарь не растёт с числом пользователей
+        self._reading: dict[int, list[int]] = {}
+        self._day = datetime.now().date()
+        self._subscribed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "users": len(self._keys_by_user),
+            "memory_used": self.memory_used,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_user.clear()
+        self.memory_used = 0
+
+    def _on_task_change(self, event: str, user_id: int | None, **info) -> None:
+        if event == "reembed":
+            # Эмбеддинг в списки задач не попадает
+            return
+        reading = self._reading.get(user_id)
+        if reading is not None:
+            reading[1] += 1
+        keys = self._keys_by_user.pop(user_id, None)
+        if keys:
+            self.invalidations += 1
+            for key in keys:
+                self.memory_used -= self._entries.pop(key).nbytes
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self.memory_used -= entry.nbytes
+        keys = self._keys_by_user[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_user[key[0]]
+
+    def _lookup(self, key: tuple) -> list | None:
+        today = datetime.now().date()
+        if today != self._day:
+            self._day = today
+            self.clear()
+
+        entry = self._entries.get(key)
+        if entry is not None and (
+            entry.valid_until is None or database.current_minute_timestamp() <= entry.valid_until
+        ):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.rows
+        if entry is not None:
+            self._drop(key)
+        self.misses += 1
+        return None
+
+    def _store(self, key: tuple, rows: list, valid_until: int | None) -> None:
+        user_id = key[0]
+        if key in self._entries:
+            return
+        entry = _Entry(rows, valid_until)
+        if entry.nbytes > self.memory_budget:
+            return
+        self._entries[key] = entry
+        self._keys_by_user.setdefault(user_id, set()).add(key)
+        self.memory_used += entry.nbytes
+        while self.memory_used > self.memory_budget:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def _read(self, key: tuple, fetch, due_of) -> list:
+        if not self._subscribed:
+            database.add_listener(self._on_task_change)
+            self._subscribed = True
+
+        rows = self._lookup(key)
+        if rows is not None:
+            return rows
+
+        user_id = key[0]
+        reading = self._reading.setdefault(user_id, [0, 0])
+        reading[0] += 1
+        version = reading[1]
+        try:
+            rows = await fetch()
+        finally:
+            reading[0] -= 1
+            if reading[0] == 0:
+                del self._reading[user_id]
+        if reading[1] != version:
+            return rows
+
+        pending_due = [due_of(row) for row in rows if row[-1] != "done"]
+        self._store(key, rows, min(pending_due) if pending_due else None)
+        return rows
+
+    async def fetch_tasks_for_date(self, user_id: int, date_str: str):
+        return await self._read(
+            (user_id, "date", date_str),
+            lambda: database.fetch_tasks_for_date(user_id, date_str),
+            lambda row: database.due_timestamp(date_str, row[2]),
+        )
+
+    async def fetch_tasks_for_dates(self, user_id: int, date_list: list[str]):
+        return await self._read(
+            (user_id, "dates", tuple(date_list)),
+            lambda: database.fetch_tasks_for_dates(user_id, date_list),
+            lambda row: database.due_timestamp(row[2], row[3]),
+        )
+
+    async def fetch_tasks_page(
+        self,
+        user_id: int,
+        cursor: tuple[int, int] | None,
+        limit: int,
+        backward: bool = False,
+    ):
+        return await self._read(
+            (user_id, "page", cursor, limit, backward),
+            lambda: database.fetch_tasks_page(user_id, cursor, limit, backward),
+            lambda row: row[1],
+        )
+
+
+cache = TaskCache(TASK_CACHE_MEMORY_BUDGET_MB * 1024 * 1024)
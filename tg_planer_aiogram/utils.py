@@ -1,10 +1,33 @@
+import asyncio
+import logging
+import re
+import threading
+import time
 import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from sentence_transformers import SentenceTransformer
-from config import EMB_MODEL
-
-# Инициализация модели эмбеддингов
-embedder = SentenceTransformer(EMB_MODEL)
+from config import (
+    EMB_BATCH_SIZE,
+    EMB_BATCH_WAIT_MS,
+    EMB_CACHE_SIZE,
+    EMB_EXECUTOR,
+    EMB_WORKERS,
+)
+import database
+from embedding_backends import EmbeddingBackend, configured_version, create_backend
+from embedding_cache import EmbeddingCache, normalize_text
+from embedding_service import EmbeddingBatcher
+
+log = logging.getLogger("planner_bot")
+
+# Модель эмбеддингов загружается при первом обращении (или прогревом из main)
+_embedder = None
+_embedder_lock = threading.Lock()
+
+# Пул, в котором считаются эмбеддинги, чтобы не блокировать event loop
+_emb_executor: Executor | None = None
+_emb_batcher: EmbeddingBatcher | None = None
+_emb_cache = EmbeddingCache(configured_version(), EMB_CACHE_SIZE)
 
 
 def current_date() -> str:
@@ -68,11 +91,151 @@ def format_date_display(date_str: str) -> str:
         return date_str
 
 
+# Номер или диапазон "5-8": только ASCII-цифры (isdigit пропускает "²")
+_TASK_NUMBERS_RE = re.compile(r"([0-9]+)(?:-([0-9]+))?")
+
+
+def parse_task_numbers(text: str, max_count: int = 100) -> list[int] | None:
+    """
+    Парсит номера задач вида "1 3 5-8" (можно через запятую).
+    Возвращает отсортированные номера без повторов или None, если формат
+    неверный, номер больше database.MAX_TASK_NUMBER или номеров больше max_count
+    """
+    numbers = set()
+    for part in text.replace(",", " ").split():
+        match = _TASK_NUMBERS_RE.fullmatch(part)
+        if match is None:
+            return None
+        first, last = match.groups()
+        start, end = int(first), int(last) if last else int(first)
+        if start < 1 or end < start or end > database.MAX_TASK_NUMBER or end - start + 1 > max_count:
+            return None
+        numbers.update(range(start, end + 1))
+        if len(numbers) > max_count:
+            return None
+    return sorted(numbers) or None
+
+
+def get_embedder() -> EmbeddingBackend:
+    """Движок эмбеддингов из config; библиотеки и модель загружаются при первом вызове"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                started = time.perf_counter()
+                backend = create_backend()
+                backend.load()
+                _embedder = backend
+                log.info(f"Эмбеддинги {backend.version} загружены за {time.perf_counter() - started:.1f} с")
+    return _embedder
+
+
+def embedding_version() -> str:
+    """Версия векторов, которую записывают рядом с эмбеддингами задач"""
+    return configured_version()
+
+
+def is_embedder_loaded() -> bool:
+    return _embedder is not None
+
+
 def make_embedding(text: str) -> np.ndarray:
-    vec = embedder.encode([text])[0].astype("float32")
+    vec = get_embedder().encode([text])[0].astype("float32")
     return vec
 
 
+def make_embeddings(texts: list[str]) -> np.ndarray:
+    """Эмбеддинги пачки текстов одним вызовом модели"""
+    return get_embedder().encode(texts).astype("float32")
+
+
+def _get_emb_executor() -> Executor:
+    global _emb_executor
+    if _emb_executor is None:
+        if EMB_EXECUTOR == "process":
+            _emb_executor = ProcessPoolExecutor(max_workers=EMB_WORKERS)
+        else:
+            _emb_executor = ThreadPoolExecutor(
+                max_workers=EMB_WORKERS, thread_name_prefix="embedder"
+            )
+    return _emb_executor
+
+
+def _get_emb_batcher() -> EmbeddingBatcher:
+    global _emb_batcher
+    if _emb_batcher is None:
+        _emb_batcher = EmbeddingBatcher(
+            make_embeddings,
+            _get_emb_executor(),
+            max_batch=EMB_BATCH_SIZE,
+            max_wait_ms=EMB_BATCH_WAIT_MS,
+        )
+    return _emb_batcher
+
+
+async def warm_up_embeddings() -> None:
+    """
+    Загружает модель в пуле эмбеддингов заранее, пока бот проверяет токен
+    и готовит БД. В пуле процессов модель своя в каждом процессе,
+    поэтому прогревается каждый из них.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_emb_executor()
+    workers = EMB_WORKERS if EMB_EXECUTOR == "process" else 1
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, make_embeddings, ["прогрев"])
+        for _ in range(workers)
+    ))
+
+
+async def reembed_stale_tasks(batch_size: int = 64) -> int:
+    """
+    Пересчитывает эмбеддинги задач, сохранённых другим движком или моделью
+    (или оставшихся без вектора). Возвращает количество обновлённых задач.
+    """
+    version = embedding_version()
+    updated = 0
+    after_id = 0
+    while rows := await database.fetch_tasks_with_stale_embedding(version, after_id, batch_size):
+        vectors = await asyncio.gather(*(make_embedding_async(title) for _, _, title in rows))
+        for (task_id, user_id, _), vec in zip(rows, vectors):
+            if await database.update_task_embedding(user_id, task_id, emb_to_blob(vec), version):
+                updated += 1
+        after_id = rows[-1][0]
+    return updated
+
+
+async def make_embedding_async(text: str) -> np.ndarray:
+    """
+    Эмбеддинг текста в отдельном пуле, event loop в это время свободен.
+    Повторы берутся из кэша, одновременные промахи объединяются
+    в один пакетный encode.
+    """
+    # Ключ кэша - нормализованный текст, а модель получает текст как есть
+    return await _emb_cache.get_or_compute(
+        normalize_text(text), lambda: _get_emb_batcher().embed(text)
+    )
+
+
+def embedding_stats() -> dict:
+    """Статистика кэша и размеров пачек (для настройки EMB_CACHE_SIZE и EMB_BATCH_*)"""
+    return {
+        "cache": _emb_cache.stats(),
+        "batches": _emb_batcher.stats() if _emb_batcher is not None else {},
+    }
+
+
+def shutdown_embeddings() -> None:
+    """Остановить пул эмбеддингов (вызывается при остановке бота)"""
+    global _emb_executor, _emb_batcher
+    if _emb_batcher is not None:
+        log.info(f"Эмбеддинги: {embedding_stats()}")
+        _emb_batcher = None
+    if _emb_executor is not None:
+        _emb_executor.shutdown(wait=False, cancel_futures=True)
+        _emb_executor = None
+
+
 def emb_to_blob(vec: np.ndarray) -> bytes:
     return vec.tobytes()
 
@@ -0,0 +1,242 @@
+import glob
+import os
+import struct
+
+import numpy as np
+
+# Заголовок файла: сигнатура, размерность векторов, формат записей
+_HEADER = struct.Struct("<8sII")
+_MAGIC = b"PLNVEC01"
+
+# Форматы записей: номер в заголовке файла
+KINDS = {"float32": 0, "float16": 1, "int8": 2}
+
+
+def record_dtype(kind: str, dim: int) -> np.dtype:
+    """Запись файла: вектор, для int8 - ещё и масштаб вектора"""
+    if kind == "float32":
+        return np.dtype([("vec", "<f4", (dim,))])
+    if kind == "float16":
+        return np.dtype([("vec", "<f2", (dim,))])
+    if kind == "int8":
+        return np.dtype([("scale", "<f4"), ("vec", "i1", (dim,))])
+    raise ValueError(f"Неизвестный формат векторов: {kind}")
+
+
+def quantize(vectors: np.ndarray, kind: str) -> np.ndarray:
+    """Переводит векторы float32 в записи формата kind"""
+    vectors = np.asarray(vectors, dtype="float32")
+    records = np.zeros(len(vectors), dtype=record_dtype(kind, vectors.shape[1]))
+    if kind == "int8":
+        # Симметричное квантование: максимум модуля вектора переходит в 127
+        scale = np.abs(vectors).max(axis=1) / 127
+        scale[scale == 0] = 1.0
+        records["scale"] = scale
+        records["vec"] = np.clip(np.rint(vectors / scale[:, None]), -127, 127)
+    else:
+        records["vec"] = vectors
+    return records
+
+
+def dequantize(records: np.ndarray) -> np.ndarray:
+    """Восстанавливает float32 из записей любого формата"""
+    vectors = records["vec"].astype("float32")
+    if "scale" in records.dtype.names:
+        vectors *= records["scale"][:, None]
+    return vectors
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Делит строки на их нормы; нулевые строки остаются нулевыми"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def segment_path(db_path: str, generation: int, suffix: str = "vec") -> str:
+    """Файл векторов заданного поколения рядом с файлом БД"""
+    return f"{db_path}.{suffix}.{generation}"
+
+
+def remove_stale_segments(db_path: str, generation: int, keep: list[str]) -> list[str]:
+    """
+    Удаляет файлы векторов поколений до generation и файлы этого поколения
+    кроме keep (остатки уплотнения и старых форматов). Более новые поколения
+    не трогаются: их может сейчас писать уплотнение в другом процессе
+    """
+    removed = []
+    keep = {os.path.abspath(path) for path in keep}
+    for path in glob.glob(glob.escape(db_path) + ".vec*.*"):
+        suffix = path.rsplit(".", 1)[1]
+        if os.path.abspath(path) in keep or (suffix.isdigit() and int(suffix) > generation):
+            continue
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            # Файл ещё отображён в память (Windows) - удалим при следующем запуске
+            pass
+    return removed
+
+
+class VectorStore:
+    """
+    Файл эмбеддингов только для дозаписи: заголовок и подряд идущие
+    записи формата kind (float32, float16 или int8 с масштабом).
+    Задача хранит номер своей записи (слот), векторы читаются через
+    np.memmap без разбора BLOB-ов по одному.
+
+    Удалённые задачи оставляют в файле «дыры»; их убирает уплотнение -
+    переписывание живых векторов в файл следующего поколения.
+    Дозапись идёт только в конец: запись, оборванная сбоем, отрезается
+    при открытии, а уже сохранённые векторы не меняются.
+    """
+
+    def __init__(self, path: str, generation: int = 0, kind: str = "float32"):
+        self.path = path
+        self.generation = generation
+        self.kind = kind
+        self.dim = 0
+        self.count = 0
+
+        self._file = None
+        self._map: np.memmap | None = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def record_size(self) -> int:
+        return record_dtype(self.kind, self.dim).itemsize
+
+    @property
+    def nbytes(self) -> int:
+        return self.count * self.record_size
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def create(self, dim: int = 0) -> None:
+        """Создаёт пустой файл (существующий перезаписывается) и открывает его"""
+        with open(self.path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, dim, KINDS[self.kind]))
+            f.flush()
+            os.fsync(f.fileno())
+        self.open()
+
+    def open(self) -> None:
+        if self.is_open:
+            return
+        if not os.path.exists(self.path):
+            self.create()
+            return
+
+        self._file = open(self.path, "r+b")
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            self.close()
+            raise ValueError(f"Повреждён заголовок файла векторов {self.path}")
+        magic, self.dim, kind_code = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} не является файлом векторов")
+        # Формат определяется файлом, а не тем, с каким kind его открыли
+        self.kind = next(name for name, code in KINDS.items() if code == kind_code)
+
+        self.refresh()
+
+    def refresh(self, truncate: bool = True) -> None:
+        """
+        Перечитывает размер файла: записи могли дописать другие процессы.
+        С truncate=True отрезает хвост недописанной записи - только когда
+        никто не дописывает файл (при открытии или под блокировкой записи БД)
+        """
+        if self.dim == 0:
+            self._file.seek(0)
+            _, self.dim, _ = _HEADER.unpack(self._file.read(_HEADER.size))
+        data_size = os.path.getsize(self.path) - _HEADER.size
+        if self.dim == 0:
+            self.count = 0
+            tail = data_size
+        else:
+            self.count = data_size // self.record_size
+            tail = data_size % self.record_size
+        if tail and truncate:
+            # Хвост недописанной записи после сбоя: слот ей ещё не выдан
+            self._file.truncate(_HEADER.size + self.count * self.record_size)
+
+    def close(self) -> None:
+        self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, vectors: np.ndarray, sync: bool = True) -> range:
+        """
+        Дописывает векторы float32 (квантуя их под формат файла) в конец
+        и возвращает их слоты. С sync=True данные сбрасываются на диск
+        до того, как слоты будут сохранены в БД.
+        """
+        vectors = np.asarray(vectors, dtype="float32")
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if self.dim == 0:
+            self.dim = vectors.shape[1]
+            self._file.seek(0)
+            self._file.write(_HEADER.pack(_MAGIC, self.dim, KINDS[self.kind]))
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Размерность {vectors.shape[1]} не совпадает с {self.dim}")
+
+        start = self.count
+        self._file.seek(_HEADER.size + start * self.record_size)
+        self._file.write(quantize(vectors, self.kind).tobytes())
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        self.count += len(vectors)
+        return range(start, self.count)
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def records(self) -> np.ndarray:
+        """Все записи файла: отображение в память, без копирования"""
+        dtype = record_dtype(self.kind, self.dim)
+        if self.count == 0:
+            return np.zeros(0, dtype=dtype)
+        if self._map is None or len(self._map) < self.count:
+            self._map = np.memmap(
+                self.path,
+                dtype=dtype,
+                mode="r",
+                offset=_HEADER.size,
+                shape=(self.count,),
+            )
+        return self._map[:self.count]
+
+    def get_records(self, slots) -> np.ndarray:
+        """
+        Записи по слотам. Подряд идущие слоты (range с шагом 1) отдаются
+        срезом отображения без копирования, произвольный список - копией
+        одной выборкой
+        """
+        if isinstance(slots, range) and slots.step == 1:
+            if slots.stop > self.count:
+                self.refresh(truncate=False)
+            if slots.start < 0 or slots.stop > self.count:
+                raise IndexError(f"Слот вне файла векторов {self.path}")
+            return self.records()[slots.start:slots.stop]
+
+        slots = np.asarray(slots, dtype="int64")
+        if len(slots) and slots.max() >= self.count:
+            # Слот мог дописать другой процесс
+            self.refresh(truncate=False)
+        if len(slots) and (slots.min() < 0 or slots.max() >= self.count):
+            raise IndexError(f"Слот вне файла векторов {self.path}")
+        return self.records()[slots]
+
+    def get(self, slots) -> np.ndarray:
+        """Векторы по слотам в виде float32 (для квантованного файла - приближённые)"""
+        return dequantize(self.get_records(slots))
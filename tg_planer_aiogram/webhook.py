@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+log = logging.getLogger("planner_bot")
+
+
+class ConcurrencyLimit(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: одновременно обрабатывается не больше
+    limit апдейтов, остальные ждут своей очереди. Считает принятые, но
+    ещё не обработанные апдейты, чтобы при остановке дождаться их.
+    Когда их max_pending (0 - без ограничения), вебхук отвечает 503,
+    и Telegram повторяет доставку позже.
+    """
+
+    def __init__(self, limit: int, max_pending: int = 0):
+        self.limit = limit
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(limit)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self.pending = 0
+        self.active = 0
+        self.peak_active = 0
+        self.processed = 0
+        self.rejected = 0
+
+    @property
+    def is_full(self) -> bool:
+        return 0 < self.max_pending <= self.pending
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "pending": self.pending,
+            "active": self.active,
+            "peak_active": self.peak_active,
+            "processed": self.processed,
+            "rejected": self.rejected,
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        self.pending += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.active -= 1
+                    self.processed += 1
+        finally:
+            self.pending -= 1
+            if self.pending == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Ждёт обработки всех принятых апдейтов; False - не успели за timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+async def _wait_for_stop_signal() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    installed = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            installed.append(sig)
+        except (NotImplementedError, RuntimeError):
+            # Windows: Ctrl+C отменит задачу, остановка пройдёт через finally
+            pass
+    try:
+        await stop.wait()
+    finally:
+        for sig in installed:
+            loop.remove_signal_handler(sig)
+
+
+def _reject_when_full(
+    handler: SimpleRequestHandler,
+    limiter: ConcurrencyLimit,
+) -> Callable[[web.Request], Awaitable[web.StreamResponse]]:
+    """Обработчик запросов вебхука: 503 вместо приёма, пока очередь апдейтов полна"""
+
+    async def receive(request: web.Request) -> web.StreamResponse:
+        if limiter.is_full:
+            limiter.rejected += 1
+            return web.Response(status=503, text="Too many pending updates", headers={"Retry-After": "1"})
+        return await handler.handle(request)
+
+    return receive
+
+
+async def run_webhook(
+    bot: Bot,
+    dp: Dispatcher,
+    limiter: ConcurrencyLimit,
+    *,
+    host: str,
+    port: int,
+    path: str,
+    secret: str,
+    public_url: str = "",
+    max_connections: int = 40,
+    shutdown_timeout: float = 10.0,
+) -> None:
+    """
+    Принимает апдейты по HTTP через aiohttp-сервер aiogram до SIGINT/SIGTERM.
+
+    Запрос без верного X-Telegram-Bot-Api-Secret-Token получает 401.
+    Апдейт подтверждается сразу и обрабатывается в фоне, одновременность
+    ограничивает limiter. Если принятых и не обработанных апдейтов уже
+    limiter.max_pending, запрос получает 503 и Telegram повторит его позже. Если задан public_url, вебхук регистрируется
+    в Telegram; без него сервер можно проверить локально, отправляя
+    записанные апдейты (tools/replay_updates.py).
+
+    При остановке сервер перестаёт принимать соединения, затем до
+    shutdown_timeout секунд дообрабатывает принятые апдейты. Вебхук
+    не удаляется: Telegram придержит новые апдейты до перезапуска.
+    """
+    app = web.Application()
+    handler = SimpleRequestHandler(dp, bot, handle_in_background=True, secret_token=secret)
+    # Не handler.register(): он закрывает сессию бота при остановке сервера,
+    # а она ещё нужна для дообработки апдейтов и досылки исходящих
+    app.router.add_post(path, _reject_when_full(handler, limiter))
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    log.info(f"Вебхук слушает http://{host}:{port}{path}")
+
+    try:
+        if public_url:
+            await bot.set_webhook(
+                url=public_url.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=max_connections,
+            )
+            log.info(f"Вебхук зарегистрирован в Telegram: {public_url.rstrip('/')}{path}")
+        else:
+            log.warning("WEBHOOK_URL не задан: вебхук в Telegram не регистрируется")
+        await _wait_for_stop_signal()
+    finally:
+        log.info("Остановка вебхука: новые апдейты не принимаются")
+        await site.stop()
+        started = time.perf_counter()
+        if await limiter.wait_idle(shutdown_timeout):
+            log.info(f"Принятые апдейты обработаны за {time.perf_counter() - started:.2f} с")
+        else:
+            log.warning(f"Не дождались обработки {limiter.pending} апдейтов за {shutdown_timeout} с")
+        await runner.cleanup()
+        log.info(f"Обработка апдейтов: {limiter.stats()}")
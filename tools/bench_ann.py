@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк приближённого поиска (IVFIndex) против точного перебора:
+полнота recall@k и задержка на синтетических 384-мерных эмбеддингах.
+
+Пример:
+    python tools/bench_ann.py --n 100000 --nlist 256 --nprobe 1 4 8 16 32
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tg_planer_aiogram"))
+
+from ann_index import IVFIndex  # noqa: E402
+
+
+def make_corpus(n: int, dim: int, clusters: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """Смесь гауссиан: похожие по смыслу задачи образуют размытые кластеры"""
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + noise * rng.normal(size=(n, dim)).astype("float32")
+    return vectors.astype("float32")
+
+
+def percentiles(samples: list[float]) -> tuple[float, float]:
+    ms = np.array(samples) * 1000
+    return float(np.percentile(ms, 50)), float(np.percentile(ms, 95))
+
+
+def recall_at_k(found: list[list[int]], truth: list[list[int]]) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / sum(len(t) for t in truth)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100_000, help="векторов в индексе")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--clusters", type=int, default=500, help="смысловых кластеров в данных")
+    parser.add_argument("--noise", type=float, default=1.0, help="разброс внутри кластера")
+    parser.add_argument("--loop-queries", type=int, default=3,
+                        help="запросов для медленного пути utils.cosine_sim (0 - пропустить)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Данные: {args.n} векторов x {args.dim}, {args.clusters} кластеров, шум {args.noise}")
+    corpus = make_corpus(args.n, args.dim, args.clusters, args.noise, rng)
+    ids = np.arange(1, args.n + 1, dtype="int64")
+
+    picks = rng.integers(0, args.n, args.queries)
+    queries = corpus[picks] + args.noise * rng.normal(size=(args.queries, args.dim)).astype("float32")
+
+    # Точный ответ: нормированная матрица и одно произведение на запрос
+    normed = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    truth, exact_times = [], []
+    for q in queries:
+        start = time.perf_counter()
+        scores = normed @ (q / np.linalg.norm(q))
+        best = np.argpartition(-scores, args.k - 1)[:args.k]
+        exact_times.append(time.perf_counter() - start)
+        truth.append(ids[best].tolist())
+
+    rows = []
+    p50, p95 = percentiles(exact_times)
+    rows.append(("exact numpy (matvec + argpartition)", 1.0, p50, p95))
+
+    if args.loop_queries > 0:
+        # Прежний путь /search: utils.cosine_sim по каждой строке в цикле Python
+        import utils
+
+        loop_times = []
+        for q in queries[:args.loop_queries]:
+            start = time.perf_counter()
+            results = [(utils.cosine_sim(q, vec), task_id) for task_id, vec in zip(ids.tolist(), corpus)]
+            results.sort(key=lambda x: x[0], reverse=True)
+            loop_times.append(time.perf_counter() - start)
+        found = [[task_id for _, task_id in results[:args.k]]]
+        assert recall_at_k(found, truth[args.loop_queries - 1:args.loop_queries]) == 1.0
+        p50, p95 = percentiles(loop_times)
+        rows.append((f"exact utils.cosine_sim loop ({args.loop_queries} запр.)", 1.0, p50, p95))
+
+    index = IVFIndex(args.dim, nlist=args.nlist)
+    start = time.perf_counter()
+    index.train(corpus[:min(args.n, 256 * args.nlist)])
+    train_time = time.perf_counter() - start
+    start = time.perf_counter()
+    index.add(ids, corpus)
+    add_time = time.perf_counter() - start
+    print(f"IVF: обучение {train_time:.2f} с, добавление {add_time:.2f} с")
+
+    for nprobe in args.nprobe:
+        found, times = [], []
+        for q in queries:
+            start = time.perf_counter()
+            result = index.search(q, args.k, nprobe=nprobe)
+            times.append(time.perf_counter() - start)
+            found.append([task_id for _, task_id in result])
+        p50, p95 = percentiles(times)
+        rows.append((f"ivf nlist={args.nlist} nprobe={nprobe}", recall_at_k(found, truth), p50, p95))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.npz")
+        start = time.perf_counter()
+        index.save(path)
+        save_time = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        start = time.perf_counter()
+        IVFIndex.load(path)
+        load_time = time.perf_counter() - start
+    print(f"Файл индекса: {size_mb:.1f} МБ, сохранение {save_time:.2f} с, загрузка {load_time:.2f} с\n")
+
+    print(f"{'метод':<48} {'recall@' + str(args.k):>9} {'p50, мс':>9} {'p95, мс':>9}")
+    for name, recall, p50, p95 in rows:
+        print(f"{name:<48} {recall:>9.3f} {p50:>9.2f} {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк функций database.py на синтетической базе: генератор заполняет
+временную БД пользователями и задачами (сроки в прошлом и будущем,
+выполненные и невыполненные, эмбеддинги движка hashing, кэш эмбеддингов
+и диалоги), затем каждая публичная функция вызывается на случайных
+пользователях и печатаются задержки p50/p95/p99. Разрушающие вызовы
+получают нетронутые данные: delete_all_tasks - каждый раз другого
+пользователя, compact_vectors - свежую копию базы.
+
+Результаты можно сохранить как базовые и сравнивать с ними следующие
+прогоны: если p50 или p95 функции выросли больше чем на --threshold
+(и больше чем на --min-delta-ms), скрипт завершается с кодом 1.
+
+Пример:
+    python tools/bench_db.py --rows 10000,100000,1000000 --save-baseline bench_db.json
+    python tools/bench_db.py --rows 10000,100000 --baseline bench_db.json --threshold 0.25
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Эмбеддинги без модели: генератор и бенчмарк не зависят от sentence-transformers
+os.environ["EMB_BACKEND"] = "hashing"
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tg_planer_aiogram"))
+
+import database  # noqa: E402
+from embedding_backends import HashingBackend, configured_version  # noqa: E402
+from config import EMB_HASH_DIM  # noqa: E402
+from vector_store import VectorStore, segment_path  # noqa: E402
+
+VERBS = [
+    "купить", "позвонить", "написать", "оплатить", "забрать", "отправить", "проверить",
+    "починить", "записаться", "подготовить", "убрать", "заказать", "встретить", "сдать",
+]
+OBJECTS = [
+    "молоко", "маме", "отчёт", "квартиру", "посылку", "врачу", "презентацию", "машину",
+    "билеты", "документы", "подарок", "счёт", "хлеб", "лекарства", "ключи", "договор",
+    "письмо", "продукты", "кран", "резюме", "интернет", "страховку", "книгу", "кофе",
+]
+EXTRAS = ["", "", "", "срочно", "завтра утром", "до обеда", "после работы", "на даче"]
+
+# Часы задач: днём чаще, ночью почти никогда
+HOUR_WEIGHTS = np.array(
+    [1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 14, 12, 10, 12, 14, 14, 12, 10, 10, 8, 6, 4, 2, 1],
+    dtype="float64",
+)
+
+INSERT_CHUNK = 50_000
+# Разброс времени изменения диалогов в fsm_state, секунды
+FSM_SPREAD = 2 * 86400
+
+
+def fsm_key(user_id: int) -> str:
+    # Ключ DefaultKeyBuilder хранилища диалогов (bot_id, чат, пользователь, destiny)
+    return f"fsm:1:{user_id}:{user_id}:default"
+
+
+def make_titles() -> list[str]:
+    titles = {
+        " ".join(filter(None, (verb, obj, extra)))
+        for verb in VERBS for obj in OBJECTS for extra in EXTRAS
+    }
+    return sorted(titles)
+
+
+def fill(path: str, rows: int, users: int, rng: np.random.Generator) -> dict:
+    """
+    Дописывает в базу со схемой users и tasks; векторы - в файл поколения 0.
+    Пользователи неравномерны: у немногих задач много, у большинства мало.
+    """
+    titles = make_titles()
+    matrix = HashingBackend(EMB_HASH_DIM).encode(titles)
+    version = configured_version()
+
+    weights = rng.lognormal(0.0, 1.0, users)
+    weights /= weights.sum()
+
+    now = datetime.now().replace(second=0, microsecond=0)
+    today = now.replace(hour=0, minute=0)
+
+    vectors = VectorStore(segment_path(path, 0), 0)
+    vectors.open()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT OR IGNORE INTO users(user_id, nickname) VALUES (?, ?)",
+        [(user_id, f"user{user_id}") for user_id in range(1, users + 1)],
+    )
+
+    for start in range(0, rows, INSERT_CHUNK):
+        n = min(INSERT_CHUNK, rows - start)
+        user_ids = rng.choice(users, n, p=weights) + 1
+        title_idx = rng.integers(0, len(titles), n)
+        # ~20% просрочены, остальные - в ближайшие недели, ближе к сегодня гуще
+        past = rng.random(n) < 0.2
+        days = np.where(past, -rng.integers(1, 30, n), np.minimum(rng.exponential(10.0, n), 90).astype(int))
+        hours = rng.choice(24, n, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+        minutes = rng.choice([0, 0, 0, 15, 30, 30, 45, 10, 20, 40, 50], n)
+        done = rng.random(n) < 0.15
+
+        slot0 = vectors.count
+        vectors.append(matrix[title_idx], sync=False)
+
+        batch = []
+        for i in range(n):
+            due = today + timedelta(days=int(days[i]), hours=int(hours[i]), minutes=int(minutes[i]))
+            batch.append((
+                int(user_ids[i]), titles[title_idx[i]],
+                due.strftime("%Y-%m-%d"), due.strftime("%H:%M"),
+                "done" if done[i] else "pending",
+                slot0 + i, version, int(due.timestamp()),
+            ))
+        conn.executemany(
+            """
+            INSERT INTO tasks(user_id, title, date, time, status, emb_slot, emb_model, due_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            batch,
+        )
+        conn.commit()
+
+    # Кэш эмбеддингов запросов и брошенные и живые диалоги за последние двое суток
+    cache_rows = max(1, rows // 10)
+    conn.executemany(
+        "INSERT OR IGNORE INTO emb_cache(model, text, emb) VALUES (?, ?, ?)",
+        (
+            (version, f"запрос {i}", matrix[i % len(titles)].tobytes())
+            for i in range(cache_rows)
+        ),
+    )
+    now_ts = int(now.timestamp())
+    conn.executemany(
+        "INSERT INTO fsm_state(key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+        (
+            (fsm_key(user_id), "AddTaskStates:waiting_for_datetime", '{"title": "купить молоко"}',
+             now_ts - int(rng.integers(0, FSM_SPREAD)))
+            for user_id in range(1, users + 1)
+        ),
+    )
+
+    vectors.sync()
+    vectors.close()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return {
+        "titles": titles, "matrix": matrix, "version": version, "today": today,
+        "cache_rows": cache_rows, "fsm_oldest": now_ts - FSM_SPREAD,
+    }
+
+
+def copy_database(path: str, directory: str) -> None:
+    """Копирует файл БД и файлы векторов в directory, заменяя прежнюю копию"""
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.basename(path)
+    for old in glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + "*")):
+        os.remove(old)
+    for source in glob.glob(glob.escape(path) + "*"):
+        shutil.copy(source, directory)
+
+
+def percentiles(samples: list[float]) -> dict:
+    ms = np.array(samples) * 1000
+    return {f"p{q}": round(float(np.percentile(ms, q)), 4) for q in (50, 95, 99)}
+
+
+async def timed(samples: list[float], coro) -> object:
+    start = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+async def bench_size(rows: int, args, rng: np.random.Generator) -> dict:
+    users = max(1, rows // args.tasks_per_user)
+    tmp = tempfile.mkdtemp(prefix="bench_db_")
+    path = os.path.join(tmp, "bench.db")
+    results: dict[str, list[float]] = {}
+
+    def samples(name: str) -> list[float]:
+        return results.setdefault(name, [])
+
+    try:
+        await database.open_pool(path)
+        await database.setup_db()
+        await database.close_pool()
+
+        start = time.perf_counter()
+        data = await asyncio.to_thread(fill, path, rows, users, rng)
+        print(f"  сгенерировано за {time.perf_counter() - start:.1f} с")
+
+        await database.open_pool(path)
+        # Первый запуск на заполненной базе квантует векторы и проверяет планы
+        await timed(samples("setup_db"), database.setup_db())
+
+        version, today, titles = data["version"], data["today"], data["titles"]
+        words = sorted({word for title in titles for word in title.split()})
+        pick = lambda: int(rng.integers(1, users + 1))  # noqa: E731
+
+        for _ in range(args.iterations):
+            user_id = pick()
+            day = today + timedelta(days=int(rng.integers(-3, 14)))
+            dates = [(day + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+            now_ts = int(time.time())
+
+            await timed(samples("fetch_tasks_for_date"), database.fetch_tasks_for_date(user_id, dates[0]))
+            await timed(samples("fetch_tasks_for_dates"), database.fetch_tasks_for_dates(user_id, dates))
+            await timed(samples("fetch_all_tasks"), database.fetch_all_tasks(user_id))
+            page = await timed(samples("fetch_tasks_page"), database.fetch_tasks_page(user_id, None, 21))
+            if page:
+                cursor = (page[-1][1], page[-1][0])
+                await timed(samples("fetch_tasks_page_next"), database.fetch_tasks_page(user_id, cursor, 21))
+            await timed(samples("count_user_tasks"), database.count_user_tasks(user_id))
+            await timed(samples("load_tasks_with_vectors"), database.load_tasks_with_vectors(user_id, version))
+            await timed(
+                samples("load_tasks_with_vectors_q"),
+                database.load_tasks_with_vectors(user_id, version, quantized=True),
+            )
+            recent = await timed(samples("recent_tasks"), database.recent_tasks(user_id, 100))
+            await timed(
+                samples("load_vectors"),
+                database.load_vectors(user_id, [task_id for task_id, _ in recent[:50]], version),
+            )
+            query = " ".join(rng.choice(words, 2))
+            await timed(samples("search_titles"), database.search_titles(user_id, query, 50))
+            await timed(
+                samples("fetch_pending_due_between"),
+                database.fetch_pending_due_between(now_ts, now_ts + 3600),
+            )
+            await timed(
+                samples("tasks_for_exact_datetime"),
+                database.tasks_for_exact_datetime(dates[0], f"{int(rng.integers(7, 22)):02d}:00"),
+            )
+            await timed(
+                samples("fetch_tasks_with_stale_embedding"),
+                database.fetch_tasks_with_stale_embedding("stale-model", 0, 64),
+            )
+            await timed(samples("load_fsm_record"), database.load_fsm_record(fsm_key(user_id)))
+
+        blobs = data["matrix"]
+        for _ in range(args.iterations):
+            user_id = pick()
+            idx = int(rng.integers(0, len(titles)))
+            day = (today + timedelta(days=int(rng.integers(1, 30)))).strftime("%Y-%m-%d")
+
+            await timed(samples("register_user"), database.register_user(user_id, f"user{user_id}"))
+            task_id = await timed(
+                samples("insert_task"),
+                database.insert_task(user_id, titles[idx], day, "12:00", blobs[idx].tobytes(), version),
+            )
+            await timed(samples("mark_task_done"), database.mark_task_done(user_id, task_id))
+            await timed(samples("mark_task_undo"), database.mark_task_undo(user_id, task_id))
+            await timed(samples("mark_done_by_numbers"), database.mark_done_by_numbers(user_id, [1, 2]))
+            await timed(samples("mark_undo_by_numbers"), database.mark_undo_by_numbers(user_id, [1, 2]))
+            await timed(
+                samples("update_task_embedding"),
+                database.update_task_embedding(user_id, task_id, blobs[idx].tobytes(), version),
+            )
+            await timed(samples("delete_task"), database.delete_task(user_id, task_id))
+            # Удаляет две ближайшие задачи пользователя - каждый раз другие
+            await timed(samples("delete_by_numbers"), database.delete_by_numbers(pick(), [1, 2]))
+            await timed(samples("reset_task_ids"), database.reset_task_ids())
+
+        cache_rows = data["cache_rows"]
+        for i in range(args.iterations):
+            await timed(
+                samples("load_cached_embedding"),
+                database.load_cached_embedding(version, f"запрос {int(rng.integers(0, cache_rows))}"),
+            )
+            await timed(
+                samples("store_cached_embedding"),
+                database.store_cached_embedding(version, f"новый запрос {i}", blobs[i % len(blobs)].tobytes()),
+            )
+            # Кэш держится на прежнем размере: каждый раз вытесняется одна старая запись
+            await timed(samples("trim_embedding_cache"), database.trim_embedding_cache(version, cache_rows))
+
+        now_ts = int(time.time())
+        step = FSM_SPREAD // (2 * args.iterations)
+        for i in range(args.iterations):
+            batch = [int(user_id) for user_id in rng.integers(1, users + 1, 60)]
+            upserts = [
+                (fsm_key(user_id), "AddTaskStates:waiting_for_title", "{}", now_ts)
+                for user_id in batch[:50]
+            ]
+            await timed(
+                samples("save_fsm_records"),
+                database.save_fsm_records(upserts, [fsm_key(user_id) for user_id in batch[50:]]),
+            )
+            # Каждый раз истекает следующая порция брошенных диалогов
+            await timed(
+                samples("delete_stale_fsm_records"),
+                database.delete_stale_fsm_records(data["fsm_oldest"] + (i + 1) * step),
+            )
+
+        # Каждый вызов удаляет задачи другого пользователя: данные перед ним нетронуты
+        cleared = rng.permutation(users)[:max(1, min(args.iterations, users // 10))] + 1
+        for user_id in cleared:
+            await timed(samples("delete_all_tasks"), database.delete_all_tasks(int(user_id)))
+
+        # Первый проход удаляет все ~20% просроченных задач разом - это разовая стоимость,
+        # дальше чистильщик каждый раз находит лишь несколько свежих
+        await timed(samples("delete_expired_tasks_full"), database.delete_expired_tasks())
+        past = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+        for _ in range(args.iterations):
+            for _ in range(3):
+                await database.insert_task(pick(), titles[0], past, "12:00", None)
+            await timed(samples("delete_expired_tasks"), database.delete_expired_tasks())
+
+        # Уплотнение меняет поколение файлов векторов, поэтому каждый замер
+        # идёт на свежей копии базы с «дырами» от удалённых выше задач
+        snapshot = os.path.join(tmp, "snapshot")
+        await database.close_pool()
+        copy_database(path, snapshot)
+        for _ in range(args.compact_iterations):
+            await database.close_pool()
+            copy_database(os.path.join(snapshot, os.path.basename(path)), tmp)
+            await database.open_pool(path)
+            await timed(samples("attach_db"), database.attach_db())
+            await timed(samples("compact_vectors"), database.compact_vectors())
+    finally:
+        await database.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {name: {"n": len(values), **percentiles(values)} for name, values in results.items()}
+
+
+def print_table(rows: int, stats: dict) -> None:
+    print(f"\n{rows} строк")
+    print(f"{'функция':<34}{'n':>6}{'p50, мс':>12}{'p95, мс':>12}{'p99, мс':>12}")
+    for name, row in stats.items():
+        print(f"{name:<34}{row['n']:>6}{row['p50']:>12.3f}{row['p95']:>12.3f}{row['p99']:>12.3f}")
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list[str]:
+    """Регрессии p50/p95 относительно базовых результатов"""
+    regressions = []
+    for rows, stats in results.items():
+        base_stats = baseline.get("results", {}).get(rows)
+        if base_stats is None:
+            print(f"Нет базовых результатов для {rows} строк")
+            continue
+        for name, row in stats.items():
+            base = base_stats.get(name)
+            if base is None:
+                continue
+            for key in ("p50", "p95"):
+                delta = row[key] - base[key]
+                if delta > min_delta_ms and row[key] > base[key] * (1 + threshold):
+                    regressions.append(
+                        f"{rows} строк, {name} {key}: {base[key]:.3f} -> {row[key]:.3f} мс "
+                        f"(+{delta / max(base[key], 1e-9):.0%})"
+                    )
+    return regressions
+
+
+async def run(args) -> int:
+    sizes = [int(value) for value in args.rows.split(",")]
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for rows in sizes:
+        print(f"Генерация {rows} строк ({max(1, rows // args.tasks_per_user)} пользователей)")
+        stats = await bench_size(rows, args, rng)
+        print_table(rows, stats)
+        results[str(rows)] = stats
+
+    if args.save_baseline:
+        meta = {"date": datetime.now().isoformat(timespec="seconds"), "iterations": args.iterations,
+                "tasks_per_user": args.tasks_per_user, "seed": args.seed}
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовые результаты сохранены в {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\nРегрессии (порог {args.threshold:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nРегрессий нет")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000", help="размеры базы через запятую")
+    parser.add_argument("--tasks-per-user", type=int, default=100, help="задач на пользователя в среднем")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов каждой функции")
+    parser.add_argument("--compact-iterations", type=int, default=3,
+                        help="замеров уплотнения векторов (каждый на свежей копии базы)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH", help="сохранить результаты как базовые")
+    parser.add_argument("--baseline", metavar="PATH", help="сравнить с базовыми результатами")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимый рост p50/p95, доля")
+    parser.add_argument("--min-delta-ms", type=float, default=0.2,
+                        help="меньший рост в миллисекундах считается шумом")
+    parser.add_argument("--vec-fsync", action="store_true",
+                        help="fsync файла векторов при вставке, как в боте (по умолчанию выключен)")
+    args = parser.parse_args()
+
+    # Без fsync вставка меряет базу, а не диск
+    database.VEC_FSYNC = args.vec_fsync
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк квантованного хранения эмбеддингов (float32 / float16 / int8):
+размер на диске, память матриц поиска, задержка и совпадение top-k
+с точным поиском через utils.cosine_sim.
+
+Пример:
+    python tools/bench_quant.py --n 20000 --queries 50
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tg_planer_aiogram"))
+
+import utils  # noqa: E402
+from search_engine import UserVectors, rerank  # noqa: E402
+from vector_store import VectorStore  # noqa: E402
+
+
+def make_corpus(n: int, dim: int, clusters: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, n)
+    return (centers[labels] + noise * rng.normal(size=(n, dim))).astype("float32")
+
+
+def blob_db_size(path: str, corpus: np.ndarray) -> int:
+    """Размер SQLite с эмбеддингами в BLOB-столбце tasks.emb (прежняя схема)"""
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY, title TEXT, emb BLOB)")
+        db.executemany(
+            "INSERT INTO tasks(title, emb) VALUES (?, ?)",
+            ((f"задача {i}", vec.tobytes()) for i, vec in enumerate(corpus)),
+        )
+    return os.path.getsize(path)
+
+
+def percentiles(samples: list[float]) -> tuple[float, float]:
+    ms = np.array(samples) * 1000
+    return float(np.percentile(ms, 50)), float(np.percentile(ms, 95))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20_000, help="задач одного пользователя")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank", type=int, default=50, help="кандидатов для точного пересчёта")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    corpus = make_corpus(args.n, args.dim, args.clusters, args.noise, rng)
+    queries = corpus[rng.integers(0, args.n, args.queries)]
+    queries = queries + args.noise * rng.normal(size=queries.shape).astype("float32")
+    ids = list(range(args.n))
+    titles = [f"задача {i}" for i in ids]
+
+    # Эталон: прежний поиск - utils.cosine_sim по каждой задаче и сортировка
+    print(f"Эталон utils.cosine_sim: {args.queries} запросов x {args.n} задач...")
+    truth = []
+    for q in queries:
+        scores = [(utils.cosine_sim(q, vec), task_id) for task_id, vec in enumerate(corpus)]
+        scores.sort(key=lambda x: x[0], reverse=True)
+        truth.append({task_id for _, task_id in scores[:args.k]})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        blob_size = blob_db_size(os.path.join(tmp, "blob.db"), corpus)
+        full = VectorStore(os.path.join(tmp, "full.vec.0"))
+        full.create(args.dim)
+        full.append(corpus)
+        full_size = os.path.getsize(full.path)
+        print(f"SQLite с BLOB в tasks: {blob_size / 1024 / 1024:.1f} МБ, "
+              f"файл float32: {full_size / 1024 / 1024:.1f} МБ\n")
+
+        header = f"{'формат':<9} {'диск, МБ':>9} {'RAM, МБ':>8} {'проход':<10} {'top-' + str(args.k):>6} {'p50, мс':>8} {'p95, мс':>8}"
+        print(header)
+        for kind in ("float32", "float16", "int8"):
+            codes = VectorStore(os.path.join(tmp, f"codes.vecq.{kind}"), kind=kind)
+            codes.create(args.dim)
+            codes.append(corpus)
+            disk_mb = os.path.getsize(codes.path) / 1024 / 1024
+            matrix = np.ascontiguousarray(codes.records()["vec"])
+            vectors = UserVectors(ids, titles, matrix)
+            ram_mb = vectors.nbytes / 1024 / 1024
+            codes.close()
+
+            passes = [("первый", False)] if kind == "float32" else [("первый", False), ("+rerank", True)]
+            for label, with_rerank in passes:
+                agree, times = 0, []
+                for q, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    query = q / np.linalg.norm(q)
+                    if with_rerank:
+                        candidates = vectors.top_k(query, max(args.k, args.rerank))
+                        slots = [task_id for _, task_id, _ in candidates]
+                        result = rerank(candidates, slots, full.get(slots), query, args.k)
+                    else:
+                        result = vectors.top_k(query, args.k)
+                    times.append(time.perf_counter() - start)
+                    agree += len(expected & {task_id for _, task_id, _ in result})
+                p50, p95 = percentiles(times)
+                print(f"{kind:<9} {disk_mb:>9.1f} {ram_mb:>8.1f} {label:<10} "
+                      f"{agree / (args.k * args.queries):>6.3f} {p50:>8.2f} {p95:>8.2f}")
+        full.close()
+
+
+if __name__ == "__main__":
+    main()
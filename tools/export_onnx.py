@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Экспорт модели эмбеддингов в ONNX для движка EMB_BACKEND=onnx.
+Нужны torch и transformers - только на машине, где делается экспорт;
+боту потом достаточно onnxruntime и tokenizers.
+
+Пример:
+    python tools/export_onnx.py --out models/minilm
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tg_planer_aiogram"))
+
+from config import EMB_MODEL  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMB_MODEL)
+    parser.add_argument("--out", default="models/minilm", help="каталог для model.onnx и tokenizer.json")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(args.out, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model).eval()
+    sample = tokenizer(["пример текста задачи"], return_tensors="pt")
+
+    path = os.path.join(args.out, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "tokens"},
+                "attention_mask": {0: "batch", 1: "tokens"},
+                "last_hidden_state": {0: "batch", 1: "tokens"},
+            },
+            opset_version=args.opset,
+        )
+    # Быстрый токенизатор сохраняет tokenizer.json, который читает движок onnx
+    tokenizer.save_pretrained(args.out)
+    print(f"Модель сохранена в {path}")
+
+
+if __name__ == "__main__":
+    main()
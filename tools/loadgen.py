@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон бота целиком без Telegram: тысячи имитируемых
+пользователей шлют апдейты в Dispatcher с обработчиками handlers.py,
+а исходящие запросы (sendMessage и др.) перехватывает поддельная сессия Bot
+с заданной задержкой API.
+
+Каждый пользователь по очереди выполняет команды из смеси (диалог /add,
+/today, /week, /list, /done N, /search) с паузами на «раздумье».
+Отчёт: пропускная способность, задержки по командам (p50/p95/p99,
+с ожиданием в очереди ConcurrencyLimit), задержка event loop и пиковый RSS.
+База - временная, заранее заполненная задачами пользователей.
+
+Пример:
+    python tools/loadgen.py --users 2000 --duration 60 --think 2 --concurrency 64
+    python tools/loadgen.py --users 500 --mix add=1,today=3,search=2 --out loadgen.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Без модели по умолчанию: нагрузка на бота, а не на sentence-transformers
+os.environ.setdefault("EMB_BACKEND", "hashing")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tg_planer_aiogram"))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.methods import EditMessageText, SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+import config  # noqa: E402
+import database  # noqa: E402
+import handlers  # noqa: E402
+import utils  # noqa: E402
+from fsm_storage import SQLiteStorage  # noqa: E402
+from task_cache import cache as task_cache  # noqa: E402
+from webhook import ConcurrencyLimit  # noqa: E402
+
+BOT_TOKEN = "123456:loadgen"
+FIRST_USER_ID = 1_000_000
+
+VERBS = ["купить", "позвонить", "написать", "оплатить", "забрать", "отправить", "проверить", "записаться"]
+OBJECTS = ["молоко", "маме", "отчёт", "посылку", "врачу", "билеты", "документы", "подарок", "счёт", "ключи"]
+
+DEFAULT_MIX = "add=15,today=20,week=15,list=20,done=10,search=20"
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot без сети: отвечает на запросы через api_latency секунд и считает их"""
+
+    def __init__(self, api_latency: float):
+        super().__init__()
+        self.api_latency = api_latency
+        self.calls: Counter[str] = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.api_latency > 0:
+            await asyncio.sleep(self.api_latency)
+        self.calls[type(method).__name__] += 1
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=int(chat_id), type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+class LoadGen:
+    def __init__(self, dp: Dispatcher, bot: Bot, mix: dict[str, float], think: float, seed: int):
+        self.dp = dp
+        self.bot = bot
+        self.commands = list(mix)
+        self.weights = list(mix.values())
+        self.think = think
+        self.rng = random.Random(seed)
+        self.latency: dict[str, list[float]] = {}
+        self.errors: Counter[str] = Counter()
+        self.updates = 0
+        self._update_id = 0
+
+    def _pause(self) -> float:
+        return self.rng.expovariate(1 / self.think) if self.think > 0 else 0.0
+
+    def _update(self, user_id: int, text: str) -> Update:
+        self._update_id += 1
+        return Update.model_validate({
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "load", "username": f"u{user_id}"},
+                "text": text,
+            },
+        }, context={"bot": self.bot})
+
+    async def send(self, name: str, user_id: int, text: str) -> None:
+        start = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, self._update(user_id, text))
+        except Exception:
+            self.errors[name] += 1
+        self.latency.setdefault(name, []).append(time.perf_counter() - start)
+        self.updates += 1
+
+    async def command(self, user_id: int, command: str) -> None:
+        rng = self.rng
+        if command == "add":
+            # Диалог из трёх апдейтов, между шагами пользователь печатает
+            title = f"{rng.choice(VERBS)} {rng.choice(OBJECTS)}"
+            due = datetime.now() + timedelta(days=rng.randint(0, 14), hours=rng.randint(1, 12))
+            await self.send("/add", user_id, "/add")
+            await asyncio.sleep(self._pause() / 2)
+            await self.send("/add: название", user_id, title)
+            await asyncio.sleep(self._pause() / 2)
+            await self.send("/add: срок", user_id, due.strftime("%d.%m.%Y %H:%M"))
+        elif command == "done":
+            await self.send("/done", user_id, f"/done {rng.randint(1, 5)}")
+        elif command == "search":
+            await self.send("/search", user_id, f"/search {rng.choice(VERBS)} {rng.choice(OBJECTS)}")
+        else:
+            await self.send(f"/{command}", user_id, f"/{command}")
+
+    async def user(self, user_id: int, deadline: float) -> None:
+        rng = self.rng
+        # Пользователи приходят не одновременно
+        await asyncio.sleep(rng.uniform(0, self.think))
+        await self.send("/start", user_id, "/start")
+        while True:
+            await asyncio.sleep(min(self._pause(), max(0.0, deadline - time.perf_counter())))
+            if time.perf_counter() >= deadline:
+                return
+            await self.command(user_id, rng.choices(self.commands, self.weights)[0])
+
+
+async def monitor_lag(samples: list[float], interval: float = 0.01) -> None:
+    """Задержка event loop: насколько позже положенного просыпается sleep(interval)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def prefill(users: list[int], tasks_per_user: int, rng: random.Random) -> None:
+    """Задачи пользователей на ближайшие две недели - чтобы списки и поиск не были пустыми"""
+    titles = sorted({f"{verb} {obj}" for verb in VERBS for obj in OBJECTS})
+    vectors = dict(zip(titles, await asyncio.to_thread(utils.make_embeddings, titles)))
+    version = utils.embedding_version()
+    today = datetime.now().replace(second=0, microsecond=0)
+
+    async def fill_user(user_id: int) -> None:
+        await database.register_user(user_id, f"u{user_id}")
+        for _ in range(tasks_per_user):
+            title = rng.choice(titles)
+            due = today + timedelta(days=rng.randint(0, 14), hours=rng.randint(1, 12))
+            await database.insert_task(
+                user_id, title, due.strftime("%Y-%m-%d"), due.strftime("%H:%M"),
+                utils.emb_to_blob(vectors[title]), version,
+            )
+
+    # Одновременные вставки объединяются пулом в общие транзакции
+    for start in range(0, len(users), 200):
+        await asyncio.gather(*(fill_user(user_id) for user_id in users[start:start + 200]))
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip().lstrip("/")] = float(weight or 1)
+    return mix
+
+
+def percentiles(samples: list[float]) -> dict:
+    ms = np.array(samples) * 1000
+    return {
+        "n": len(samples),
+        **{f"p{q}": round(float(np.percentile(ms, q)), 3) for q in (50, 95, 99)},
+        "max": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss - килобайты в Linux и байты в macOS
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / 1024 / 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\nПользователей: {report['users']}, длительность {report['elapsed']:.1f} с")
+    print(f"Апдейтов: {report['updates']} ({report['throughput']:.1f} в секунду), ошибок: {report['errors']}")
+    print(f"Запросов к API: {report['api_calls']}")
+    print(f"\n{'команда':<18}{'n':>8}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}{'max, мс':>11}{'ошибок':>8}")
+    for name, row in report["commands"].items():
+        print(
+            f"{name:<18}{row['n']:>8}{row['p50']:>11.2f}{row['p95']:>11.2f}"
+            f"{row['p99']:>11.2f}{row['max']:>11.2f}{row['errors']:>8}"
+        )
+    lag = report["loop_lag"]
+    print(f"\nЗадержка event loop: p50 {lag['p50']:.2f} мс, p99 {lag['p99']:.2f} мс, max {lag['max']:.2f} мс")
+    rss = report["peak_rss_mb"]
+    print(f"Пиковый RSS: {rss['self']} МБ (дочерние процессы {rss['children']} МБ)")
+    print(f"Ограничитель апдейтов: {report['limiter']}")
+    print(f"Состояния диалогов: {report['fsm']}")
+    print(f"Кэш списков задач: {report['task_cache']}")
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    tmp = None
+    path = args.db
+    if path is None:
+        tmp = tempfile.mkdtemp(prefix="loadgen_")
+        path = os.path.join(tmp, "loadgen.db")
+
+    session = FakeSession(args.api_latency)
+    bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    storage = SQLiteStorage(config.FSM_TTL, config.FSM_FLUSH_INTERVAL, config.FSM_FLUSH_BATCH, config.FSM_IDLE)
+    dp = Dispatcher(storage=storage)
+    limiter = ConcurrencyLimit(args.concurrency)
+    dp.update.outer_middleware(limiter)
+    handlers.register_handlers(dp)
+
+    users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    lag: list[float] = []
+    monitor = None
+    try:
+        await database.open_pool(path)
+        await database.setup_db()
+        await utils.warm_up_embeddings()
+        if args.tasks_per_user > 0:
+            started = time.perf_counter()
+            await prefill(users, args.tasks_per_user, rng)
+            print(f"Заполнено {len(users) * args.tasks_per_user} задач за {time.perf_counter() - started:.1f} с")
+        storage.start()
+
+        gen = LoadGen(dp, bot, parse_mix(args.mix), args.think, args.seed)
+        monitor = asyncio.create_task(monitor_lag(lag))
+        started = time.perf_counter()
+        await asyncio.gather(*(gen.user(user_id, started + args.duration) for user_id in users))
+        elapsed = time.perf_counter() - started
+    finally:
+        if monitor is not None:
+            monitor.cancel()
+        await storage.close()
+        utils.shutdown_embeddings()
+        await database.close_pool()
+        await bot.session.close()
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "users": args.users,
+        "elapsed": elapsed,
+        "updates": gen.updates,
+        "throughput": gen.updates / elapsed,
+        "errors": sum(gen.errors.values()),
+        "api_calls": dict(session.calls),
+        "commands": {
+            name: {**percentiles(samples), "errors": gen.errors[name]}
+            for name, samples in sorted(gen.latency.items())
+        },
+        "loop_lag": percentiles(lag or [0.0]),
+        "peak_rss_mb": peak_rss_mb(),
+        "limiter": limiter.stats(),
+        "fsm": storage.stats(),
+        "task_cache": task_cache.stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="имитируемых пользователей")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность нагрузки, секунды")
+    parser.add_argument("--think", type=float, default=2.0, help="средняя пауза пользователя между командами, секунды")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса команд: add, today, week, list, done, search")
+    parser.add_argument("--concurrency", type=int, default=config.UPDATE_CONCURRENCY,
+                        help="одновременно обрабатываемых апдейтов")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка ответа поддельного API, секунды")
+    parser.add_argument("--tasks-per-user", type=int, default=10, help="задач на пользователя до начала нагрузки")
+    parser.add_argument("--db", help="файл БД (по умолчанию временный)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", metavar="PATH", help="сохранить отчёт в JSON для сравнения прогонов")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nОтчёт сохранён в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Отправка записанных апдейтов Telegram на локальный вебхук бота
+(RUN_MODE=webhook) - проверка режима webhook без Telegram.
+
+Файл апдейтов: JSON Lines (апдейт на строку), JSON-массив или ответ
+getUpdates целиком ({"ok": true, "result": [...]}), например:
+    curl "https://api.telegram.org/bot$TELEGRAM_BOT_TOKEN/getUpdates" > updates.json
+
+Пример:
+    python tools/replay_updates.py updates.json --concurrency 20 --repeat 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+import aiohttp
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSON Lines: несколько документов подряд
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, list):
+        return data
+    return data["result"] if "result" in data else [data]
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def replay(args: argparse.Namespace) -> None:
+    updates = load_updates(args.file) * args.repeat
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    statuses: Counter = Counter()
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(session: aiohttp.ClientSession, update: dict) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(args.url, json=update, headers=headers) as resp:
+                    await resp.read()
+                    statuses[resp.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(send(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    print(f"Отправлено апдейтов: {len(updates)} за {elapsed:.2f} с ({len(updates) / elapsed:.1f} в секунду)")
+    print("Ответы:", ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    if latencies:
+        print(
+            f"Задержка ответа, мс: p50 {percentile(latencies, 0.5) * 1000:.1f}, "
+            f"p95 {percentile(latencies, 0.95) * 1000:.1f}, max {max(latencies) * 1000:.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="файл с записанными апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""), help="по умолчанию WEBHOOK_SECRET")
+    parser.add_argument("--concurrency", type=int, default=10, help="одновременных запросов")
+    parser.add_argument("--repeat", type=int, default=1, help="сколько раз повторить файл")
+    asyncio.run(replay(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()